@@ -77,6 +77,12 @@ execGroup.add_argument("--description", dest="description",
                      help="Provide a brief title/description to be included in the log for this test")
 execGroup.add_argument("-e", "--executor", dest="executor",
                      help="Use the specified execution STRATEGY module", metavar="STRATEGY")
+execGroup.add_argument("--max-workers", dest="max_workers", default=None,
+                     help="Maximum number of sections the parallel executor, or of combinations the combinatorial executor, runs concurrently", metavar="N")
+execGroup.add_argument("--covering-array", dest="covering_array", default=None,
+                     help="Have the combinatorial executor only execute enough combinations to cover every T-way combination of option values", metavar="T")
+execGroup.add_argument("--pairwise", dest="covering_array", action="store_const", const="2",
+                     help="Same as --covering-array 2 - cover every pair of option values")
 execGroup.add_argument("--base-dir", dest="basedir",
                      help="Specify the DIRECTORY where we can find the TestDef class (checks DIRECTORY, DIRECTORY/Utilities, and DIRECTORY/pylib/Utilities locations) - also serves as default plugin-dir", metavar="DIRECTORY")
 execGroup.add_argument("--plugin-dir", dest="plugindir",
@@ -97,6 +103,14 @@ execGroup.add_argument("--timestamp", dest="time",
 execGroup.add_argument("--clean-start", dest="clean",
                      action="store_true",
                      help="Clean the scratch directory from past MTT invocations before running")
+execGroup.add_argument("--no-checkpoint", dest="checkpoint",
+                     action="store_false", default=True,
+                     help="Do not record each section as it completes - by default they are, so that an interrupted run can be resumed with --resume")
+execGroup.add_argument("--resume", dest="resume",
+                     action="store_true", default=False,
+                     help="Resume an interrupted run, skipping the sections that completed successfully and whose options and dependencies are unchanged - the sections go on being recorded even with --no-checkpoint")
+execGroup.add_argument("--shard", dest="shard", default=None,
+                     help="Only execute shard I of N (counting from 1) of the tests of each test run section, so that a test suite can be split across MTT clients", metavar="I/N")
 execGroup.add_argument("-c", "--cleanup", dest="clean_after",
                      action="store_true",
                      help="Clean the scratch directory after a successful run")
@@ -108,6 +122,9 @@ execGroup.add_argument("-l", "--log", dest="logfile", default=None,
                      help="Log all output to FILE (defaults to stdout)", metavar="FILE")
 execGroup.add_argument("--group-results", dest="submit_group_results", default=True,
                      help="Report results from each test section as it is completed")
+execGroup.add_argument("--spill-output", dest="spill_output",
+                     action="store_true", default=None,
+                     help="Write the full stdout and stderr of each command to files in the scratch directory, only keeping their last lines in the log")
 execGroup.add_argument("--default-make-options", dest="default_make_options", default="-j10",
                      help="Default options when running the \"make\" command")
 execGroup.add_argument("--env-module-wrapper", dest="env_module_wrapper", default=None,
@@ -244,6 +261,14 @@ if not args.ini_files or not args.ini_files[0]:
 if args.section and args.skipsections:
     print("ERROR: Cannot both execute specific sections and specify sections to be skipped")
     sys.exit(1)
+if args.shard is not None:
+    try:
+        i,n = [int(x) for x in args.shard.split('/')]
+    except ValueError:
+        i,n = 0,0
+    if n < 1 or i < 1 or i > n:
+        print("ERROR: The shard must be given as I/N, with I between 1 and N")
+        sys.exit(1)
 
 # open the logging file if given - otherwise, we log
 # to stdout
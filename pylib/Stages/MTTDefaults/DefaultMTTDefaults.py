@@ -26,7 +26,10 @@ from MTTDefaultsMTTStage import *
 # @param merge_stdout_stderr   Merge stdout and stderr into one output stream
 # @param stdout_save_lines     Number of lines of stdout to save (-1 for unlimited)
 # @param stderr_save_lines     Number of lines of stderr to save (-1 for unlimited)
-# @param executor              Strategy to use: combinatorial or sequential executor
+# @param spill_output          Write the full stdout and stderr of each command to files in the scratch directory, only keeping their last lines in the log
+# @param executor              Strategy to use: combinatorial, parallel or sequential executor
+# @param max_workers           Maximum number of sections (parallel executor) or combinations (combinatorial executor) to run concurrently
+# @param covering_array        Have the combinatorial executor only cover every t-way combination of values, t being the given strength
 # @param time                  Record how long it takes to run each individual test
 # @}
 class DefaultMTTDefaults(MTTDefaultsMTTStage):
@@ -43,7 +46,10 @@ class DefaultMTTDefaults(MTTDefaultsMTTStage):
         self.options['merge_stdout_stderr'] = (False, "Merge stdout and stderr into one output stream")
         self.options['stdout_save_lines'] = (-1, "Number of lines of stdout to save (-1 for unlimited)")
         self.options['stderr_save_lines'] = (-1, "Number of lines of stderr to save (-1 for unlimited)")
-        self.options['executor'] = ('sequential', "Strategy to use: combinatorial or sequential executor")
+        self.options['spill_output'] = (False, "Write the full stdout and stderr of each command to files in the scratch directory, only keeping their last lines in the log")
+        self.options['executor'] = ('sequential', "Strategy to use: combinatorial, parallel or sequential executor")
+        self.options['max_workers'] = (None, "Maximum number of sections (parallel executor) or combinations (combinatorial executor) to run concurrently")
+        self.options['covering_array'] = (None, "Have the combinatorial executor only cover every t-way combination of values, t being the given strength")
         self.options['time'] = (True, "Record how long it takes to run each individual test")
         return
 
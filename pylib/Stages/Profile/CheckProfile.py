@@ -82,15 +82,15 @@ class CheckProfile(ProfileMTTStage):
         for key in keys:
             # diskSpace
             if key == 'diskSpace' and cmds[key] and key in opts:
-                for check in keyvals[key].split(","):
-                    testDef.logger.verbose_print("Checking: " + check)
-                    disk, op, pcent = check.split()
+                # the checks are independent, so query all disks at once
+                checks = [check.split() for check in keyvals[key].split(",")]
+                allresults = testDef.execmd.execute_many(cmds,
+                    [[self.diskSpaceCmd[0], self.diskSpaceCmd[1],
+                      self.diskSpaceCmd[2].replace("DISK", disk)] for disk, op, pcent in checks], testDef)
+                for (disk, op, pcent), results in zip(checks, allresults):
+                    testDef.logger.verbose_print("Checking: " + " ".join([disk, op, pcent]))
                     pcentNeeded = int(pcent.split('%')[0])
 
-                    cmd = self.diskSpaceCmd[2].replace("DISK", disk)
-                    results = testDef.execmd.execute(cmds,
-                        [self.diskSpaceCmd[0], self.diskSpaceCmd[1], cmd], testDef)
-
                     if 0 != results['status']:
                         log['status'] = results['status']
                         log['stdout'] = results['stdout']
@@ -114,19 +114,19 @@ class CheckProfile(ProfileMTTStage):
 
             # memory
             if key == 'memory' and cmds[key] and key in opts:
-                for check in keyvals[key].split(","):
-                    testDef.logger.verbose_print("Checking: " + check)
-                    kind, op, gigs = check.split()
-                    gigsNeeded = float(gigs.split('G')[0])
-
+                checks = [check.split() for check in keyvals[key].split(",")]
+                memcmds = []
+                for kind, op, gigs in checks:
                     cmd = self.memoryTotalCmd[2]
                     if kind == 'free':
                         cmd = self.memoryFreeCmd[2]
                     if kind == 'used':
                         cmd = self.memoryUsedCmd[2]
-
-                    results = testDef.execmd.execute(cmds,
-                        [self.diskSpaceCmd[0], self.diskSpaceCmd[1], cmd], testDef)
+                    memcmds.append([self.diskSpaceCmd[0], self.diskSpaceCmd[1], cmd])
+                allresults = testDef.execmd.execute_many(cmds, memcmds, testDef)
+                for (kind, op, gigs), results in zip(checks, allresults):
+                    testDef.logger.verbose_print("Checking: " + " ".join([kind, op, gigs]))
+                    gigsNeeded = float(gigs.split('G')[0])
 
                     if 0 != results['status']:
                         log['status'] = results['status']
@@ -68,19 +68,20 @@ class DefaultProfile(ProfileMTTStage):
         # pass in a timeout option as not every system will support
         # every option
         myopts = {'timeout': 2}
-        for key in keys:
-            if key in self.options and cmds[key]:
-                results = testDef.execmd.execute(myopts, self.options[key][2], testDef)
-                if 'timedout' in results:
-                    # we just ignore it
-                    continue
-                if 0 != results['status']:
-                    log['status'] = results['status']
-                    log['stdout'] = results['stdout']
-                    log['stderr'] = results['stderr']
-                    # ignore the execution time, if collected
-                    return
-                myLog[key] = results['stdout']
+        # the commands are independent, so execute them all at once
+        keys = [key for key in keys if key in self.options and cmds[key]]
+        allresults = testDef.execmd.execute_many(myopts, [self.options[key][2] for key in keys], testDef)
+        for key,results in zip(keys, allresults):
+            if 'timedout' in results:
+                # we just ignore it
+                continue
+            if 0 != results['status']:
+                log['status'] = results['status']
+                log['stdout'] = results['stdout']
+                log['stderr'] = results['stderr']
+                # ignore the execution time, if collected
+                return
+            myLog[key] = results['stdout']
         # add our log to the system log
         log['profile'] = myLog
         log['status'] = 0
@@ -62,6 +62,8 @@ class IUDatabase(ReporterMTTStage):
         self.options['debug_screen'] = (False, "Print debug output to screen")
         self.options['dryrun'] = (False, "Print debug without actually submitting to database server")
         self.cmds = {}
+        self._merged = {}
+        self._first = {}
 
     def activate(self):
         # get the automatic procedure from IPlugin
@@ -83,6 +85,10 @@ class IUDatabase(ReporterMTTStage):
         return
 
     def execute(self, log, keyvals, testDef):
+        # the log doesn't change while we report it, so values
+        # gathered across it are computed once per execution
+        self._merged = {}
+        self._first = {}
         # parse the provided keyvals against our options
         testDef.parseOptions(log, self.options, keyvals, self.cmds)
         if self.cmds['dryrun']:
@@ -183,10 +189,8 @@ class IUDatabase(ReporterMTTStage):
         #
         # Process the test run sections
         #
-        for lg in fullLog:
-            # Find sections prefixed with 'TestRun'
-            if re.match("TestRun", lg['section']):
-                rtn = self._submit_test_run(testDef.logger, lg, metadata, s, url, testDef, www_auth)
+        for lg in testDef.logger.getStageLogs("TestRun"):
+            rtn = self._submit_test_run(testDef.logger, lg, metadata, s, url, testDef, www_auth)
 
         log['status'] = 0
         return
@@ -311,6 +315,10 @@ class IUDatabase(ReporterMTTStage):
                 # if the test result wasn't provided, then this
                 # is an error and the data must be rejected
                 return None
+            # the server has no category for stalled tests
+            stalled = data['test_result'] == testDef.MTT_TEST_STALLED
+            if stalled:
+                data['test_result'] = testDef.MTT_TEST_TIMED_OUT
 
             if data['test_result'] == testDef.MTT_TEST_PASSED:
                 data['result_message'] = "Success"
@@ -335,7 +343,7 @@ class IUDatabase(ReporterMTTStage):
             elif data['test_result'] == testDef.MTT_TEST_SKIPPED:
                 data['result_message'] = "Skipped"
             elif data['test_result'] == testDef.MTT_TEST_TIMED_OUT:
-                data['result_message'] = "Timed Out"
+                data['result_message'] = "Stalled" if stalled else "Timed Out"
                 if 'stderr' in lg:
                     if type(lg['stderr']) is list:
                         lgerr = '\n'.join(lg['stderr'])
@@ -360,7 +368,10 @@ class IUDatabase(ReporterMTTStage):
             # data['exit_signal'] = None
 
             # data['resource_manager'] = None
-            # data['parameters'] = None
+            # identify the shard of the tests this client ran so
+            # the results of all the shards can be merged
+            if 'shard' in lg:
+                data['parameters'] = "shard=" + lg['shard']
             # data['network'] = None
 
             # data['latency_bandwidth'] = None
@@ -375,18 +386,12 @@ class IUDatabase(ReporterMTTStage):
             # data['description'] = None
             data['description'] = self._extract_param(logger, 'MTTDefaults', 'description')
             # data['environment'] = None
-            environment = {}
-            for lgentry in logger.getLog(None):
-                if 'environ' in lgentry:
-                    environment.update(lgentry['environ'])
+            environment = self._merge_logs(logger, 'environ')
             data['environment'] = "\n".join([str(k) + "=" + str(v) for k,v in environment.items()])
 
 
             # BIOS table
-            bios = {}
-            for lgentry in logger.getLog(None):
-                if 'bios' in lgentry:
-                    bios.update(lgentry['bios'])
+            bios = self._merge_logs(logger, 'bios')
             try:
                 data['bios_nodelist'] = bios['nodelist']
                 data['bios_params'] = bios['params']
@@ -395,10 +400,7 @@ class IUDatabase(ReporterMTTStage):
                 pass
 
             # Firmware table (TODO: may want to grab whole cfg file)
-            firmware = {}
-            for lgentry in logger.getLog(None):
-                if 'firmware' in lgentry:
-                    firmware.update(lgentry['firmware'])
+            firmware = self._merge_logs(logger, 'firmware')
             try:
                 data['flashupdt_cfg'] = firmware['flashupdt_cfg']
                 data['firmware_nodelist'] = firmware['nodelist']
@@ -406,10 +408,7 @@ class IUDatabase(ReporterMTTStage):
                 pass
 
             # Provision table
-            provisioning = {}
-            for lgentry in logger.getLog(None):
-                if 'provisioning' in lgentry:
-                    provisioning.update(lgentry['provisioning'])
+            provisioning = self._merge_logs(logger, 'provisioning')
             try:
                 data['targets'] = provisioning['target']
                 data['image'] = provisioning['image']
@@ -419,10 +418,7 @@ class IUDatabase(ReporterMTTStage):
                 pass
 
             # Harasser table
-            harasser = {}
-            for lgentry in logger.getLog(None):
-                if 'harasser' in lgentry:
-                    harasser.update(lgentry['harasser'])
+            harasser = self._merge_logs(logger, 'harasser')
             try:
                 data['harasser_seed'] = harasser['seed']
                 data['inject_script'] = harasser['inject_script']
@@ -441,15 +437,12 @@ class IUDatabase(ReporterMTTStage):
                 data['merge_stdout_stderr'] = None
 
             try:
-                data['result_stdout'] = '\n'.join(trun['stdout'] if trun['stdout'] is not None else "")
+                data['result_stdout'] = self.outputText(trun, 'stdout')
             except KeyError:
                 data['result_stdout'] = None
 
             try:
-                if type(trun['stderr']) is list:
-                    data['result_stderr'] = '\n'.join(trun['stderr'] if trun['stderr'] is not None else "")
-                else:
-                    data['result_stderr'] = (trun['stderr'] if trun['stderr'] is not None else "")
+                data['result_stderr'] = self.outputText(trun, 'stderr')
             except KeyError:
                 data['result_stderr'] = None
 
@@ -507,13 +500,11 @@ class IUDatabase(ReporterMTTStage):
 #            data['compiler_version'] = "\n".join(lg['compiler']['version'])
             data['compiler_version'] = lg['compiler']['version']
         except KeyError:
-            full_log = logger.getLog(None)
-            for entry in full_log:
-                if 'compiler' in entry:
-                    data['compiler_name'] = entry['compiler']['compiler']
-#                    data['compiler_version'] = "\n".join(entry['compiler']['version'])
-                    data['compiler_version'] = entry['compiler']['version']
-                    break
+            entry = self._first_log_with(logger, 'compiler')
+            if entry is not None:
+                data['compiler_name'] = entry['compiler']['compiler']
+#                data['compiler_version'] = "\n".join(entry['compiler']['version'])
+                data['compiler_version'] = entry['compiler']['version']
             else:
                 data['compiler_name'] = None
                 data['compiler_version'] = None
@@ -581,10 +572,7 @@ class IUDatabase(ReporterMTTStage):
         #data['description'] = None
         data['description'] = self._extract_param(logger, 'MTTDefaults', 'description')
         #data['environment'] = None
-        environment = {}
-        for lgentry in logger.getLog(None):
-            if 'environ' in lgentry:
-                environment.update(lgentry['environ'])
+        environment = self._merge_logs(logger, 'environ')
         data['environment'] = "\n".join([str(k) + "=" + str(v) for k,v in environment.items()])
 
         try:
@@ -596,15 +584,12 @@ class IUDatabase(ReporterMTTStage):
             data['merge_stdout_stderr'] = None
 
         try:
-            data['result_stdout'] = '\n'.join(lg['stdout'])
+            data['result_stdout'] = self.outputText(lg, 'stdout')
         except KeyError:
             data['result_stdout'] = None
 
         try:
-            if type(lg['stderr']) is list:
-                data['result_stderr'] = '\n'.join(lg['stderr'])
-            else:
-                data['result_stderr'] = lg['stderr']
+            data['result_stderr'] = self.outputText(lg, 'stderr')
         except KeyError:
             data['result_stderr'] = None
 
@@ -685,13 +670,11 @@ class IUDatabase(ReporterMTTStage):
 #            data['compiler_version'] = "\n".join(lg['compiler']['version'])
             data['compiler_version'] = lg['compiler']['version']
         except KeyError:
-            full_log = logger.getLog(None)
-            for entry in full_log:
-                if 'compiler' in entry:
-                    data['compiler_name'] = entry['compiler']['compiler']
-#                    data['compiler_version'] = "\n".join(entry['compiler']['version'])
-                    data['compiler_version'] = entry['compiler']['version']
-                    break
+            entry = self._first_log_with(logger, 'compiler')
+            if entry is not None:
+                data['compiler_name'] = entry['compiler']['compiler']
+#                data['compiler_version'] = "\n".join(entry['compiler']['version'])
+                data['compiler_version'] = entry['compiler']['version']
             else:
                 data['compiler_name'] = None
                 data['compiler_version'] = None
@@ -700,12 +683,10 @@ class IUDatabase(ReporterMTTStage):
             data['mpi_name'] = lg['mpi_info']['name']
             data['mpi_version'] = lg['mpi_info']['version']
         except KeyError:
-            full_log = logger.getLog(None)
-            for entry in full_log:
-                if 'mpi_info' in entry:
-                    data['mpi_name'] = entry['mpi_info']['name']
-                    data['mpi_version'] = entry['mpi_info']['version']
-                    break
+            entry = self._first_log_with(logger, 'mpi_info')
+            if entry is not None:
+                data['mpi_name'] = entry['mpi_info']['name']
+                data['mpi_version'] = entry['mpi_info']['version']
             else:
                 data['mpi_name'] = 'Undef'
                 data['mpi_version'] = 'Undef'
@@ -780,10 +761,7 @@ class IUDatabase(ReporterMTTStage):
         #data['description'] = None
         data['description'] = self._extract_param(logger, 'MTTDefaults', 'description')
         #data['environment'] = None
-        environment = {}
-        for lgentry in logger.getLog(None):
-            if 'environ' in lgentry:
-                environment.update(lgentry['environ'])
+        environment = self._merge_logs(logger, 'environ')
         data['environment'] = "\n".join([str(k) + "=" + str(v) for k,v in environment.items()])
 
         try:
@@ -795,15 +773,12 @@ class IUDatabase(ReporterMTTStage):
             data['merge_stdout_stderr'] = None
 
         try:
-            data['result_stdout'] = '\n'.join(lg['stdout'])
+            data['result_stdout'] = self.outputText(lg, 'stdout')
         except KeyError:
             data['result_stdout'] = None
 
         try:
-            if type(lg['stderr']) is list:
-                data['result_stderr'] = '\n'.join(lg['stderr'])
-            else:
-                data['result_stderr'] = lg['stderr']
+            data['result_stderr'] = self.outputText(lg, 'stderr')
         except KeyError:
             data['result_stderr'] = None
 
@@ -860,6 +835,33 @@ class IUDatabase(ReporterMTTStage):
 
         return r.json()
 
+    def _merge_logs(self, logger, key):
+        # merge the given entry across the logs of all sections
+        try:
+            return self._merged[key]
+        except KeyError:
+            pass
+        merged = {}
+        for lgentry in logger.getLog(None):
+            if key in lgentry:
+                merged.update(lgentry[key])
+        self._merged[key] = merged
+        return merged
+
+    def _first_log_with(self, logger, key):
+        # find the first section log containing the given entry
+        try:
+            return self._first[key]
+        except KeyError:
+            pass
+        found = None
+        for lgentry in logger.getLog(None):
+            if key in lgentry:
+                found = lgentry
+                break
+        self._first[key] = found
+        return found
+
     def _extract_param(self, logger, section, parameter):
         found = logger.getLog(section)
         if found is None:
@@ -66,11 +66,11 @@ class JunitXML(ReporterMTTStage):
         time = 0
         for lg in fullLog:
             if 'stdout' in lg and lg['stdout'] is not None:
-                stdout = "\n".join(lg['stdout'])
+                stdout = self.outputText(lg, 'stdout')
             else:
                 stdout = None
             if 'stderr' in lg and lg['stderr'] is not None:
-                stderr = "\n".join(lg['stderr'])
+                stderr = self.outputText(lg, 'stderr')
             else:
                 stderr = None
             if 'time' in lg and lg['time'] is not None:
@@ -95,7 +95,11 @@ class JunitXML(ReporterMTTStage):
 
         # TODO:  Pull in the resource manager jobid.
         jobid = "job1"
-        ts = TestSuite(jobid, testCases)
+        # note which shard of the tests this client ran, if they were split
+        if testDef.options.get('shard'):
+            ts = TestSuite(jobid, testCases, properties={'shard': testDef.options['shard']})
+        else:
+            ts = TestSuite(jobid, testCases)
         print(TestSuite.to_xml_string([ts]), file=self.fh)
 
         if cmds['filename'] is not None:
@@ -10,6 +10,7 @@
 
 from __future__ import print_function
 from yapsy.IPlugin import IPlugin
+import mmap
 
 ## @addtogroup Stages
 # @{
@@ -25,3 +26,54 @@ class ReporterMTTStage(IPlugin):
 
     def ordering(self):
         return 600
+
+    # map the file the given output of a log was written to, if
+    # any - see the spill_output option of ExecuteCmd. Returns None
+    # if the output was not written to a file or the file is gone
+    def mapOutput(self, log, key):
+        try:
+            handle = log[key + '_file']
+            with open(handle['path'], 'rb') as f:
+                if 0 == handle['size']:
+                    return b''
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (KeyError, TypeError, IOError, OSError, ValueError):
+            return None
+
+    # return the given output of a log as a single string, reading
+    # the full output from its file if it was written to one. Raises
+    # KeyError if the log has no such output
+    def outputText(self, log, key):
+        m = self.mapOutput(log, key)
+        if m is not None:
+            try:
+                return m[:].decode('utf-8', 'replace')
+            finally:
+                if not isinstance(m, bytes):
+                    m.close()
+        val = log[key]
+        if val is None:
+            return ""
+        if type(val) is list:
+            return '\n'.join(val)
+        return val
+
+    # return the given output of a log as lines. If it was written
+    # to a file, the lines are read from the file one at a time as
+    # they are consumed so the full output is never held in memory
+    def outputLines(self, log, key):
+        m = self.mapOutput(log, key)
+        if m is None:
+            return log[key]
+        if isinstance(m, bytes):
+            return []
+        return self._mappedLines(m)
+
+    def _mappedLines(self, m):
+        try:
+            line = m.readline()
+            while line:
+                yield line.decode('utf-8', 'replace').rstrip()
+                line = m.readline()
+        finally:
+            m.close()
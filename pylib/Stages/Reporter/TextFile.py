@@ -56,10 +56,16 @@ class TextFile(ReporterMTTStage):
         return
 
     def _print_stderr_block(self, name, lines, tabs=1):
-        if lines:
-            print("\t"*tabs,"ERROR ({name})".format(name=name), file=self.fh)
-            for l in lines:
-                print("\t"*(tabs),"   ",l, file=self.fh)
+        if not lines:
+            return
+        # the lines may be read from a file as they are printed, so
+        # only print the header once we know a line follows it
+        header = True
+        for l in lines:
+            if header:
+                print("\t"*tabs,"ERROR ({name})".format(name=name), file=self.fh)
+                header = False
+            print("\t"*(tabs),"   ",l, file=self.fh)
 
     def execute(self, log, keyvals, testDef):
         self.fh = sys.stdout
@@ -111,9 +117,9 @@ class TextFile(ReporterMTTStage):
 
                 if 0 != lg['status']:
                     if "stderr" in lg:
-                        self._print_stderr_block("stderr", lg['stderr'], tabs=1)
+                        self._print_stderr_block("stderr", self.outputLines(lg, 'stderr'), tabs=1)
                     if "stdout" in lg:
-                        self._print_stderr_block("stdout", lg['stdout'], tabs=1)
+                        self._print_stderr_block("stdout", self.outputLines(lg, 'stdout'), tabs=1)
                 else:
                     num_secs_pass += 1
                 try:
@@ -168,8 +174,14 @@ class TextFile(ReporterMTTStage):
                         ntime = str(lg['numTimed'])
                     except:
                         ntime = "N/A"
+                    try:
+                        nstall = str(lg['numStalled'])
+                    except:
+                        nstall = "N/A"
 
-                    print("\n\tTests:",lg['numTests'],"Pass:",npass,"Skip:",nskip,"Fail:",nfail,"TimedOut:",ntime,"\n", file=self.fh)
+                    print("\n\tTests:",lg['numTests'],"Pass:",npass,"Skip:",nskip,"Fail:",nfail,"TimedOut:",ntime,"Stalled:",nstall,"\n", file=self.fh)
+                    if 'shard' in lg:
+                        print("\tShard:",lg['shard'],"\n", file=self.fh)
             except KeyError:
                 pass
             try:
@@ -183,6 +195,8 @@ class TextFile(ReporterMTTStage):
                                 st = "FAILED"
                             elif test['result'] == testDef.MTT_TEST_TIMED_OUT:
                                 st = "TIMED OUT"
+                            elif test['result'] == testDef.MTT_TEST_STALLED:
+                                st = "STALLED"
                             elif test['result'] == testDef.MTT_TEST_SKIPPED:
                                 st = "SKIPPED"
                             else:
@@ -192,9 +206,9 @@ class TextFile(ReporterMTTStage):
                         print("\t\t",tname,"  Status:",test['status'], "Category:",st, file=self.fh)
                         if 0 != test['status']:
                             if "stderr" in test:
-                                self._print_stderr_block("stderr", test['stderr'], tabs=3)
+                                self._print_stderr_block("stderr", self.outputLines(test, 'stderr'), tabs=3)
                             if "stdout" in test:
-                                self._print_stderr_block("stdout", test['stdout'], tabs=3)
+                                self._print_stderr_block("stdout", self.outputLines(test, 'stdout'), tabs=3)
             except KeyError:
                 pass
             print(file=self.fh)
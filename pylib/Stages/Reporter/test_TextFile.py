@@ -0,0 +1,44 @@
+# run this via pytest
+# export MTT_HOME=/path/to/mtt
+# pytest ./test_TextFile.py
+#   add the -s argument to display print lines
+#   add the -v argument to be verbose
+# ie  pytest -sv ./test_TextFile.py
+import pytest
+import os
+import sys
+import io
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/Stages/Reporter"))
+import TextFile as TF
+
+def reporter():
+   r = TF.TextFile()
+   r.fh = io.StringIO()
+   return r
+
+def spilled(tmpdir, text):
+   path = os.path.join(str(tmpdir), "out")
+   with open(path, 'w') as f:
+      f.write(text)
+   return {'stderr': [], 'stderr_file': {'path': path, 'size': len(text), 'lines': text.count("\n")}}
+
+def test_noBlockForEmptySpilledOutput(tmpdir):
+   r = reporter()
+   log = spilled(tmpdir, "")
+   r._print_stderr_block("stderr", r.outputLines(log, 'stderr'))
+   assert r.fh.getvalue() == ""
+
+def test_blockForSpilledOutput(tmpdir):
+   r = reporter()
+   log = spilled(tmpdir, "first\nsecond\n")
+   r._print_stderr_block("stderr", r.outputLines(log, 'stderr'))
+   out = r.fh.getvalue().splitlines()
+   assert "ERROR (stderr)" in out[0]
+   assert out[1].split() == ['first'] and out[2].split() == ['second']
+
+def test_noBlockForEmptyLines():
+   r = reporter()
+   r._print_stderr_block("stdout", [])
+   r._print_stderr_block("stdout", None)
+   r._print_stderr_block("stdout", iter([]))
+   assert r.fh.getvalue() == ""
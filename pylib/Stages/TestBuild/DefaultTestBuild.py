@@ -136,11 +136,7 @@ class DefaultTestBuild(TestBuildMTTStage):
         except KeyError:
             pass
         # use the Autotools plugin to execute the build
-        plugin = None
-        for pluginInfo in testDef.tools.getPluginsOfCategory("Build"):
-            if "Autotools" == pluginInfo.plugin_object.print_name():
-                plugin = pluginInfo.plugin_object
-                break
+        plugin = testDef.findPlugin("Autotools", "tool", "Build")[0]
         if plugin is None:
             log['status'] = 1
             log['stderr'] = "Autotools plugin not found"
@@ -121,6 +121,12 @@ class PMIxUnit(TestRunMTTStage):
         testDef.parseOptions(log, self.options, mykeyvals, cmds)
         self.cmds = cmds
 
+        # only run the tests of our shard if the tests are
+        # split across clients
+        if testDef.options.get('shard'):
+            log['shard'] = testDef.options['shard']
+            tests = testDef.shardTests(tests)
+
         # must be executing a test of some kind - the install stage
         # must be specified so we can find the tests to be run
         try:
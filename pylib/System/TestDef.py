@@ -73,8 +73,19 @@ class TestDef(object):
         self.stages = None
         self.tools = None
         self.utilities = None
+        # index of the loaded plugins - for each kind of plugin
+        # ("stage", "tool" or "utility"), map the plugin name to
+        # the categories providing it and the plugins in each category
+        self.registry = None
         self.defaults = None
         self.log = {}
+        # track what has already been written to the hidden ENV
+        # and LOG sections so they can be updated incrementally
+        self.env_filled = {}
+        self.log_results = None
+        self.log_filled = 0
+        self.log_digests = []
+        self.log_referenced = None
         self.watchdog = None
         self.plugin_trans_sem = Semaphore()
         # provide a signature to differentiate this MTT execution
@@ -90,6 +101,9 @@ class TestDef(object):
         self.MTT_TEST_SKIPPED            =   2
         self.MTT_TEST_TIMED_OUT          =   3
         self.MTT_TEST_TIMED_OUT_OR_FAIL  =   4
+        # a test killed for producing no output within its idle
+        # timeout - the server knows it as having timed out
+        self.MTT_TEST_STALLED            =   5
 
 
     def setOptions(self, args):
@@ -330,31 +344,25 @@ class TestDef(object):
         # Load all the utility plugins
         self.utilities.collectPlugins()
 
+        # index the plugins by name so we don't have to search
+        # thru every category each time we need one
+        self.registerPlugins()
+
         # since we use these all over the place, find the
         # ExecuteCmd and ModuleCmd plugins and record them
-        availUtil = list(self.loader.utilities.keys())
-        for util in availUtil:
-            for pluginInfo in self.utilities.getPluginsOfCategory(util):
-                if "ExecuteCmd" == pluginInfo.plugin_object.print_name():
-                    self.execmd = pluginInfo.plugin_object
-                elif "ModuleCmd" == pluginInfo.plugin_object.print_name():
-                    self.modcmd = pluginInfo.plugin_object
-                    # initialize this module
-                    self.modcmd.setCommand(self.options)
-                elif "Watchdog" == pluginInfo.plugin_object.print_name():
-                    self.watchdog = pluginInfo.plugin_object
-                if self.execmd is not None and self.modcmd is not None and self.watchdog is not None:
-                    break
+        self.execmd = self.selectPlugin("ExecuteCmd", "utility")
+        self.modcmd = self.selectPlugin("ModuleCmd", "utility")
+        if self.modcmd is not None:
+            # initialize this module
+            self.modcmd.setCommand(self.options)
+        self.watchdog = self.selectPlugin("Watchdog", "utility")
         if self.execmd is None:
             print("ExecuteCmd plugin was not found")
             print("This is a basic capability required")
             print("for MTT operations - cannot continue")
             sys.exit(1)
         # Configure harasser plugin
-        for pluginInfo in self.tools.getPluginsOfCategory("Harasser"):
-            if "Harasser" == pluginInfo.plugin_object.print_name():
-                self.harasser = pluginInfo.plugin_object
-                break
+        self.harasser = self.findPlugin("Harasser", "tool", "Harasser")[0]
         if self.harasser is None:
             print("Harasser plugin was not found")
             print("This is required for all TestRun plugins")
@@ -362,13 +370,51 @@ class TestDef(object):
             sys.exit(1)
         # similarly, capture the highest priority defaults stage here
         pri = -1
-        for pluginInfo in self.stages.getPluginsOfCategory("MTTDefaults"):
-            if pri < pluginInfo.plugin_object.priority():
-                self.defaults = pluginInfo.plugin_object
-                pri = pluginInfo.plugin_object.priority()
+        for plugin in self.pluginsOfCategory("stage", "MTTDefaults"):
+            if pri < plugin.priority():
+                self.defaults = plugin
+                pri = plugin.priority()
 
         return
 
+    # build the registry of loaded plugins. This is done once
+    # when the plugins are loaded so that looking up a plugin
+    # by name doesn't require scanning every category
+    def registerPlugins(self):
+        self.registry = {}
+        for kind, manager, categories in [("stage", self.stages, self.loader.stages),
+                                          ("tool", self.tools, self.loader.tools),
+                                          ("utility", self.utilities, self.loader.utilities)]:
+            byName = {}
+            byCategory = {}
+            for category in list(categories.keys()):
+                byCategory[category] = []
+                for pluginInfo in manager.getPluginsOfCategory(category):
+                    plugin = pluginInfo.plugin_object
+                    byCategory[category].append(plugin)
+                    byName.setdefault(plugin.print_name(), []).append((category, plugin))
+            self.registry[kind] = {'names': byName, 'categories': byCategory}
+
+    # find the plugin of the given kind ("stage", "tool" or
+    # "utility") with the given name. If a category is given, the
+    # plugin must belong to it - otherwise, the first category
+    # providing a plugin of that name is used. Returns the plugin
+    # and its category, or (None, None) if no match was found
+    def findPlugin(self, name, kind, category=None):
+        try:
+            candidates = self.registry[kind]['names'][name]
+        except KeyError:
+            return None, None
+        for cat, plugin in candidates:
+            if category is None or category == cat:
+                return plugin, cat
+        return None, None
+
+    # return the list of plugins of the given kind in the
+    # given category - raises KeyError if the category is unknown
+    def pluginsOfCategory(self, kind, category):
+        return self.registry[kind]['categories'][category]
+
     def printInfo(self):
         # Print the available MTT sections out, if requested
         if self.options['listsections']:
@@ -389,8 +435,8 @@ class TestDef(object):
             for section in sections:
                 print(section + ":")
                 try:
-                    for pluginInfo in self.stages.getPluginsOfCategory(section):
-                        print("    " + pluginInfo.plugin_object.print_name())
+                    for plugin in self.pluginsOfCategory("stage", section):
+                        print("    " + plugin.print_name())
                 except KeyError:
                     print("    Invalid stage name " + section)
                 print()
@@ -407,9 +453,9 @@ class TestDef(object):
             for section in sections:
                 print(section + ":")
                 try:
-                    for pluginInfo in self.stages.getPluginsOfCategory(section):
-                        print("    " + pluginInfo.plugin_object.print_name() + ":")
-                        pluginInfo.plugin_object.print_options(self, "        ")
+                    for plugin in self.pluginsOfCategory("stage", section):
+                        print("    " + plugin.print_name() + ":")
+                        plugin.print_options(self, "        ")
                 except KeyError:
                     print("    Invalid stage name " + section)
                 print()
@@ -435,8 +481,8 @@ class TestDef(object):
             for tool in availTools:
                 print(tool + ":")
                 try:
-                    for pluginInfo in self.tools.getPluginsOfCategory(tool):
-                        print("    " + pluginInfo.plugin_object.print_name())
+                    for plugin in self.pluginsOfCategory("tool", tool):
+                        print("    " + plugin.print_name())
                 except KeyError:
                     print("    Invalid tool type name",tool)
                 print()
@@ -453,9 +499,9 @@ class TestDef(object):
             for tool in availTools:
                 print(tool + ":")
                 try:
-                    for pluginInfo in self.tools.getPluginsOfCategory(tool):
-                        print("    " + pluginInfo.plugin_object.print_name() + ":")
-                        pluginInfo.plugin_object.print_options(self, "        ")
+                    for plugin in self.pluginsOfCategory("tool", tool):
+                        print("    " + plugin.print_name() + ":")
+                        plugin.print_options(self, "        ")
                 except KeyError:
                     print("    Invalid tool type name " + tool)
                 print()
@@ -481,8 +527,8 @@ class TestDef(object):
             for util in availUtils:
                 print(util + ":")
                 try:
-                    for pluginInfo in self.utilities.getPluginsOfCategory(util):
-                        print("    " + pluginInfo.plugin_object.print_name())
+                    for plugin in self.pluginsOfCategory("utility", util):
+                        print("    " + plugin.print_name())
                 except KeyError:
                     print("    Invalid utility type name")
                 print()
@@ -499,9 +545,9 @@ class TestDef(object):
             for util in availUtils:
                 print(util + ":")
                 try:
-                    for pluginInfo in self.utilities.getPluginsOfCategory(util):
-                        print("    " + pluginInfo.plugin_object.print_name() + ":")
-                        pluginInfo.plugin_object.print_options(self, "        ")
+                    for plugin in self.pluginsOfCategory("utility", util):
+                        print("    " + plugin.print_name() + ":")
+                        plugin.print_options(self, "        ")
                 except KeyError:
                     print("    Invalid utility type name " + util)
                 print()
@@ -510,9 +556,9 @@ class TestDef(object):
 
         # if they asked for the version info, print it and exit
         if self.options['version']:
-            for pluginInfo in self.tools.getPluginsOfCategory("Version"):
-                print("MTT Base:   " + pluginInfo.plugin_object.getVersion())
-                print("MTT Client: " + pluginInfo.plugin_object.getClientVersion())
+            for plugin in self.pluginsOfCategory("tool", "Version"):
+                print("MTT Base:   " + plugin.getVersion())
+                print("MTT Client: " + plugin.getClientVersion())
             sys.exit(0)
 
     def openLogger(self):
@@ -584,24 +630,76 @@ class TestDef(object):
 
     def fill_env_hidden_section(self):
         """fill ENV section with environment variables
+
+        Only variables that changed since the last call are written,
+        and variables that have since been unset are removed
         """
-        try:
-            self.config.add_section('ENV')
-        except configparser.DuplicateSectionError:
-            pass
+        if self.add_hidden_section('ENV'):
+            # the section is new, so everything must be written
+            self.env_filled = {}
         for k,v in os.environ.items():
-            self.config.set('ENV', k, v.replace("$","$$"))
+            if self.env_filled.get(k) != v:
+                self.config.set('ENV', k, v.replace("$","$$"))
+                self.env_filled[k] = v
+        for k in [k for k in self.env_filled if k not in os.environ]:
+            self.config.remove_option('ENV', k)
+            del self.env_filled[k]
 
     def fill_log_hidden_section(self):
         """Add LOG section filled with log results of stages
+
+        Only log entries added or changed since the last call are
+        written. As flattening the log can be expensive, the entries
+        are held back until the test description actually references
+        the LOG section
         """
-        try:
-            self.config.add_section('LOG')
-        except configparser.DuplicateSectionError:
-            pass
+        if self.add_hidden_section('LOG'):
+            # the section is new, so everything must be written and
+            # we have to find out if anyone uses it
+            self.log_filled = 0
+            self.log_referenced = None
         thefulllog = self.logger.getLog(None)
-        for e in thefulllog:
+        if thefulllog is not self.log_results or len(thefulllog) < self.log_filled:
+            # the log was reset - start over
+            self.log_results = thefulllog
+            self.log_filled = 0
+        if self.log_referenced is None:
+            self.log_referenced = False
+            for section in self.config.sections():
+                if section in ['ENV', 'LOG']:
+                    continue
+                for k,v in self.config.items(section, raw=True):
+                    if "LOG:" in v:
+                        self.log_referenced = True
+                        break
+                if self.log_referenced:
+                    break
+        if not self.log_referenced:
+            return
+        # stages may update an entry after logging it, so compare
+        # what was written against the current contents - anything
+        # from the first changed entry on is written again to keep
+        # later entries for the same section on top
+        digests = [repr(e) for e in thefulllog]
+        for i in range(self.log_filled):
+            if digests[i] != self.log_digests[i]:
+                self.log_filled = i
+                break
+        for e in thefulllog[self.log_filled:]:
             self.fill_log_interpolation(e['section'].replace(":","_"), e)
+        self.log_filled = len(thefulllog)
+        self.log_digests = digests
+
+    def add_hidden_section(self, name):
+        """Add the given hidden section if not already present
+
+        Returns True if the section had to be added
+        """
+        try:
+            self.config.add_section(name)
+        except configparser.DuplicateSectionError:
+            return False
+        return True
 
     def check_for_nondefined_env_variables(self):
         # Check for ENV input
@@ -736,8 +834,12 @@ class TestDef(object):
         # clear the configuration parser
         for section in self.config.sections():
             self.config.remove_section(section)
-        # read in the file
-        self.config.read(file)
+        # read in the file - the new test description may also be
+        # given directly as a dictionary of sections
+        if isinstance(file, dict):
+            self.config.read_dict(file)
+        else:
+            self.config.read(file)
         for section in self.config.sections():
             if section.startswith("SKIP") or section.startswith("skip"):
                 # users often want to temporarily ignore a section
@@ -750,6 +852,41 @@ class TestDef(object):
                 self.logger.verbose_print(self.config.items(section))
         return
 
+    # select the tests of our shard when the tests of each section are
+    # split across MTT clients. The tests are sorted first so that every
+    # client splits them alike. If the expected duration of the tests is
+    # given, they are dealt to the shards longest first so that each
+    # shard gets an equal share of the time - otherwise, in turn
+    def shardTests(self, tests, durations=None):
+        try:
+            shard = self.options['shard']
+        except KeyError:
+            shard = None
+        if not shard:
+            return tests
+        i,n = [int(x) for x in shard.split('/')]
+        ordered = sorted(set(tests))
+        if durations is None:
+            mine = set(ordered[i-1::n])
+        else:
+            # tests that never ran are taken to be of average length
+            known = [durations[t] for t in ordered if durations.get(t) is not None]
+            default = sum(known) / len(known) if known else 1.0
+            weights = {}
+            for t in ordered:
+                weights[t] = durations.get(t)
+                if weights[t] is None:
+                    weights[t] = default
+            loads = [0.0] * n
+            mine = set()
+            for t in sorted(ordered, key=lambda t: -weights[t]):
+                s = loads.index(min(loads))
+                loads[s] += weights[t]
+                if s == i - 1:
+                    mine.add(t)
+        # keep the tests in the order they were given
+        return [t for t in tests if t in mine]
+
     def executeTest(self, executor="sequential"):
         self.logger.print_cmdline_args(self)
 
@@ -857,39 +994,7 @@ class TestDef(object):
 
 
     def selectPlugin(self, name, category):
-        if category == "stage":
-            try:
-                availStages = list(self.loader.stages.keys())
-                for stage in availStages:
-                    for pluginInfo in self.stages.getPluginsOfCategory(stage):
-                        if name == pluginInfo.plugin_object.print_name():
-                            return pluginInfo.plugin_object
-                # didn't find it
-                return None
-            except:
-                return None
-        elif category == "tool":
-            try:
-                availTools = list(self.loader.tools.keys())
-                for tool in availTools:
-                    for pluginInfo in self.tools.getPluginsOfCategory(tool):
-                        if name == pluginInfo.plugin_object.print_name():
-                            return pluginInfo.plugin_object
-                # didn't find it
-                return None
-            except:
-                return None
-        elif category == "utility":
-            try:
-                availUtils = list(self.loader.utilities.keys())
-                for util in availUtils:
-                    for pluginInfo in self.utilities.getPluginsOfCategory(util):
-                        if name == pluginInfo.plugin_object.print_name():
-                            return pluginInfo.plugin_object
-                # didn't find it
-                return None
-            except:
-                return None
-        else:
+        if category not in ["stage", "tool", "utility"]:
             print("Unrecognized category:",category)
             return None
+        return self.findPlugin(name, category)[0]
@@ -177,3 +177,148 @@ def test_expandWildCardsMultipleStarsInARowNoGaps():
    assert 'Reporter:TextFile' in expsections
    print("--->expanded:", expsections) 
 
+
+class FakePlugin(object):
+   def __init__(self, name):
+      self.name = name
+   def print_name(self):
+      return self.name
+
+class FakeManager(object):
+   def __init__(self, plugins):
+      self.plugins = plugins
+   def getPluginsOfCategory(self, category):
+      return [type('Info', (object,), {'plugin_object': p}) for p in self.plugins[category]]
+
+class FakeLoader(object):
+   def __init__(self, stages, tools, utilities):
+      self.stages = stages
+      self.tools = tools
+      self.utilities = utilities
+
+def registry_setup():
+   td = setup()
+   shellBuild = FakePlugin("Shell")
+   shellRun = FakePlugin("Shell")
+   stages = {'TestBuild': [shellBuild], 'TestRun': [shellRun]}
+   tools = {'Build': [FakePlugin("Autotools"), FakePlugin("Shell")]}
+   utilities = {'ExecuteCmd': [FakePlugin("ExecuteCmd")]}
+   td.loader = FakeLoader(dict.fromkeys(stages), dict.fromkeys(tools), dict.fromkeys(utilities))
+   td.stages = FakeManager(stages)
+   td.tools = FakeManager(tools)
+   td.utilities = FakeManager(utilities)
+   td.registerPlugins()
+   return td, shellBuild, shellRun
+
+def test_findPluginInCategory():
+   td, shellBuild, shellRun = registry_setup()
+   assert td.findPlugin("Shell", "stage", "TestBuild") == (shellBuild, "TestBuild")
+   assert td.findPlugin("Shell", "stage", "TestRun") == (shellRun, "TestRun")
+   assert td.findPlugin("Shell", "stage", "MiddlewareGet") == (None, None)
+   assert td.findPlugin("Autotools", "tool")[1] == "Build"
+   assert td.findPlugin("Missing", "utility") == (None, None)
+
+def test_selectPlugin():
+   td, shellBuild, shellRun = registry_setup()
+   assert td.selectPlugin("ExecuteCmd", "utility").print_name() == "ExecuteCmd"
+   assert td.selectPlugin("ExecuteCmd", "tool") is None
+   assert td.selectPlugin("ExecuteCmd", "bogus") is None
+   assert [p.print_name() for p in td.pluginsOfCategory("tool", "Build")] == ["Autotools", "Shell"]
+
+class FakeLogger(object):
+   def __init__(self):
+      self.results = []
+   def getLog(self, key):
+      return self.results
+
+def test_fillEnvHiddenSectionIncremental():
+   td = setup()
+   os.environ['MTT_TEST_ENV_VAR'] = "first"
+   td.fill_env_hidden_section()
+   assert td.config.get('ENV', 'MTT_TEST_ENV_VAR') == "first"
+   os.environ['MTT_TEST_ENV_VAR'] = "second$"
+   td.fill_env_hidden_section()
+   assert td.config.get('ENV', 'MTT_TEST_ENV_VAR') == "second$"
+   del os.environ['MTT_TEST_ENV_VAR']
+
+def test_fillEnvHiddenSectionDropsUnset():
+   td = setup()
+   os.environ['MTT_TEST_ENV_VAR'] = "first"
+   td.fill_env_hidden_section()
+   del os.environ['MTT_TEST_ENV_VAR']
+   td.fill_env_hidden_section()
+   assert not td.config.has_option('ENV', 'MTT_TEST_ENV_VAR')
+   assert 'MTT_TEST_ENV_VAR' not in td.env_filled
+
+def test_fillLogHiddenSectionIncremental():
+   td = setup()
+   td.logger = FakeLogger()
+   td.config.add_section('TestRun:A')
+   td.config.set('TestRun:A', 'command', '${LOG:TestBuild_A.status}')
+   td.logger.results.append({'section': 'TestBuild:A', 'status': '0'})
+   td.fill_log_hidden_section()
+   assert td.config.get('TestRun:A', 'command') == '0'
+   td.logger.results.append({'section': 'TestBuild:B', 'status': '1'})
+   td.fill_log_hidden_section()
+   assert td.config.get('LOG', 'TestBuild_B.status') == '1'
+   assert td.log_filled == 2
+
+def test_fillLogHiddenSectionResyncsChangedEntry():
+   td = setup()
+   td.logger = FakeLogger()
+   td.config.add_section('TestRun:A')
+   td.config.set('TestRun:A', 'command', '${LOG:TestBuild_A.status}')
+   entry = {'section': 'TestBuild:A', 'status': '0'}
+   td.logger.results.append(entry)
+   td.logger.results.append({'section': 'TestBuild:B', 'status': '0'})
+   td.fill_log_hidden_section()
+   entry['status'] = '1'
+   td.fill_log_hidden_section()
+   assert td.config.get('TestRun:A', 'command') == '1'
+   assert td.config.get('LOG', 'TestBuild_B.status') == '0'
+   assert td.log_filled == 2
+
+def test_fillLogHiddenSectionUnreferenced():
+   td = setup()
+   td.logger = FakeLogger()
+   td.logger.results.append({'section': 'TestBuild:A', 'status': '0'})
+   td.fill_log_hidden_section()
+   assert not td.config.has_option('LOG', 'TestBuild_A.status')
+
+def shards(td, tests, n, durations=None):
+   result = []
+   for i in range(1, n + 1):
+      td.options['shard'] = "%d/%d" % (i, n)
+      result.append(td.shardTests(tests, durations))
+   return result
+
+def test_shardTestsPartitionByName():
+   td = setup()
+   tests = ["t%02d" % i for i in range(23)]
+   tests.reverse()
+   for n in [1, 2, 3, 5, 30]:
+      parts = shards(td, tests, n)
+      # every test is in exactly one shard
+      assert sorted(sum(parts, [])) == sorted(tests)
+      # and the shards keep the order the tests were given in
+      for part in parts:
+         assert part == [t for t in tests if t in part]
+   # the split does not depend on the order the tests were found in
+   assert shards(td, sorted(tests), 3) == [sorted(p) for p in shards(td, tests, 3)]
+
+def test_shardTestsPartitionByDuration():
+   td = setup()
+   tests = ["t%02d" % i for i in range(20)]
+   durations = dict((t, float(i)) for i, t in enumerate(tests))
+   # tests without a duration count as average
+   durations['t03'] = None
+   del durations['t07']
+   parts = shards(td, tests, 4, durations)
+   assert sorted(sum(parts, [])) == sorted(tests)
+   loads = [sum([durations.get(t) or 9.5 for t in part]) for part in parts]
+   assert max(loads) - min(loads) <= 19
+
+def test_shardTestsWithoutShard():
+   td = setup()
+   td.options['shard'] = None
+   assert td.shardTests(['b', 'a']) == ['b', 'a']
@@ -226,13 +226,7 @@ class Autotools(BuildMTTTool):
             return
 
         # sense and record the compiler being used
-        plugin = None
-        availUtil = list(testDef.loader.utilities.keys())
-        for util in availUtil:
-            for pluginInfo in testDef.utilities.getPluginsOfCategory(util):
-                if "Compilers" == pluginInfo.plugin_object.print_name():
-                    plugin = pluginInfo.plugin_object
-                    break
+        plugin = testDef.selectPlugin("Compilers", "utility")
         if plugin is None:
             log['compiler'] = {'status' : 1, 'family' : "unknown", 'version' : "unknown"}
         else:
@@ -249,13 +243,7 @@ class Autotools(BuildMTTTool):
             if 'mpi_info' in lg:
                 mpi_info_found = True
         if mpi_info_found is False:
-            plugin = None
-            availUtil = list(testDef.loader.utilities.keys())
-            for util in availUtil:
-                for pluginInfo in testDef.utilities.getPluginsOfCategory(util):
-                    if "MPIVersion" == pluginInfo.plugin_object.print_name():
-                        plugin = pluginInfo.plugin_object
-                        break
+            plugin = testDef.selectPlugin("MPIVersion", "utility")
             if plugin is None:
                 log['mpi_info'] = {'name' : 'unknown', 'version' : 'unknown'}
             else:
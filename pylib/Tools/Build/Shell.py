@@ -292,13 +292,7 @@ class Shell(BuildMTTTool):
             return
 
         # sense and record the compiler being used
-        plugin = None
-        availUtil = list(testDef.loader.utilities.keys())
-        for util in availUtil:
-            for pluginInfo in testDef.utilities.getPluginsOfCategory(util):
-                if "Compilers" == pluginInfo.plugin_object.print_name():
-                    plugin = pluginInfo.plugin_object
-                    break
+        plugin = testDef.selectPlugin("Compilers", "utility")
         if plugin is None:
             log['compiler'] = {'status' : 1, 'family' : "unknown", 'version' : "unknown"}
         else:
@@ -308,13 +302,7 @@ class Shell(BuildMTTTool):
 
         # Find MPI information for IUDatabase plugin
         if log['section'].startswith("TestBuild:") or log['section'].startswith("MiddlewareBuild:"):
-            plugin = None
-            availUtil = list(testDef.loader.utilities.keys())
-            for util in availUtil:
-                for pluginInfo in testDef.utilities.getPluginsOfCategory(util):
-                    if "MPIVersion" == pluginInfo.plugin_object.print_name():
-                        plugin = pluginInfo.plugin_object
-                        break
+            plugin = testDef.selectPlugin("MPIVersion", "utility")
             if plugin is None:
                 log['mpi_info'] = {'name' : 'unknown', 'version' : 'unknown'}
             else:
@@ -371,6 +359,9 @@ class Shell(BuildMTTTool):
                 log['status'] = results['status']
             log['stdout'] = results['stdout']
             log['stderr'] = results['stderr']
+            for key in ['stdout_file', 'stderr_file']:
+                if key in results:
+                    log[key] = results[key]
             log['result'] = testDef.MTT_TEST_FAILED
             try:
                 log['time'] = results['elapsed_secs']
@@ -379,12 +370,16 @@ class Shell(BuildMTTTool):
             return
         log['status'] = 0
         log['stdout'] = results['stdout']
+        if 'stdout_file' in results:
+            log['stdout_file'] = results['stdout_file']
         try:
             log['time'] = results['elapsed_secs']
         except:
             pass
         if cmds['fail_test'] == True:
             log['stderr'] = results['stderr']
+            if 'stderr_file' in results:
+                log['stderr_file'] = results['stderr_file']
         # record this location for any follow-on steps
         log['location'] = location
         log['result'] = testDef.MTT_TEST_PASSED
@@ -10,6 +10,19 @@
 
 from __future__ import print_function
 from yapsy.IPlugin import IPlugin
+import os
+import sys
+import re
+import select
+import json
+import pickle
+import hashlib
+import datetime
+
+try:
+    basestring
+except:
+    basestring = str
 
 ## @addtogroup Tools
 # @{
@@ -20,6 +33,471 @@ class ExecutorMTTTool(IPlugin):
     def __init__(self):
         # initialise parent class
         IPlugin.__init__(self)
+        # sections of these stages are checkpointed as they
+        # complete so an interrupted run can be resumed
+        self.checkpoint_stages = ['MiddlewareGet', 'MiddlewareBuild', 'TestGet', 'TestBuild', 'TestRun']
+        self.checkpoint = {}
+        self.checkpoint_file = None
+        # lines of output kept in the checkpoint of each section
+        self.checkpoint_lines = 100
     def print_name(self):
         print("Executor")
 
+    # check if the given section title belongs to the given stage
+    def matchesStage(self, title, step):
+        if ":" in title:
+            return step in title.split(":")[0]
+        return step in title
+
+    # return the list of (stage, title) pairs in the order
+    # in which they would be executed - i.e., stage by stage in
+    # the order given by LoadClasses.stageOrder, and in the order
+    # of appearance in the test description within each stage
+    def orderedSections(self, testDef):
+        order = []
+        actives = set(testDef.actives)
+        titles = [t for t in testDef.config.sections() if t in actives]
+        for step in testDef.loader.stageOrder:
+            for title in titles:
+                if self.matchesStage(title, step):
+                    order.append((step, title))
+        return order
+
+    # compile the test description into an ordered execution plan
+    # so that the stage x section scan and the plugin lookup are
+    # done once rather than on every pass thru the test description.
+    # Each entry records the stage and title of the section, whether
+    # it is a STOP or SKIP section, and the plugin that will execute
+    # it. Sections whose values don't use interpolation also carry
+    # their parameters - sections that reference ENV or LOG values
+    # must be re-read on each pass as those may change
+    def compilePlan(self, testDef):
+        plan = []
+        for step, title in self.orderedSections(testDef):
+            entry = {'step': step, 'title': title,
+                     'stop': "STOP" in title, 'skip': "SKIP" in title,
+                     'parameters': None, 'plugin': None}
+            plan.append(entry)
+            if entry['stop'] or entry['skip']:
+                continue
+            params = testDef.config.items(title, raw=True)
+            if any("$" in kv[1] for kv in params):
+                continue
+            entry['parameters'] = params
+            stage, stageLog, keyvals = self.setupSection(testDef, title, title, parameters=params)
+            entry['plugin'] = self.lookupPlugin(testDef, stage, keyvals)[0]
+        return plan
+
+    # extract the stage from the section title, setup the log
+    # for the section, and convert the key-value tuples provided
+    # in this section by the user into a dictionary for easier
+    # parsing. The parameters may be passed in if they were
+    # already read. Returns the stage, the log and the keyvals
+    def setupSection(self, testDef, title, disp_title, title_append="", parameters=None):
+        # extract the stage and stage name from the title
+        if ":" in title:
+            stage,name = title.split(':')
+            stage = stage.strip()
+        else:
+            stage = title
+        # setup the log
+        stageLog = {'section':disp_title}
+        # get the key-value tuples output by the configuration parser
+        if parameters is None:
+            parameters = testDef.config.items(title)
+        stageLog["parameters"] = list(parameters)
+        # Yes, we could do this automatically, but we instead do it
+        # manually so we can strip all the keys and values for easier
+        # parsing later
+        keyvals = {'section':disp_title.strip()}
+        for kv in stageLog["parameters"]:
+            keyvals[kv[0].strip()] = kv[1].strip()
+        if 'parent' in keyvals:
+            keyvals['parent'] = keyvals['parent'] + title_append
+        # if they included the "ASIS" qualifier, remove it
+        # from the stage name
+        if "ASIS" in stage:
+            # find the first non-space character
+            i = 4
+            while stage[i].isspace():
+                i = i + 1
+            stage = stage[i:]
+            stageLog['section'] = disp_title[i:].strip()
+            keyvals['section'] = disp_title[i:].strip()
+            keyvals['asis'] = True
+        return stage, stageLog, keyvals
+
+    # if this section has a parent, get the log for that section
+    # and check its status - if it didn't succeed, then we shall
+    # log this section as also having failed. Returns True if the
+    # section can proceed
+    def checkParent(self, testDef, disp_title, stageLog, keyvals):
+        try:
+            parent = keyvals['parent']
+        except KeyError:
+            return True
+        if parent is None:
+            return True
+        # get the log entry as it contains the status
+        bldlog = testDef.logger.getLog(parent)
+        if bldlog is None:
+            # couldn't find the parent's log - cannot continue
+            stageLog['status'] = 1
+            stageLog['stderr'] = ["Prior dependent step did not record a log"]
+            testDef.logger.logResults(disp_title, stageLog)
+            return False
+        try:
+            if bldlog['status'] != 0:
+                # the parent step failed, and so we
+                # cannot proceed here either
+                stageLog['status'] = bldlog['status']
+                stageLog['stderr'] = ["Prior dependent step failed - cannot proceed"]
+                testDef.logger.logResults(disp_title, stageLog)
+                return False
+        except KeyError:
+            # if it didn't report a status, we shouldn't rely on it
+            stageLog['status'] = 1
+            stageLog['stderr'] = ["Prior dependent step failed to provide a status"]
+            testDef.logger.logResults(disp_title, stageLog)
+            return False
+        return True
+
+    # find the plugin specified for this section. The stage plugins
+    # are searched first - if not found there, then it may not be a
+    # stage as sometimes a stage consists of executing a tool or
+    # utility, so check those too. If no plugin was given, use the
+    # default for the stage if one is available. Returns the plugin,
+    # plus the plugin manager and category that must be used to
+    # activate it - the manager is None if no activation is needed
+    def lookupPlugin(self, testDef, stage, keyvals):
+        try:
+            module = keyvals['plugin']
+        except KeyError:
+            # if they didn't specify a plugin, use the default if one
+            # is available and so designated
+            plugin = testDef.findPlugin("Default{0}".format(stage), "stage", stage)[0]
+            return plugin, None, None
+
+        # see if this plugin exists as a stage plugin
+        plugin = testDef.findPlugin(module, "stage", stage)[0]
+        if plugin is not None:
+            return plugin, testDef.stages, stage
+
+        # check the tools, noting that those are not stage-specific
+        plugin, tool = testDef.findPlugin(module, "tool")
+        if plugin is not None:
+            return plugin, testDef.tools, tool
+
+        # check the utilities
+        plugin = testDef.findPlugin(module, "utility")[0]
+        return plugin, None, None
+
+    # find the plugin specified for this section and activate it.
+    # Returns None if no plugin could be found, with the error logged
+    def resolvePlugin(self, testDef, disp_title, stage, stageLog, keyvals):
+        plugin, manager, category = self.lookupPlugin(testDef, stage, keyvals)
+        if plugin is not None:
+            if manager is not None:
+                # activate the specified plugin
+                manager.activatePluginByName(keyvals['plugin'], category)
+            return plugin
+
+        stageLog['status'] = 1
+        if 'plugin' not in keyvals:
+            # we really have no way of executing this
+            stageLog['stderr'] = "Plugin for stage",stage,"was not specified, and no default is available"
+        else:
+            stageLog['stderr'] = "Specified plugin",keyvals['plugin'],"does not exist in stage",stage,"or in the available tools and utilities"
+        testDef.logger.logResults(disp_title, stageLog)
+        return None
+
+    # refresh the hidden ENV and LOG sections so that any
+    # interpolation in this section picks up the latest values,
+    # and print the options for the section
+    def refreshSection(self, testDef, title, disp_title):
+        # Check for updated environment variables
+        testDef.fill_env_hidden_section()
+        # Check for updated log variables
+        testDef.fill_log_hidden_section()
+        # Print section options
+        testDef.logger.verbose_print("OPTIONS FOR SECTION: %s" % disp_title)
+        strs_to_print = testDef.logger.get_tuplelist_contents(testDef.config.items(title))
+        if strs_to_print:
+            for s in strs_to_print:
+                testDef.logger.verbose_print("  %s" % s)
+        else:
+            testDef.logger.verbose_print("  No options provided for section")
+
+    # make sure stdout and stderr are properly formatted, then
+    # log the results for the section and print its end
+    def finishSection(self, testDef, disp_title, stageLog):
+        if 'stdout' in stageLog and isinstance(stageLog['stdout'], basestring):
+            stageLog['stdout'] = stageLog['stdout'].split("\n")
+        if 'stderr' in stageLog and isinstance(stageLog['stderr'], basestring):
+            stageLog['stderr'] = stageLog['stderr'].split("\n")
+
+        # Log results for section
+        testDef.logger.logResults(disp_title, stageLog)
+
+        # Print end of section
+        testDef.logger.stage_end_print(disp_title, stageLog)
+        self.releaseUnclaimed(testDef, disp_title)
+
+    # let the launchers pass on, or release, a shared allocation kept
+    # for the given section - called once it is done, or found not to
+    # be executed, so that nothing is held for a section that never
+    # claims it
+    def releaseUnclaimed(self, testDef, disp_title):
+        try:
+            launchers = testDef.pluginsOfCategory("tool", "Launcher")
+        except (AttributeError, KeyError):
+            return
+        for plugin in launchers:
+            plugin.sectionDone(testDef, disp_title)
+
+    # return the names of the sections this section depends upon,
+    # as given by its parent, middleware and dependencies keys
+    def sectionDependencies(self, testDef, title):
+        deps = []
+        for key in ['parent', 'middleware', 'dependencies']:
+            try:
+                val = testDef.config.get(title, key)
+            except:
+                try:
+                    val = testDef.config.get(title, key, raw=True)
+                except:
+                    continue
+            if val is None:
+                continue
+            # might be comma-delimited, tab or space delimited
+            for d in re.split(",| |\t", val):
+                d = d.strip()
+                if d and d not in deps:
+                    deps.append(d)
+        return deps
+
+    # start the harasser if the user requested it on the cmd line
+    def startHarasser(self, testDef):
+        if testDef.options["harass_trigger_scripts"] is None:
+            return 0
+        stageLog = {'section':"DefaultHarasser"}
+        testDef.harasser.execute(stageLog,{"trigger_scripts": testDef.options["harass_trigger_scripts"],
+                              "stop_scripts": testDef.options["harass_stop_scripts"],
+                              "join_timeout": testDef.options["harass_join_timeout"]}, testDef)
+        testDef.logger.logResults("DefaultHarasser", stageLog)
+        return stageLog['status']
+
+    # deactivate every plugin that is currently active
+    def deactivatePlugins(self, testDef):
+        for p in testDef.stages.getAllPlugins() \
+               + testDef.tools.getAllPlugins() \
+               + testDef.utilities.getAllPlugins():
+            if p._getIsActivated():
+                p.plugin_object.deactivate()
+
+    # open the checkpoint file in the scratch directory. If we are
+    # to resume an earlier run, read the records it holds - each is
+    # the log of a section that completed, so later records for the
+    # same section supersede earlier ones, and a record cut short by
+    # the interruption ends the file. The surviving records are then
+    # written back so we can append to the file. Otherwise we start
+    # with an empty file. Every run is checkpointed unless told not
+    # to be, so any run can be resumed - resuming always checkpoints
+    def loadCheckpoint(self, testDef):
+        self.checkpoint = {}
+        self.checkpoint_file = None
+        try:
+            resume = testDef.options['resume']
+        except KeyError:
+            resume = False
+        try:
+            checkpoint = testDef.options['checkpoint']
+        except KeyError:
+            checkpoint = True
+        if not checkpoint and not resume:
+            return
+        self.checkpoint_file = os.path.join(testDef.options['scratchdir'], "checkpoint.pkl")
+        if resume:
+            try:
+                with open(self.checkpoint_file, 'rb') as f:
+                    while True:
+                        try:
+                            record = pickle.load(f)
+                        except Exception:
+                            break
+                        if record['key'] is None:
+                            self.checkpoint.pop(record['section'], None)
+                        else:
+                            self.checkpoint[record['section']] = record
+            except (IOError, OSError):
+                testDef.logger.verbose_print("No checkpoint found in " + testDef.options['scratchdir'] + " - starting from the beginning")
+        tmpfile = self.checkpoint_file + ".tmp"
+        with open(tmpfile, 'wb') as f:
+            for record in self.checkpoint.values():
+                pickle.dump(record, f, 2)
+        os.rename(tmpfile, self.checkpoint_file)
+
+    # compute the checkpoint key of a section from its resolved
+    # options and the records of the sections it depends upon, so
+    # that a change to either - including a dependency having been
+    # executed again - invalidates the checkpoint of the section
+    def checkpointKey(self, testDef, stageLog, keyvals):
+        deps = []
+        for key in ['parent', 'middleware', 'dependencies']:
+            try:
+                val = keyvals[key]
+            except KeyError:
+                continue
+            if not isinstance(val, basestring):
+                continue
+            for d in re.split(",| |\t", val):
+                d = d.strip()
+                if d:
+                    try:
+                        deps.append([d, self.checkpoint[d]['stamp']])
+                    except KeyError:
+                        deps.append([d, None])
+        data = json.dumps([stageLog['section'], sorted(stageLog['parameters']), deps])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    # if the checkpoint of a section is still valid, log its recorded
+    # results in place of executing it. A checkpoint is valid if the
+    # section succeeded, its key still matches, and any location it
+    # created still exists. Returns True if the section was restored
+    def restoreSection(self, testDef, disp_title, stageLog, key):
+        try:
+            record = self.checkpoint[stageLog['section']]
+        except KeyError:
+            return False
+        if record['key'] != key or record['log'].get('status') != 0:
+            return False
+        location = record['log'].get('location')
+        if isinstance(location, basestring) and not os.path.exists(location):
+            return False
+        testDef.logger.verbose_print("Restoring results for " + disp_title + " from checkpoint")
+        testDef.logger.logResults(disp_title, record['log'])
+        testDef.logger.stage_end_print(disp_title, record['log'])
+        return True
+
+    # copy the log of a section for its checkpoint, keeping only the
+    # last lines of its output and of the output of each of its tests
+    # so the checkpoint doesn't grow with the output of the run. Where
+    # lines were dropped, the kept output starts with a line saying so
+    # to let the restored log be told apart from the original
+    def checkpointLog(self, stageLog):
+        log = dict(stageLog)
+        for key in ['stdout', 'stderr']:
+            if isinstance(log.get(key), list) and len(log[key]) > self.checkpoint_lines:
+                dropped = len(log[key]) - self.checkpoint_lines
+                log[key] = ["[%d earlier lines were not kept in the checkpoint]" % dropped] + \
+                           log[key][-self.checkpoint_lines:]
+        if isinstance(log.get('testresults'), list):
+            log['testresults'] = [self.checkpointLog(t) if isinstance(t, dict) else t
+                                  for t in log['testresults']]
+        return log
+
+    # append the log of a completed section to the checkpoint file.
+    # Failed sections are recorded with no key so that any earlier
+    # checkpoint of the section is dropped when resuming
+    def saveCheckpoint(self, testDef, stageLog, key):
+        if self.checkpoint_file is None:
+            return
+        if stageLog.get('status') != 0:
+            record = {'section': stageLog['section'], 'key': None}
+            self.checkpoint.pop(stageLog['section'], None)
+        else:
+            record = {'section': stageLog['section'], 'key': key,
+                      'stamp': datetime.datetime.now().isoformat(), 'log': self.checkpointLog(stageLog)}
+            self.checkpoint[stageLog['section']] = record
+        try:
+            data = pickle.dumps(record, 2)
+        except Exception:
+            data = pickle.dumps(self.sanitize(record), 2)
+        with open(self.checkpoint_file, 'ab') as f:
+            f.write(data)
+
+    # fork a worker process to call func(*args) and pass the result
+    # back to us thru a pipe. The worker is placed in its own process
+    # group so it can be terminated along with anything it started.
+    # Returns the pid of the worker and the file descriptor from which
+    # its result is to be read - see pollWorkers
+    def forkWorker(self, testDef, func, *args):
+        # flush our output so the child doesn't repeat it
+        sys.stdout.flush()
+        testDef.logger.fh.flush()
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if 0 != pid:
+            os.close(wfd)
+            # set its group here too, so it can be signalled as a
+            # group even before it gets to do so itself
+            try:
+                os.setpgid(pid, pid)
+            except OSError:
+                pass
+            return pid, rfd
+        code = 1
+        try:
+            os.close(rfd)
+            os.setpgid(0, 0)
+            result = func(*args)
+            try:
+                data = pickle.dumps(result, 2)
+            except Exception:
+                data = pickle.dumps(self.sanitize(result), 2)
+            while data:
+                n = os.write(wfd, data)
+                data = data[n:]
+            code = 0
+        finally:
+            # nothing is left running for the sections of our parent
+            try:
+                for plugin in testDef.pluginsOfCategory("tool", "Launcher"):
+                    plugin.releaseKept(testDef)
+            except Exception:
+                pass
+            try:
+                sys.stdout.flush()
+                testDef.logger.fh.flush()
+            except:
+                pass
+            os._exit(code)
+
+    # wait for output from the given workers, a dictionary of
+    # pid -> {'fd': descriptor, 'data': []} plus whatever else the
+    # caller wishes to track. Completed workers are reaped and removed
+    # from the dictionary. Returns a list of (pid, worker, result)
+    # tuples for them, with the result being None if the worker
+    # failed to provide one
+    def pollWorkers(self, workers):
+        fds = {w['fd']:pid for pid,w in workers.items()}
+        ready = select.select(list(fds.keys()), [], [])[0]
+        completed = []
+        for fd in ready:
+            pid = fds[fd]
+            worker = workers[pid]
+            chunk = os.read(fd, 65536)
+            if chunk:
+                worker['data'].append(chunk)
+                continue
+            # the worker closed its end of the pipe, so it is done
+            os.close(fd)
+            os.waitpid(pid, 0)
+            del workers[pid]
+            try:
+                result = pickle.loads(b''.join(worker['data']))
+            except Exception:
+                result = None
+            completed.append((pid, worker, result))
+        return completed
+
+    # convert anything that cannot be pickled into a string
+    def sanitize(self, val):
+        if isinstance(val, dict):
+            return {k:self.sanitize(v) for k,v in val.items()}
+        if isinstance(val, (list, tuple)):
+            return [self.sanitize(v) for v in val]
+        if val is None or isinstance(val, (basestring, bool, int, float,
+                                           datetime.datetime, datetime.date)):
+            return val
+        return str(val)
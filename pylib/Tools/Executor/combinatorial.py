@@ -18,8 +18,9 @@ import importlib
 import logging
 import imp
 import datetime
-import tempfile
-import shutil
+import itertools
+import re
+from collections import OrderedDict
 from yapsy.PluginManager import PluginManager
 
 from ExecutorMTTTool import *
@@ -29,6 +30,8 @@ from ExecutorMTTTool import *
 # @addtogroup Executor
 # @section CombinatorialEx
 # Combinatorial execution executor
+# @param max_workers    Maximum number of combinations to execute concurrently (defaults to one at a time)
+# @param covering_array Only execute enough combinations to cover every t-way combination of values, t being the given strength
 # @}
 class CombinatorialEx(ExecutorMTTTool):
 
@@ -36,13 +39,11 @@ class CombinatorialEx(ExecutorMTTTool):
         # initialise parent class
         ExecutorMTTTool.__init__(self)
         self.options = {}
-        self.parser = configparser.ConfigParser()
-        self.parser.optionxform = str
-        # Create temp directory to hold .ini files
-        self.tempDir = tempfile.mkdtemp()
-        self.baseIniFile = None
-        self.runLog = {}
-        self.iniLog = {}
+        self.options['max_workers'] = (None, "Maximum number of combinations to execute concurrently (defaults to one at a time)")
+        self.options['covering_array'] = (None, "Only execute enough combinations to cover every t-way combination of values, t being the given strength")
+        # stages whose sections are executed only once for all
+        # combinations that resolve them identically
+        self.shared_stages = ['MiddlewareGet', 'MiddlewareBuild', 'TestGet', 'TestBuild']
 
     def activate(self):
         # use the automatic procedure from IPlugin
@@ -63,17 +64,20 @@ class CombinatorialEx(ExecutorMTTTool):
         return
 
 
-    # Create .ini files for each combination to be run
-    # BaseIniFile created by TestDef ConfigTest()
-    def createIniLog(self, testDef):
-        self.baseIniFile = testDef.config
-        tempSpecialSection = {}
-        # configParser object to write individual options to files
-        writeOption = configparser.ConfigParser()
-        writeOption.optionxform = str
-        # Sort base .ini sections and write to temp files 
-        for section in self.baseIniFile.sections():
-            if section == "ENV":
+    # Collect the sections of the base test description, sorted
+    # into the MiddlewareGet sections, the TestRun sections, and
+    # all others. Each is a list of (section, [(option, value)])
+    # tuples. Also return the (section, option, [values]) tuples
+    # of the options given as comma separated values, which are
+    # the axes to be combined. Only sections outside of MiddlewareGet
+    # and TestRun are searched for such options
+    def collectSections(self, testDef):
+        gets = []
+        runs = []
+        others = []
+        axes = []
+        for section in testDef.config.sections():
+            if section in ["ENV", "LOG"]:
                 continue
             if section.startswith("SKIP") or section.startswith("skip"):
                 # users often want to temporarily ignore a section
@@ -81,113 +85,304 @@ class CombinatorialEx(ExecutorMTTTool):
                 # remove it lest they forget what it did. So let
                 # them just mark the section as "skip" to be ignored
                 continue
-            self.parser.add_section(section)
-            for option in self.baseIniFile.options(section):
-                self.parser.set(section, option, self.baseIniFile.get(section, option))
-            # TODO: FIX Getting temp file in tmp dir that is not being removed
-            fd, fileName = tempfile.mkstemp(suffix=".ini", dir = self.tempDir)
-            with open(fileName, 'w') as configfile:
-                self.parser.write(configfile)
-            # Clear out parser for next section
-            self.parser.remove_section(section)
+            # resolve the values now - escape them so they are
+            # returned as-is when read back from the new test
+            values = [(option, testDef.config.get(section, option).replace("$", "$$"))
+                      for option in testDef.config.options(section)]
             if "MiddlewareGet" in section:
-                self.runLog[section] = fileName
+                gets.append((section, values))
             elif "TestRun" in section:
-                tempSpecialSection[section] = fileName
+                runs.append((section, values))
             else:
-                self.iniLog[section] = fileName
-        # Combine TestRun and MiddlewareGet files
-        tempList = {}
-        for section in self.runLog:
-            self.parser.read(self.runLog[section])
-            for id in tempSpecialSection:
-                self.parser.read(tempSpecialSection[id])
-                fd, fileName = tempfile.mkstemp(suffix = ".ini", dir = self.tempDir)
-                with open(fileName, 'w') as configfile:
-                    self.parser.write(configfile)
-                self.parser.remove_section(id)
-                tempList[fd] = fileName
-            self.parser.remove_section(section)
-        self.runLog.clear()
-        self.runLog = tempList
-        # Sort sections for comma separated values to be parsed
-        optionsCSV = {}
-        for section in self.iniLog:
-            writeOption.read(self.iniLog[section])
-            for option in writeOption.options(section):
-                if ',' in writeOption.get(section, option):
-                    try:
-                        if optionsCSV[section] is not None:
-                            pass
-                    except KeyError:
-                        optionsCSV[section] = []
-                    optionsCSV[section].append(option)
-                else:
-                    # write option to base run files
-                    for fd in self.runLog:
-                        # set up parser to write to each file
-                        self.parser.read(self.runLog[fd])
-                        if not self.parser.has_section(section):
-                            self.parser.add_section(section)
-                        self.parser.set(section, option, writeOption.get(section, option))
-                        # Want to overwrite file with new parser contents
-                        with open(self.runLog[fd], 'w') as configfile:
-                            self.parser.write(configfile)
-                        # clear parser for next file
-                        for sect in self.parser.sections():
-                            self.parser.remove_section(sect)       
-            writeOption.remove_section(section)
-        # Process CSV options
-        for section in optionsCSV:
-            self.parser.read(self.iniLog[section])
-            for option in optionsCSV[section]:
-                # Get clean list of CSV's
-                rawList = self.parser.get(section, option)
-                splitList = rawList.split(',')
-                optionList = []
-                for item in splitList:
-                    optionList.append(item.strip())
-                newList = {}
-                for fd in self.runLog:
-                    writeOption.read(self.runLog[fd])
-                    for nextOpt in optionList:
-                        try:
-                            if writeOption.has_section(section):
-                                pass
-                        except KeyError:
-                            writeOption.add_section(section)
-                        writeOption.set(section, option, nextOpt)
-                        fd, fileName = tempfile.mkstemp(suffix=".ini", dir = self.tempDir)
-                        with open(fileName, 'w') as configfile:
-                            writeOption.write(configfile)
-                        newList[fd] = fileName
-                    for sect in writeOption.sections():
-                        writeOption.remove_section(sect)
-                # Update runLog for next pass
-                self.runLog.clear()
-                self.runLog = newList
-            self.parser.remove_section(section)
+                others.append((section, values))
+                for option, value in values:
+                    if ',' in value:
+                        axes.append((section, option, [v.strip() for v in value.split(',')]))
+        return gets, runs, others, axes
+
+    # Generate the test description for each combination to be run,
+    # one at a time. Each combination consists of one MiddlewareGet
+    # section, one TestRun section, and all other sections with one
+    # value chosen for each comma separated option. The choices are
+    # given as tuples of indices into the gets, the runs and the
+    # values of each axis - by default, every possible combination
+    def combinations(self, gets, runs, others, axes, choices=None):
+        if choices is None:
+            choices = itertools.product(range(len(gets)), range(len(runs)),
+                                        *[range(len(axis[2])) for axis in axes])
+        for choice in choices:
+            chosen = {}
+            for axis, value in zip(axes, choice[2:]):
+                chosen[(axis[0], axis[1])] = axis[2][value]
+            config = OrderedDict()
+            for section, values in [gets[choice[0]], runs[choice[1]]] + others:
+                config[section] = OrderedDict()
+                for option, value in values:
+                    config[section][option] = chosen.get((section, option), value)
+            yield config
+
+    # build a covering array of the given strength - i.e., a set of
+    # rows, each choosing one value for every axis, such that every
+    # combination of values of any "strength" axes appears in at least
+    # one row. The axes are given by their number of values. The rows
+    # are built greedily: each row starts from the uncovered combination
+    # whose values appear most often among those still uncovered, and
+    # the value of each remaining axis is chosen to cover as many new
+    # combinations as possible
+    def coveringArray(self, sizes, strength):
+        naxes = len(sizes)
+        if strength < 1 or strength >= naxes:
+            return list(itertools.product(*[range(n) for n in sizes]))
+        uncovered = set()
+        for group in itertools.combinations(range(naxes), strength):
+            for values in itertools.product(*[range(sizes[a]) for a in group]):
+                uncovered.add((group, values))
+        rows = []
+        while uncovered:
+            # count the uncovered combinations each value appears in
+            potential = {}
+            for group, values in uncovered:
+                for a, v in zip(group, values):
+                    potential[(a, v)] = potential.get((a, v), 0) + 1
+            group, values = max(sorted(uncovered),
+                                key=lambda gv: sum(potential[(a, v)] for a, v in zip(gv[0], gv[1])))
+            row = [None] * naxes
+            for a, v in zip(group, values):
+                row[a] = v
+            # fill in the axes with the most values first
+            for a in sorted([a for a in range(naxes) if row[a] is None], key=lambda a: -sizes[a]):
+                best = None
+                for v in range(sizes[a]):
+                    row[a] = v
+                    count = 0
+                    for others in itertools.combinations([b for b in range(naxes) if b != a and row[b] is not None],
+                                                         strength - 1):
+                        grp = tuple(sorted(others + (a,)))
+                        if (grp, tuple(row[b] for b in grp)) in uncovered:
+                            count += 1
+                    score = (count, potential.get((a, v), 0))
+                    if best is None or score > best[0]:
+                        best = (score, v)
+                row[a] = best[1]
+            for grp in itertools.combinations(range(naxes), strength):
+                uncovered.discard((grp, tuple(row[b] for b in grp)))
+            rows.append(tuple(row))
+        return rows
+
+    # get the given setting from the cmd line or, as the MTTDefaults
+    # section has not yet been executed, from the test description
+    def setting(self, testDef, name):
+        try:
+            if testDef.options[name] is not None:
+                return testDef.options[name]
+        except KeyError:
+            pass
+        try:
+            return testDef.config.get('MTTDefaults', name)
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            return None
+
+    # check if the given section may be shared between combinations
+    def isShared(self, title):
+        if "ASIS" in title:
+            return False
+        for stage in self.shared_stages:
+            if self.matchesStage(title, stage):
+                return True
+        return False
+
+    # compute the key of each section of the given combination that
+    # may be shared with other combinations. The key covers the options
+    # of the section, the keys of the sections it depends upon, and
+    # the MTTDefaults options that apply to every section. Sections
+    # that only affect the test runs - e.g., LauncherDefaults - are
+    # left out, so sweeping np or ppn doesn't rebuild anything.
+    # Sections with equal keys are executed identically, and so need
+    # only be executed once
+    def sectionKeys(self, config):
+        common = tuple((section, tuple(values.items())) for section, values in config.items()
+                       if self.matchesStage(section, "MTTDefaults"))
+        keys = {}
+        def keyOf(title, visiting):
+            if title in keys:
+                return keys[title]
+            deps = []
+            for key in ['parent', 'middleware', 'dependencies']:
+                if key not in config[title]:
+                    continue
+                # might be comma-delimited, tab or space delimited
+                for d in re.split(",| |\t", config[title][key]):
+                    d = d.strip()
+                    if not d or d not in config or d in visiting:
+                        continue
+                    if self.isShared(d):
+                        deps.append(keyOf(d, visiting + [d]))
+                    else:
+                        # executed in every combination - only its
+                        # options can tell us if it will differ
+                        deps.append((d, tuple(config[d].items())))
+            keys[title] = (title, tuple(config[title].items()), tuple(deps), common)
+            return keys[title]
+        for title in config:
+            if self.isShared(title):
+                keyOf(title, [title])
+        return keys
+
+    # find the sections of the given combination whose results are
+    # in the cache. Returns the combination without those sections,
+    # plus the cached logs of the sections being reused
+    def reuseSections(self, testDef, config, keys, cache):
+        reused = []
+        for title, key in keys.items():
+            if title in cache and cache[title][0] == key:
+                testDef.logger.verbose_print("Reusing the results of section %s" % title)
+                reused.append(cache[title][1])
+        if not reused:
+            return config, reused
+        skip = [log['section'] for log in reused]
+        config = OrderedDict([(s, v) for s, v in config.items() if s not in skip])
+        return config, reused
+
+    # record the results of the shared sections that were executed.
+    # Only the latest successful execution of a section is kept, as a
+    # later execution with different options may have replaced its
+    # output - the section will then be executed again when needed
+    def recordSections(self, logs, keys, cache, reused):
+        skip = [log['section'] for log in reused]
+        for title, key in keys.items():
+            if title in skip:
+                continue
+            log = logs.get(title)
+            if log is not None and log.get('status') == 0:
+                cache[title] = (key, log)
+            else:
+                cache.pop(title, None)
+
+    # the body of a worker process - execute one combination in its
+    # own scratch directory, and return its status and result log
+    def runCombination(self, testDef, index, config, reused):
+        name = "combination%d" % index
+        testDef.options['scratchdir'] = os.path.join(self.scratchdir, name)
+        if not os.path.exists(testDef.options['scratchdir']):
+            os.makedirs(testDef.options['scratchdir'])
+        # keep only our own results, and don't let the
+        # workers write over each other's log file
+        testDef.logger.reset()
+        try:
+            if testDef.options['logfile'] is not None:
+                testDef.logger.fh = open(testDef.options['logfile'] + "." + name, 'w')
+        except KeyError:
+            pass
+        # the sections we reuse are part of our results too, and
+        # must be found by the sections depending upon them
+        for log in reused:
+            testDef.logger.addResult(log)
+        testDef.configNewTest(config)
+        status = testDef.executeTest()
+        testDef.logger.close()
+        return status, testDef.logger.getLog(None)
+
+    # execute the combinations on up to max_workers worker processes.
+    # The reporters are not executed by the workers - instead, the
+    # results of all combinations are merged into our log and the
+    # reporters executed once all the combinations are done
+    def executeConcurrently(self, testDef, combinations, max_workers):
+        status = 0
+        self.scratchdir = testDef.options['scratchdir']
+        workers = {}
+        results = {}
+        cache = {}
+        reporters = None
+        for index, config in enumerate(combinations):
+            if reporters is None:
+                # the reporters and the defaults they need
+                reporters = OrderedDict([(s, v) for s, v in config.items()
+                                         if s == "MTTDefaults" or self.matchesStage(s, "Reporter")])
+            config = OrderedDict([(s, v) for s, v in config.items() if not self.matchesStage(s, "Reporter")])
+            keys = self.sectionKeys(config)
+            # if a running combination is executing a section we can
+            # share, then wait for it rather than execute it again
+            while any(w['keys'].get(t) == k for w in workers.values() for t, k in keys.items()):
+                self.collectCombinations(workers, results, cache)
+            while len(workers) >= max_workers:
+                self.collectCombinations(workers, results, cache)
+            config, reused = self.reuseSections(testDef, config, keys, cache)
+            pid, fd = self.forkWorker(testDef, self.runCombination, testDef, index, config, reused)
+            workers[pid] = {'fd': fd, 'data': [], 'index': index, 'keys': keys, 'reused': reused}
+        while workers:
+            self.collectCombinations(workers, results, cache)
+        # merge the results in the order the combinations were generated
+        for index in sorted(results.keys()):
+            combination_status, log = results[index]
+            if combination_status != 0:
+                status = 1
+            testDef.logger.mergeResults(log)
+        if reporters:
+            testDef.configNewTest(reporters)
+            if testDef.executeTest() != 0:
+                status = 1
+        return status
+
+    # record the results of any workers that completed
+    def collectCombinations(self, workers, results, cache):
+        for pid, worker, result in self.pollWorkers(workers):
+            if result is None:
+                result = (1, [{'section': "combination%d" % worker['index'], 'status': 1,
+                               'stderr': ["Worker process exited without reporting results"]}])
+            results[worker['index']] = result
+            logs = {}
+            for log in result[1]:
+                logs.setdefault(log['section'], log)
+            self.recordSections(logs, worker['keys'], cache, worker['reused'])
 
     def execute(self, testDef):
         testDef.logger.verbose_print("ExecuteCombinatorial")
         status = 0
-        self.createIniLog(testDef)
+        # the base test description is replaced by each combination
+        # in turn, so capture its contents before we start
+        gets, runs, others, axes = self.collectSections(testDef)
+        if not gets or not runs:
+            print("Error, empty run log, combinatorial executor failed")
+            sys.exit(1)
         try:
-            if not self.runLog:
-                print("Error, empty run log, combinatorial executor failed")
+            max_workers = int(self.setting(testDef, 'max_workers'))
+        except (TypeError, ValueError):
+            max_workers = 1
+        # if requested, only execute enough combinations to cover
+        # every t-way combination of the choices
+        choices = None
+        strength = self.setting(testDef, 'covering_array')
+        if strength is not None:
+            try:
+                strength = int(strength)
+            except ValueError:
+                print("Covering array strength must be an integer:", strength)
                 sys.exit(1)
-            for nextFile in self.runLog:
-                if not os.path.isfile(self.runLog[nextFile]):
-                    print("Test .ini file not found!: " + nextFile)
-                    sys.exit(1)
-                testDef.configNewTest(self.runLog[nextFile])
-                sequential_status = testDef.executeTest()
-                if sequential_status != 0: 
-                    status = 1
-            # clean up temporary files
-        finally:
-            shutil.rmtree(self.tempDir)
-  
+            sizes = [len(gets), len(runs)] + [len(axis[2]) for axis in axes]
+            choices = self.coveringArray(sizes, strength)
+            total = 1
+            for n in sizes:
+                total = total * n
+            print("Covering array of strength %d: executing %d of %d combinations (reduction factor %.1f)" \
+                  % (strength, len(choices), total, float(total) / len(choices)))
+        combinations = self.combinations(gets, runs, others, axes, choices)
+        if max_workers > 1:
+            return self.executeConcurrently(testDef, combinations, max_workers)
+        cache = {}
+        for config in combinations:
+            keys = self.sectionKeys(config)
+            # look up sections by name within this combination only,
+            # plus those whose results we reuse - which are logged
+            # again so each combination reports them
+            testDef.logger.resetSections()
+            config, reused = self.reuseSections(testDef, config, keys, cache)
+            for log in reused:
+                testDef.logger.addResult(log)
+            testDef.configNewTest(config)
+            sequential_status = testDef.executeTest()
+            if sequential_status != 0:
+                status = 1
+            logs = {title: testDef.logger.getLog(title) for title in keys}
+            self.recordSections(logs, keys, cache, reused)
+
         return status
-        
-            
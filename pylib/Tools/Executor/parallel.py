@@ -0,0 +1,353 @@
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: f; python-indent: 4 -*-
+#
+# Copyright (c) 2015-2018 Intel, Inc. All rights reserved.
+# $COPYRIGHT$
+#
+# Additional copyrights may follow
+#
+# $HEADER$
+#
+
+from __future__ import print_function
+from future import standard_library
+standard_library.install_aliases()
+import os
+import sys
+import signal
+import traceback
+import multiprocessing
+
+from ExecutorMTTTool import *
+
+# Theory of Operation
+#
+# The parallel executor executes the same sections as the sequential
+# executor, but builds a dependency graph from the "parent", "middleware"
+# and "dependencies" keys of each section and runs every section whose
+# dependencies have completed on a bounded pool of worker processes.
+# Thus, independent Get/Build/Run chains proceed concurrently and the
+# total time approaches that of the slowest chain.
+#
+# Plugins keep state across sections and change the cwd and environment
+# while they execute, so each section is executed in a forked child
+# that returns its log to the executor when done. Sections that configure
+# shared state (MTTDefaults, LauncherDefaults, Profile, and TestRun
+# sections setting the defaults of their launcher) or that act upon the
+# system as a whole are executed
+# in the executor itself in the order given by LoadClasses.stageOrder,
+# and every section that follows one of them waits for it to complete.
+# Reporter and STOP sections wait for all preceding sections.
+#
+# Each section is executed once - looping with --loop or --loopforever
+# is not supported.
+#
+
+## @addtogroup Tools
+# @{
+# @addtogroup Executor
+# @section ParallelEx
+# Parallel execution executor
+# @param max_workers    Maximum number of sections to execute concurrently (defaults to the number of CPUs)
+# @}
+class ParallelEx(ExecutorMTTTool):
+
+    def __init__(self):
+        # initialise parent class
+        ExecutorMTTTool.__init__(self)
+        self.options = {}
+        self.options['max_workers'] = (None, "Maximum number of sections to execute concurrently (defaults to the number of CPUs)")
+        # stages whose sections are executed in worker processes
+        self.worker_stages = ['MiddlewareGet', 'MiddlewareBuild', 'TestGet', 'TestBuild', 'TestRun']
+
+    def activate(self):
+        # use the automatic procedure from IPlugin
+        IPlugin.activate(self)
+        return
+
+    def deactivate(self):
+        IPlugin.deactivate(self)
+        return
+
+    def print_name(self):
+        return "Parallel executor"
+
+    def print_options(self, testDef, prefix):
+        lines = testDef.printOptions(self.options)
+        for line in lines:
+            print(prefix + line)
+        return
+
+    # return the name under which the given section will be logged
+    def sectionName(self, title):
+        stage = title.split(':')[0].strip()
+        if "ASIS" in stage:
+            i = 4
+            while stage[i].isspace():
+                i = i + 1
+            return title[i:].strip()
+        return title
+
+    # the launchers take a TestRun section whose name includes "Default"
+    # as setting their defaults (see updateDefaults) - those have to be
+    # executed in the executor so that later sections inherit them
+    def setsDefaults(self, step, title):
+        if step != "TestRun" or ":" not in title:
+            return False
+        return "Default" in title.split(":", 1)[1]
+
+    # build the dependency graph - a list of nodes in sequential
+    # execution order, each carrying the indices of the nodes that
+    # must complete before it can start
+    def buildGraph(self, testDef):
+        nodes = []
+        names = {}
+        for step,title in self.orderedSections(testDef):
+            # sections marked SKIP are never executed
+            if "SKIP" in title:
+                continue
+            name = self.sectionName(title)
+            node = {'step': step, 'title': title, 'name': name, 'deps': set()}
+            node['inline'] = step not in self.worker_stages or \
+                             "STOP" in title or self.setsDefaults(step, title)
+            # explicit dependencies can only be on sections that
+            # would have executed ahead of us in sequential order
+            for d in self.sectionDependencies(testDef, title):
+                if d in names:
+                    node['deps'].add(names[d])
+            barrier = step == "Reporter" or "STOP" in title
+            for i,prev in enumerate(nodes):
+                if barrier or prev['inline']:
+                    node['deps'].add(i)
+            names[name] = len(nodes)
+            nodes.append(node)
+        return nodes
+
+    # setup the section, check its parent and locate its plugin.
+    # Returns the log, keyvals and plugin - or None if the section
+    # has already been logged as failed
+    def prepareSection(self, testDef, node):
+        title = node['title']
+        testDef.logger.verbose_print(title)
+        # Print that section is now starting
+        testDef.logger.stage_start_print(title)
+        self.refreshSection(testDef, title, title)
+        stage, stageLog, keyvals = self.setupSection(testDef, title, title)
+        if not self.checkParent(testDef, title, stageLog, keyvals):
+            return None
+        plugin = self.resolvePlugin(testDef, title, stage, stageLog, keyvals)
+        if plugin is None:
+            return None
+        # Make sure that the plugin was activated
+        if not plugin.is_activated:
+            plugin.activate()
+        return stageLog, keyvals, plugin
+
+    # record the completion of a section
+    def completeSection(self, testDef, title, stageLog):
+        self.finishSection(testDef, title, stageLog)
+        # Set flag if any stage failed so that a return code can be passed back up
+        if stageLog['status'] != 0:
+            self.status = 1
+            if testDef.options['stop_on_fail'] is not False:
+                print("Section " + stageLog['section'] + ": Status " + str(stageLog['status']))
+                try:
+                    print("Section " + stageLog['section'] + ": Stderr " + str(stageLog['stderr']))
+                except KeyError:
+                    pass
+                self.abortWorkers(testDef, "Execution stopped on failure of " + stageLog['section'])
+                self.only_reporter = True
+
+    # execute a section in the executor itself
+    def runInline(self, testDef, node):
+        # if they provided the STOP section, that means we
+        # are to immediately stop processing the test definition
+        if "STOP" in node['title']:
+            testDef.logger.verbose_print(node['title'])
+            return False
+        prep = self.prepareSection(testDef, node)
+        if prep is None:
+            return True
+        stageLog, keyvals, plugin = prep
+        testDef.logger.verbose_print("Executing plugin %s" % plugin.print_name())
+        plugin.execute(stageLog, keyvals, testDef)
+        self.completeSection(testDef, node['title'], stageLog)
+        return True
+
+    # fork a worker to execute a section. Returns True if the
+    # worker was started, False if the section already completed
+    def launchWorker(self, testDef, idx):
+        node = self.nodes[idx]
+        prep = self.prepareSection(testDef, node)
+        if prep is None:
+            return False
+        stageLog, keyvals, plugin = prep
+        pid, fd = self.forkWorker(testDef, self.runWorker, testDef, plugin, stageLog, keyvals)
+        self.running[pid] = {'idx': idx, 'fd': fd, 'data': [], 'log': stageLog}
+        return True
+
+    # the body of the worker process - execute the plugin and
+    # return the resulting log along with the commands it executed
+    def runWorker(self, testDef, plugin, stageLog, keyvals):
+        testDef.logger.execmds_stash = []
+        try:
+            testDef.logger.verbose_print("Executing plugin %s" % plugin.print_name())
+            plugin.execute(stageLog, keyvals, testDef)
+        except BaseException as e:
+            testDef.logger.verbose_print("=======================================")
+            testDef.logger.verbose_print("Exception was raised: %s %s" % (type(e), str(e)))
+            testDef.logger.verbose_print("=======================================")
+            type_, value_, traceback_ = sys.exc_info()
+            ex = traceback.format_exception(type_, value_, traceback_)
+            testDef.logger.verbose_print("\n".join(ex))
+            testDef.logger.verbose_print("=======================================")
+            stageLog['status'] = 1
+            stageLog['stderr'] = ["Exception was raised: %s %s" % (type(e), str(e))]
+        return stageLog, testDef.logger.execmds_stash
+
+    # wait for output from the running workers and complete
+    # the sections of any that are done
+    def waitWorkers(self, testDef):
+        for pid, worker, result in self.pollWorkers(self.running):
+            title = self.nodes[worker['idx']]['title']
+            stageLog = worker['log']
+            if result is None:
+                stageLog['status'] = 1
+                stageLog['stderr'] = ["Worker process exited without reporting results"]
+            else:
+                stageLog, testDef.logger.execmds_stash = result
+            self.done.add(worker['idx'])
+            self.completeSection(testDef, title, stageLog)
+
+    # terminate all running workers, logging their sections as failed
+    def abortWorkers(self, testDef, reason):
+        for pid in list(self.running.keys()):
+            worker = self.running.pop(pid)
+            try:
+                os.killpg(pid, signal.SIGTERM)
+            except OSError:
+                pass
+            os.close(worker['fd'])
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            stageLog = worker['log']
+            stageLog['status'] = 1
+            stageLog['stderr'] = [reason]
+            self.done.add(worker['idx'])
+            self.finishSection(testDef, self.nodes[worker['idx']]['title'], stageLog)
+        self.status = 1
+
+    # start every section whose dependencies have been met.
+    # Returns True if any progress was made
+    def dispatch(self, testDef):
+        progress = False
+        for idx in list(self.pending):
+            node = self.nodes[idx]
+            if self.only_reporter and node['step'] != "Reporter":
+                # we are only to report what we have
+                self.pending.remove(idx)
+                self.done.add(idx)
+                progress = True
+                continue
+            if not node['deps'].issubset(self.done):
+                continue
+            if not node['inline'] and len(self.running) >= self.max_workers:
+                continue
+            self.pending.remove(idx)
+            progress = True
+            try:
+                if node['inline']:
+                    if not self.runInline(testDef, node):
+                        # STOP - drop everything that remains
+                        self.pending = []
+                        return True
+                    self.done.add(idx)
+                elif not self.launchWorker(testDef, idx):
+                    self.done.add(idx)
+            except KeyboardInterrupt:
+                raise
+            except BaseException as e:
+                testDef.logger.verbose_print("=======================================")
+                testDef.logger.verbose_print("Exception was raised: %s %s" \
+                            % (type(e), str(e)))
+                testDef.logger.verbose_print("=======================================")
+                type_, value_, traceback_ = sys.exc_info()
+                ex = traceback.format_exception(type_, value_, traceback_)
+                testDef.logger.verbose_print("\n".join(ex))
+                testDef.logger.verbose_print("=======================================")
+                stageLog = {'section': node['name'], 'status': 1,
+                            'stderr': ["Exception was raised: %s %s" % (type(e), str(e))]}
+                testDef.logger.logResults(node['title'], stageLog)
+                self.done.add(idx)
+                self.status = 1
+                self.abortWorkers(testDef, "Execution aborted due to an exception")
+                self.only_reporter = True
+        return progress
+
+    def schedule(self, testDef):
+        while self.pending or self.running:
+            progress = self.dispatch(testDef)
+            if self.running:
+                self.waitWorkers(testDef)
+            elif not progress:
+                # nothing is running and nothing can start
+                break
+
+    def execute(self, testDef):
+        testDef.logger.verbose_print("ExecuteParallel")
+        # each section is executed once, so looping can't be honoured
+        if testDef.options['loopforever'] or testDef.options['loop']:
+            print("ERROR: the parallel executor does not support --loop or --loopforever")
+            return 1
+        self.status = 0
+        self.only_reporter = False
+        self.running = {}
+        self.done = set()
+
+        try:
+            self.max_workers = int(testDef.options['max_workers'])
+        except (KeyError, TypeError, ValueError):
+            self.max_workers = multiprocessing.cpu_count()
+        if self.max_workers < 1:
+            self.max_workers = 1
+
+        testDef.watchdog.__init__(testDef=testDef)
+        testDef.watchdog.activate()
+
+        # Holding a semaphore while in transition between plugins
+        # so async threads don't interrupt in the wrong context
+        testDef.plugin_trans_sem.acquire()
+
+        # If --duration switch is used, activate watchdog timer
+        if testDef.options['duration']:
+            testDef.watchdog.start(timeout=testDef.options['duration'])
+
+
+        # Start harasser
+        if 0 != self.startHarasser(testDef):
+            self.status = 1
+            self.only_reporter = True
+
+        self.nodes = self.buildGraph(testDef)
+        self.pending = list(range(len(self.nodes)))
+        testDef.logger.verbose_print("Executing %d sections with up to %d workers" % (len(self.nodes), self.max_workers))
+
+        # the sections are now in flight, so the watchdog can
+        # interrupt us at any point
+        testDef.plugin_trans_sem.release()
+        while True:
+            try:
+                self.schedule(testDef)
+                break
+            except KeyboardInterrupt as e:
+                testDef.logger.verbose_print("=======================================")
+                testDef.logger.verbose_print("KeyboardInterrupt exception was raised: %s %s" \
+                            % (type(e), str(e)))
+                testDef.logger.verbose_print("=======================================")
+                self.abortWorkers(testDef, "Exception was raised: %s %s" % (type(e), str(e)))
+                self.only_reporter = True
+
+        self.deactivatePlugins(testDef)
+
+        return self.status
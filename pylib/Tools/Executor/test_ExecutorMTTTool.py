@@ -0,0 +1,266 @@
+# run this via pytest
+# export MTT_HOME=/path/to/mtt
+# pytest ./test_ExecutorMTTTool.py
+#   add the -s argument to display print lines
+#   add the -v argument to be verbose
+# ie  pytest -sv ./test_ExecutorMTTTool.py
+import pytest
+import os
+import sys
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/System"))
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/Tools/Executor"))
+import ExecutorMTTTool as EX
+
+class FakeLogger(object):
+   def __init__(self):
+      self.logged = []
+   def verbose_print(self, *args, **kwargs):
+      pass
+   def logResults(self, title, result):
+      self.logged.append((title, result))
+   def stage_end_print(self, title, result):
+      pass
+
+class FakeTestDef(object):
+   def __init__(self, scratchdir, **options):
+      self.options = {'scratchdir': scratchdir}
+      self.options.update(options)
+      self.logger = FakeLogger()
+
+def sectionLog(section, parameters, status=0, parent=None):
+   log = {'section': section, 'parameters': parameters, 'status': status,
+          'stdout': ["line %d" % i for i in range(500)], 'stderr': []}
+   keyvals = {'section': section}
+   if parent is not None:
+      keyvals['parent'] = parent
+   return log, keyvals
+
+def checkpointed(tmpdir, **options):
+   ex = EX.ExecutorMTTTool()
+   td = FakeTestDef(str(tmpdir), **options)
+   ex.loadCheckpoint(td)
+   return ex, td
+
+def test_noCheckpointWhenDisabled(tmpdir):
+   ex, td = checkpointed(tmpdir, checkpoint=False)
+   assert ex.checkpoint_file is None
+   log, keyvals = sectionLog('TestGet:A', [('url', 'a')])
+   ex.saveCheckpoint(td, log, ex.checkpointKey(td, log, keyvals))
+   assert not os.path.exists(os.path.join(str(tmpdir), "checkpoint.pkl"))
+
+def test_resumeRestoresUnchangedSection(tmpdir):
+   # checkpoints are written unless disabled
+   ex, td = checkpointed(tmpdir)
+   log, keyvals = sectionLog('TestGet:A', [('url', 'a')])
+   ex.saveCheckpoint(td, log, ex.checkpointKey(td, log, keyvals))
+   assert len(log['stdout']) == 500
+
+   ex, td = checkpointed(tmpdir, resume=True)
+   log, keyvals = sectionLog('TestGet:A', [('url', 'a')])
+   assert ex.restoreSection(td, 'TestGet:A', log, ex.checkpointKey(td, log, keyvals))
+   title, restored = td.logger.logged[0]
+   assert title == 'TestGet:A'
+   # the output kept in the checkpoint is bounded, and says so
+   assert len(restored['stdout']) == ex.checkpoint_lines + 1
+   assert restored['stdout'][0] == "[400 earlier lines were not kept in the checkpoint]"
+   assert restored['stdout'][-1] == "line 499"
+   assert restored['stderr'] == []
+
+def test_changedOptionsInvalidateCheckpoint(tmpdir):
+   ex, td = checkpointed(tmpdir, checkpoint=True)
+   log, keyvals = sectionLog('TestGet:A', [('url', 'a')])
+   ex.saveCheckpoint(td, log, ex.checkpointKey(td, log, keyvals))
+
+   ex, td = checkpointed(tmpdir, resume=True)
+   log, keyvals = sectionLog('TestGet:A', [('url', 'b')])
+   assert not ex.restoreSection(td, 'TestGet:A', log, ex.checkpointKey(td, log, keyvals))
+
+def test_rerunParentInvalidatesChild(tmpdir):
+   ex, td = checkpointed(tmpdir, checkpoint=True)
+   for section, parent in [('TestGet:A', None), ('TestBuild:A', 'TestGet:A')]:
+      log, keyvals = sectionLog(section, [('x', '1')], parent=parent)
+      ex.saveCheckpoint(td, log, ex.checkpointKey(td, log, keyvals))
+   child, childvals = sectionLog('TestBuild:A', [('x', '1')], parent='TestGet:A')
+
+   ex, td = checkpointed(tmpdir, resume=True)
+   assert ex.restoreSection(td, 'TestBuild:A', child, ex.checkpointKey(td, child, childvals))
+   # executing the parent again gives it a new stamp
+   ex.checkpoint['TestGet:A']['stamp'] = 'later'
+   assert not ex.restoreSection(td, 'TestBuild:A', child, ex.checkpointKey(td, child, childvals))
+
+def test_failedSectionIsNotRestored(tmpdir):
+   ex, td = checkpointed(tmpdir, checkpoint=True)
+   log, keyvals = sectionLog('TestGet:A', [('url', 'a')])
+   key = ex.checkpointKey(td, log, keyvals)
+   ex.saveCheckpoint(td, log, key)
+   log['status'] = 1
+   ex.saveCheckpoint(td, log, key)
+
+   ex, td = checkpointed(tmpdir, resume=True)
+   assert 'TestGet:A' not in ex.checkpoint
+   assert not ex.restoreSection(td, 'TestGet:A', log, key)
+
+class StageOrder(object):
+   stageOrder = ['MTTDefaults', 'LauncherDefaults', 'TestGet', 'TestBuild', 'TestRun', 'Reporter']
+
+class GraphLogger(FakeLogger):
+   def __init__(self):
+      FakeLogger.__init__(self)
+      self.fh = sys.stdout
+      self.execmds_stash = []
+   def stage_start_print(self, title):
+      pass
+   def get_tuplelist_contents(self, items):
+      return []
+   def getLog(self, section):
+      for title, result in self.logged:
+         if result.get('section') == section:
+            return result
+      return None
+
+class GraphPlugin(object):
+   # fails the sections that ask it to, and notes those it executed
+   is_activated = True
+   def __init__(self, record):
+      self.record = record
+   def print_name(self):
+      return "Fake"
+   def execute(self, log, keyvals, testDef):
+      with open(self.record, 'a') as f:
+         f.write(log['section'] + "\n")
+      log['status'] = int(keyvals.get('fail', '0'))
+
+def graphTestDef(tmpdir, ini):
+   import configparser
+   td = FakeTestDef(str(tmpdir), stop_on_fail=False)
+   td.logger = GraphLogger()
+   td.loader = StageOrder()
+   td.config = configparser.ConfigParser()
+   td.config.optionxform = str
+   td.config.read_string(ini)
+   td.actives = [t for t in td.config.sections() if not t.startswith("SKIP")]
+   plugin = GraphPlugin(os.path.join(str(tmpdir), "executed"))
+   td.findPlugin = lambda name, kind, category=None: (plugin, category) if kind == "utility" else (None, None)
+   td.fill_env_hidden_section = lambda: None
+   td.fill_log_hidden_section = lambda: None
+   return td
+
+def executed(td):
+   try:
+      with open(os.path.join(td.options['scratchdir'], "executed")) as f:
+         return f.read().split()
+   except IOError:
+      return []
+
+graphIni = u"""
+[MTTDefaults]
+plugin = Fake
+[TestGet:A]
+plugin = Fake
+[TestGet:B]
+plugin = Fake
+fail = 1
+[TestBuild:A]
+plugin = Fake
+parent = TestGet:A
+[TestBuild:B]
+plugin = Fake
+parent = TestGet:B
+[TestRun:Defaults]
+plugin = Fake
+[TestRun:A]
+plugin = Fake
+parent = TestBuild:A
+dependencies = TestBuild:B
+[SKIP TestRun:C]
+plugin = Fake
+[Reporter:R]
+plugin = Fake
+"""
+
+def test_parallelGraph(tmpdir):
+   import parallel
+   ex = parallel.ParallelEx()
+   td = graphTestDef(tmpdir, graphIni)
+   nodes = ex.buildGraph(td)
+   titles = [n['title'] for n in nodes]
+   assert titles == ['MTTDefaults', 'TestGet:A', 'TestGet:B', 'TestBuild:A', 'TestBuild:B',
+                     'TestRun:Defaults', 'TestRun:A', 'Reporter:R']
+   deps = dict((n['title'], set(titles[i] for i in n['deps'])) for n in nodes)
+   inline = [n['title'] for n in nodes if n['inline']]
+   # the defaults are set in the executor, ahead of all that follow
+   assert inline == ['MTTDefaults', 'TestRun:Defaults', 'Reporter:R']
+   assert deps['TestGet:A'] == set(['MTTDefaults'])
+   assert deps['TestBuild:A'] == set(['MTTDefaults', 'TestGet:A'])
+   assert deps['TestRun:A'] == set(['MTTDefaults', 'TestRun:Defaults', 'TestBuild:A', 'TestBuild:B'])
+   # the reporters wait for everything
+   assert deps['Reporter:R'] == set(titles[:-1])
+   # only a TestRun section naming defaults is taken as setting them
+   assert ex.setsDefaults("TestRun", "TestRun:Defaults")
+   assert not ex.setsDefaults("TestGet", "TestGet:Defaults")
+   assert not ex.setsDefaults("TestRun", "TestRun:A")
+
+def scheduled(tmpdir, ini):
+   import parallel
+   ex = parallel.ParallelEx()
+   td = graphTestDef(tmpdir, ini)
+   ex.status = 0
+   ex.only_reporter = False
+   ex.running = {}
+   ex.done = set()
+   ex.max_workers = 2
+   ex.nodes = ex.buildGraph(td)
+   ex.pending = list(range(len(ex.nodes)))
+   ex.schedule(td)
+   return ex, td, dict((title, log) for title, log in td.logger.logged)
+
+def test_parallelFailedParentSkipsChildren(tmpdir):
+   ex, td, logs = scheduled(tmpdir, graphIni)
+   ran = executed(td)
+   assert sorted(ran) == sorted(['MTTDefaults', 'TestGet:A', 'TestGet:B', 'TestBuild:A',
+                                 'TestRun:Defaults', 'TestRun:A', 'Reporter:R'])
+   # B failed, so its build is logged as failed without being executed
+   assert logs['TestGet:B']['status'] == 1
+   assert 'TestBuild:B' not in ran
+   assert logs['TestBuild:B']['status'] == 1
+   assert "Prior dependent step failed" in logs['TestBuild:B']['stderr'][0]
+   assert logs['TestRun:A']['status'] == 0
+   assert ran[-1] == 'Reporter:R'
+   assert ex.status == 1 and ex.running == {}
+
+def test_parallelStopDropsTheRest(tmpdir):
+   ex, td, logs = scheduled(tmpdir, u"""
+[TestGet:A]
+plugin = Fake
+[TestBuild:STOP]
+[TestRun:A]
+plugin = Fake
+""")
+   assert executed(td) == ['TestGet:A']
+   assert 'TestRun:A' not in logs
+
+def test_parallelAbortWorkers(tmpdir):
+   import parallel
+   import time
+   ex = parallel.ParallelEx()
+   td = graphTestDef(tmpdir, graphIni)
+   ex.status = 0
+   ex.running = {}
+   ex.done = set()
+   ex.nodes = ex.buildGraph(td)
+   pid, fd = ex.forkWorker(td, time.sleep, 30)
+   ex.running[pid] = {'idx': 1, 'fd': fd, 'data': [], 'log': {'section': 'TestGet:A'}}
+   ex.abortWorkers(td, "stopped")
+   assert ex.running == {} and 1 in ex.done and ex.status == 1
+   title, log = td.logger.logged[-1]
+   assert title == 'TestGet:A' and log['status'] == 1 and log['stderr'] == ["stopped"]
+   # the worker is gone
+   with pytest.raises(OSError):
+      os.kill(pid, 0)
+
+def test_parallelRejectsLooping(tmpdir):
+   import parallel
+   td = graphTestDef(tmpdir, graphIni)
+   td.options.update({'loop': "60", 'loopforever': False})
+   assert 1 == parallel.ParallelEx().execute(td)
+   assert executed(td) == []
@@ -0,0 +1,145 @@
+# run this via pytest
+# export MTT_HOME=/path/to/mtt
+# pytest ./test_combinatorial.py
+#   add the -s argument to display print lines
+#   add the -v argument to be verbose
+# ie  pytest -sv ./test_combinatorial.py
+import pytest
+import os
+import sys
+import itertools
+from collections import OrderedDict
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/System"))
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/Tools/Executor"))
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/Utilities"))
+import combinatorial
+import Logger
+
+def combination(np, scratch="/tmp/scratch"):
+   config = OrderedDict()
+   config['MTTDefaults'] = OrderedDict([('scratchdir', scratch)])
+   config['MiddlewareGet:OMPI'] = OrderedDict([('plugin', 'Git'), ('url', 'https://example.com/ompi')])
+   config['MiddlewareBuild:OMPI'] = OrderedDict([('parent', 'MiddlewareGet:OMPI'), ('configure_options', '--enable-debug')])
+   config['LauncherDefaults:OMPI'] = OrderedDict([('plugin', 'OpenMPI'), ('np', np)])
+   config['TestRun:Hello'] = OrderedDict([('plugin', 'OpenMPI'), ('parent', 'MiddlewareBuild:OMPI'), ('np', np)])
+   return config
+
+def test_sectionKeysIgnoreRunOnlySections():
+   c = combinatorial.CombinatorialEx()
+   keys2 = c.sectionKeys(combination('2'))
+   keys4 = c.sectionKeys(combination('4'))
+   print("--->keys:", keys2)
+   assert sorted(keys2.keys()) == ['MiddlewareBuild:OMPI', 'MiddlewareGet:OMPI']
+   assert keys2 == keys4
+
+def test_sectionKeysFollowMTTDefaults():
+   c = combinatorial.CombinatorialEx()
+   keys = c.sectionKeys(combination('2'))
+   other = c.sectionKeys(combination('2', scratch="/tmp/other"))
+   assert keys['MiddlewareBuild:OMPI'] != other['MiddlewareBuild:OMPI']
+
+def test_sectionKeysFollowParents():
+   c = combinatorial.CombinatorialEx()
+   config = combination('2')
+   keys = c.sectionKeys(config)
+   config['MiddlewareGet:OMPI']['url'] = 'https://example.com/fork'
+   other = c.sectionKeys(config)
+   assert keys['MiddlewareGet:OMPI'] != other['MiddlewareGet:OMPI']
+   assert keys['MiddlewareBuild:OMPI'] != other['MiddlewareBuild:OMPI']
+
+def covers(rows, sizes, strength):
+   for group in itertools.combinations(range(len(sizes)), strength):
+      seen = set(tuple(row[a] for a in group) for row in rows)
+      for values in itertools.product(*[range(sizes[a]) for a in group]):
+         if values not in seen:
+            print("--->missing:", group, values)
+            return False
+   return True
+
+def test_coveringArrayCoversEveryPair():
+   c = combinatorial.CombinatorialEx()
+   for sizes in [[2, 2, 2], [3, 3, 3, 3], [4, 2, 3, 5, 2], [2] * 10]:
+      rows = c.coveringArray(sizes, 2)
+      print("--->sizes:", sizes, "rows:", len(rows))
+      assert covers(rows, sizes, 2)
+      assert all(len(row) == len(sizes) for row in rows)
+      assert all(0 <= row[a] < sizes[a] for row in rows for a in range(len(sizes)))
+      assert len(rows) < len(list(itertools.product(*[range(n) for n in sizes])))
+
+def test_coveringArrayCoversEveryTriple():
+   c = combinatorial.CombinatorialEx()
+   sizes = [2, 3, 2, 2, 3]
+   rows = c.coveringArray(sizes, 3)
+   assert covers(rows, sizes, 3)
+
+def test_coveringArrayFullStrength():
+   c = combinatorial.CombinatorialEx()
+   sizes = [2, 3]
+   rows = c.coveringArray(sizes, 2)
+   assert sorted(rows) == sorted(itertools.product(range(2), range(3)))
+
+class FakeTestDef(object):
+   # executes each section by noting it in a file shared by all the
+   # combinations, and logging whether its parent's results were found
+   def __init__(self, scratchdir):
+      self.options = {'scratchdir': scratchdir, 'logfile': None}
+      self.logger = Logger.Logger()
+      self.record = os.path.join(scratchdir, "executed")
+      self.config = None
+   def pluginsOfCategory(self, kind, category):
+      return []
+   def configNewTest(self, config):
+      self.config = config
+   def executeTest(self):
+      order = ['MTTDefaults', 'MiddlewareGet', 'MiddlewareBuild', 'LauncherDefaults', 'TestRun']
+      for title in sorted(self.config, key=lambda t: order.index(t.split(":")[0])):
+         values = self.config[title]
+         with open(self.record, 'a') as f:
+            f.write(title + "\n")
+         log = {'section': title, 'status': 0}
+         if 'parent' in values:
+            log['parent_found'] = self.logger.getLog(values['parent']) is not None
+         self.logger.logResults(title, log)
+      return 0
+   def executed(self):
+      with open(self.record) as f:
+         return f.read().split()
+
+combinationIni = u"""
+[MTTDefaults]
+scratchdir = %s
+max_workers = %d
+[MiddlewareGet:OMPI]
+plugin = Git
+[MiddlewareBuild:OMPI]
+parent = MiddlewareGet:OMPI
+[LauncherDefaults:OMPI]
+np = 1,2,4
+[TestRun:Hello]
+parent = MiddlewareBuild:OMPI
+"""
+
+def executeCombinations(tmpdir, max_workers):
+   import configparser
+   td = FakeTestDef(str(tmpdir))
+   td.config = configparser.ConfigParser()
+   td.config.optionxform = str
+   td.config.read_string(combinationIni % (str(tmpdir), max_workers))
+   assert 0 == combinatorial.CombinatorialEx().execute(td)
+   ran = td.executed()
+   # the middleware was fetched and built once for all three
+   assert ran.count('MiddlewareGet:OMPI') == 1
+   assert ran.count('MiddlewareBuild:OMPI') == 1
+   assert ran.count('TestRun:Hello') == 3
+   # yet every combination reports it, and found it when needed
+   sections = [log['section'] for log in td.logger.getLog(None)]
+   assert sections.count('MiddlewareGet:OMPI') == 3
+   assert sections.count('MiddlewareBuild:OMPI') == 3
+   found = [log['parent_found'] for log in td.logger.getLog(None) if 'parent_found' in log]
+   assert len(found) == 6 and all(found)
+
+def test_executeSharesSections(tmpdir):
+   executeCombinations(tmpdir, 1)
+
+def test_executeConcurrentlySharesSections(tmpdir):
+   executeCombinations(tmpdir, 2)
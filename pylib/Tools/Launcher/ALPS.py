@@ -31,12 +31,17 @@ import shlex
 # @param fail_timeout              Maximum execution time for tests expected to fail
 # @param skip_tests                Names of tests to be skipped
 # @param max_num_tests             Maximum number of tests to run
+# @param max_concurrent            Maximum number of tests to run at a time, packed onto the slots of the hostfile or allocation (0 for as many as the slots allow)
+# @param test_order                Order in which to run the tests: original, or longest, shortest or failed first as recorded in earlier runs
+# @param shard_by                  Split the tests across the shards given by --shard by name, or by the durations in the shard_history file
+# @param shard_history             History file of earlier runs to balance the shards by with shard_by = duration - every client must be given the same file
 # @param modules_unload            Modules to unload
 # @param modules                   Modules to load
 # @param modules_swap              Modules to swap
 # @param test_list                 List of tests to run, default is all
 # @param allocate_cmd              Command to use for allocating nodes from the resource manager
 # @param deallocate_cmd            Command to use for deallocating nodes from the resource manager
+# @param allocation_key            Name of an allocation to be shared by the TestRun sections giving the same name - it is released after the last of them
 # @param dependencies              List of dependencies specified as the build stage name
 # @}
 class ALPS(LauncherMTTTool):
@@ -58,12 +63,17 @@ class ALPS(LauncherMTTTool):
         self.options['fail_timeout'] = (None, "Maximum execution time for tests expected to fail")
         self.options['skip_tests'] = (None, "Names of tests to be skipped")
         self.options['max_num_tests'] = (None, "Maximum number of tests to run")
+        self.options['max_concurrent'] = ("1", "Maximum number of tests to run at a time, packed onto the slots of the hostfile or allocation (0 for as many as the slots allow)")
+        self.options['test_order'] = ("original", "Order in which to run the tests: original, or longest, shortest or failed first as recorded in earlier runs")
+        self.options['shard_by'] = ("name", "Split the tests across the shards given by --shard by name, or by the durations in the shard_history file")
+        self.options['shard_history'] = (None, "History file of earlier runs to balance the shards by with shard_by = duration - every client must be given the same file")
         self.options['modules'] = (None, "Modules to load")
         self.options['modules_unload'] = (None, "Modules to unload")
         self.options['modules_swap'] = (None, "Modules to swap")
         self.options['test_list'] = (None, "List of tests to run, default is all")
         self.options['allocate_cmd'] = (None, "Command to use for allocating nodes from the resource manager")
         self.options['deallocate_cmd'] = (None, "Command to use for deallocating nodes from the resource manager")
+        self.options['allocation_key'] = (None, "Name of an allocation to be shared by the TestRun sections giving the same name - it is released after the last of them")
         self.options['dependencies'] = (None, "List of dependencies specified as the build stage name - e.g., MiddlwareBuild_package to be added to configure using --with-package=location")
 
         self.allocated = False
@@ -83,6 +93,9 @@ class ALPS(LauncherMTTTool):
         if self.testDef and self.cmds and self.cmds['deallocate_cmd'] is not None:
             deallocate_cmdargs = shlex.split(self.cmds['deallocate_cmd'])
             self.deallocateCluster(None, self.cmds, self.testDef)
+        if self.testDef:
+            # release the allocations still kept for later sections
+            self.releaseAllocations(self.testDef)
 
 
     def print_name(self):
@@ -118,7 +131,7 @@ class ALPS(LauncherMTTTool):
             return
 
         # collect the tests to be considered
-        status = self.collectTests(log, cmds)
+        status = self.collectTests(log, cmds, testDef)
         # check that we found something
         if status != 0:
             # something went wrong - error is in the log
@@ -16,6 +16,44 @@ from yapsy.IPlugin import IPlugin
 import os
 import shlex
 import re
+import math
+import pickle
+import datetime
+import threading
+import itertools
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+from collections import deque
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+# the executables found beneath each directory scanned for tests,
+# shared by all launchers so the sections running the tests of
+# the same build only scan it once
+testIndexes = {}
+
+# the allocations kept open for the TestRun sections that share them,
+# keyed by the name they were given - shared by all launchers. Each
+# holds the options it was allocated with, the process that allocated
+# it, and the title of the section due to use it next, if any
+allocations = {}
+
+# the markers noting the start and end of each test of a batch on each
+# process and when that was, and the tag on each line of the output of
+# a test. The time is only whole seconds where date doesn't know %N
+batchMarker = re.compile(r"##MTT-(BEGIN|END) (\d+) (\d+)(?: (-?\d+))?(?: @(\d+(?:\.\d+)?)\S*)?\s*$")
+batchLine = re.compile(r"##MTT-(\d+) ?(.*)$")
 
 ## @addtogroup Tools
 # @{
@@ -37,8 +75,20 @@ class LauncherMTTTool(IPlugin):
         self.numSkip = 0
         self.numFail = 0
         self.numTimed = 0
+        self.numStalled = 0
         self.maxTests = 10000000
         self.midpath = False
+        # durations of earlier runs of each test that passed, and
+        # the result of its last run, keyed by the test, the number
+        # of processes and the launcher
+        self.history = {}
+        self.lastResult = {}
+        self.history_file = None
+        self.historyLength = 100
+        self.historyMinSamples = 5
+        self.batchIds = itertools.count(1)
+        # the name of the shared allocation the current section runs in
+        self.allocation = None
         # initialise parent class
         IPlugin.__init__(self)
 
@@ -216,77 +266,143 @@ class LauncherMTTTool(IPlugin):
         os.chdir(self.cwd)
         return
 
-    def collectTests(self, log, cmds):
-        # did they give us a list of specific directories where the desired
-        # tests to be executed reside?
-        if cmds['test_list'] is None:
+    # scan a directory tree for executables in the order os.walk
+    # would visit it, recording the mtime of every directory so that
+    # the scan can be checked for being current without repeating it
+    def scanTests(self, top):
+        index = {'dirs': [], 'tests': [], 'names': {}}
+        if scandir is None:
+            for dirName, subdirList, fileList in os.walk(top):
+                try:
+                    index['dirs'].append((dirName, os.stat(dirName).st_mtime))
+                except OSError:
+                    continue
+                for fname in fileList:
+                    filename = os.path.abspath(os.path.join(dirName, fname))
+                    if os.path.isfile(filename) and os.access(filename, os.X_OK):
+                        self.indexTest(index, fname, filename)
+            return index
+        pending = [top]
+        while pending:
+            dirName = pending.pop()
             try:
-                if cmds['test_dir'] is not None:
-                    # pick up the executables from the specified directories
-                    # accept values delimited by , or space or tab
-                    dirs = re.split(",| |\t", cmds['test_dir'])
-                    for dr in dirs:
-                        dr = dr.strip()
-                        # remove any commas and quotes
-                        dr = dr.replace('\"','')
-                        for dirName, subdirList, fileList in os.walk(dr):
-                            for fname in fileList:
-                                # see if this is an executable
-                                filename = os.path.abspath(os.path.join(dirName,fname))
-                                if os.path.isfile(filename) and os.access(filename, os.X_OK):
-                                    # add this file to our list of tests to execute
-                                    self.tests.append(filename)
-                else:
-                    # get the list of executables from this directory and any
-                    # subdirectories beneath it
-                    for dirName, subdirList, fileList in os.walk("."):
-                        for fname in fileList:
-                            # see if this is an executable
-                            filename = os.path.abspath(os.path.join(dirName,fname))
-                            if os.path.isfile(filename) and os.access(filename, os.X_OK):
-                                # add this file to our list of tests to execute
-                                self.tests.append(filename)
-            except KeyError:
-                # get the list of executables from this directory and any
-                # subdirectories beneath it
-                for dirName, subdirList, fileList in os.walk("."):
-                    for fname in fileList:
-                        # see if this is an executable
-                        filename = os.path.abspath(os.path.join(dirName,fname))
-                        if os.path.isfile(filename) and os.access(filename, os.X_OK):
-                            # add this file to our list of tests to execute
-                            self.tests.append(filename)
-        # If list of individual tests is provided, use list rather than grabbing all tests
+                mtime = os.stat(dirName).st_mtime
+                entries = list(scandir(dirName))
+            except OSError:
+                continue
+            index['dirs'].append((dirName, mtime))
+            subdirs = []
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        # like os.walk, don't follow links to directories
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    elif entry.is_file() and os.access(entry.path, os.X_OK):
+                        self.indexTest(index, entry.name, os.path.abspath(entry.path))
+                except OSError:
+                    pass
+            # visit the subdirectories in order once this one is done
+            subdirs.reverse()
+            pending.extend(subdirs)
+        return index
+
+    def indexTest(self, index, fname, filename):
+        index['names'].setdefault(fname, []).append((len(index['dirs']) - 1, filename))
+        index['tests'].append(filename)
+
+    # get the index of the executables beneath a directory - scanning it
+    # only if it wasn't scanned before or any of its directories changed
+    def testIndex(self, top):
+        top = os.path.abspath(top)
+        try:
+            index = testIndexes[top]
+            for dirName, mtime in index['dirs']:
+                if os.stat(dirName).st_mtime != mtime:
+                    break
+            else:
+                return index
+        except (KeyError, OSError):
+            pass
+        index = self.scanTests(top)
+        testIndexes[top] = index
+        return index
+
+    def collectTests(self, log, cmds, testDef=None):
+        # get the directories where the desired tests reside - default
+        # to this directory and any subdirectories beneath it
+        try:
+            test_dir = cmds['test_dir']
+        except KeyError:
+            test_dir = None
+        if test_dir is not None:
+            # accept values delimited by , or space or tab
+            # and remove any quotes
+            dirs = [dr.strip().replace('\"','') for dr in re.split(",| |\t", test_dir)]
+            dirs = [dr for dr in dirs if dr]
         else:
-            if cmds['test_dir'] is not None:
-                dirs = re.split(",| |\t", cmds['test_dir'])
+            dirs = ["."]
+        for dr in dirs:
+            index = self.testIndex(dr)
+            # did they give us a list of specific tests to be executed?
+            if cmds['test_list'] is None:
+                self.tests.extend(index['tests'])
             else:
-                dirs = ['.']
-            for dr in dirs:
-                dr = dr.strip()
-                dr = dr.replace('\"','')
+                # pick up the listed tests wherever they are found,
+                # in the order of the directories they are in
+                found = []
                 individual_tests = re.split(",| |\t", cmds['test_list'])
-                for dirName, subdirList, fileList in os.walk(dr):
-                    for fname_cmd in individual_tests:
-                        fname = fname_cmd.strip().split(" ")[0]
-                        fname_args = " ".join(fname_cmd.strip().split(" ")[1:])
-                        if fname not in fileList:
-                            continue
-                        filename = os.path.abspath(os.path.join(dirName,fname))
-                        if os.path.isfile(filename) and os.access(filename, os.X_OK):
-                            self.tests.append((filename+" "+fname_args).strip())
+                for i,fname_cmd in enumerate(individual_tests):
+                    fname = fname_cmd.strip().split(" ")[0]
+                    fname_args = " ".join(fname_cmd.strip().split(" ")[1:])
+                    for dirIdx, filename in index['names'].get(fname, []):
+                        found.append((dirIdx, i, (filename+" "+fname_args).strip()))
+                found.sort()
+                self.tests.extend([f[2] for f in found])
         # check that we found something
         if not self.tests:
             log['status'] = 1
             log['stderr'] = "No tests found"
             return 1
 
+        # only keep the tests of our shard if the tests are split
+        # across clients - balancing the shards by the durations in
+        # the given history file, if requested. Our own history can't
+        # be used as it differs from one client to the next
+        if testDef is not None and testDef.options.get('shard'):
+            log['shard'] = testDef.options['shard']
+            durations = None
+            if cmds.get('shard_by') == "duration":
+                if cmds.get('shard_history') is None:
+                    log['status'] = 1
+                    log['stderr'] = "shard_by = duration requires a shard_history file given to every client"
+                    return 1
+                durations = self.shardDurations(cmds['shard_history'], cmds, testDef)
+                if durations is None:
+                    # splitting by name instead would not match the
+                    # clients that could read it
+                    log['status'] = 1
+                    log['stderr'] = "Cannot read shard history " + cmds['shard_history']
+                    return 1
+            self.tests = testDef.shardTests(self.tests, durations)
+            if not self.tests:
+                testDef.logger.verbose_print("No tests in shard " + log['shard'])
+                log['status'] = 0
+                log['testresults'] = []
+                return 1
+
         # get the "skip" exit status
         self.skipStatus = int(cmds['skipped'])
         # get any specified max number of tests to execute
         if cmds['max_num_tests'] is not None:
             self.maxTests = int(cmds['max_num_tests'])
 
+        # the tests are referred to by name in the options below, so
+        # find the tests of each name
+        byname = {}
+        for t in self.tests:
+            byname.setdefault(t.split("/")[-1], []).append(t)
+
         # construct a dict of usecases for tests expected to fail
         fail_usecases = {}
         # create a list of the tests that are expected to fail - i.e.,
@@ -311,15 +427,14 @@ class LauncherMTTTool(IPlugin):
                     fail_usecases[t] = None
             # the list of tests expected to fail is given by test name, but
             # the list of tests we are to execute has been setup in absolute
-            # path form. Thus, scan the two lists and replace the fail_tests
-            # entries with their absolute path equivalents. Note that we don't
-            # bother removing those we don't match as those won't be executed
-            # anyway and thus are irrelevant
-            for t in fail_usecases:
-                for t2 in self.tests:
-                    if t2.split("/")[-1] == t:
-                        rc = fail_usecases[t]
-                        del fail_usecases[t]
+            # path form. Thus, replace the fail_tests entries with their
+            # absolute path equivalents. Note that we don't bother removing
+            # those we don't match as those won't be executed anyway and
+            # thus are irrelevant
+            for t in list(fail_usecases.keys()):
+                if t in byname:
+                    rc = fail_usecases.pop(t)
+                    for t2 in byname[t]:
                         fail_usecases[t2] = rc
 
         # record the expected return code for each test - we store this in a
@@ -327,10 +442,7 @@ class LauncherMTTTool(IPlugin):
         # expected return code of 0 for any test not in the fail_tests list
         # cycle across the list of tests
         for t in self.tests:
-            if t in fail_usecases:
-                self.expected_returncodes[t] = fail_usecases[t]
-            else:
-                self.expected_returncodes[t] = 0
+            self.expected_returncodes[t] = fail_usecases.get(t, 0)
 
         # construct the list of tests to be skipped - we will skip the
         # tests at time of execution and so we leave them in the list
@@ -339,24 +451,36 @@ class LauncherMTTTool(IPlugin):
         if skip_tests is not None:
             # be flexible and accept values delimited by , or space or tab
             # and strip any lingering whitespace
-            self.skip_tests = [t.strip() for t in re.split(",| |\t", skip_tests)]
+            names = [t.strip() for t in re.split(",| |\t", skip_tests)]
         else:
-            self.skip_tests = []
+            names = []
         # the list of tests to skip is given by test name, but
         # the list of tests we are to execute has been setup in absolute
-        # path form. Thus, scan the two lists and replace the skip_tests
-        # entries with their absolute path equivalents. Note that we don't
-        # bother removing those we don't match as those won't be executed
-        # anyway and thus are irrelevant
-        for i,t in enumerate(self.skip_tests):
-            for t2 in self.tests:
-                if t2.split("/")[-1] == t:
-                    self.skip_tests[i] = t2
+        # path form. Thus, replace the skip_tests entries with their
+        # absolute path equivalents. Note that we don't bother removing
+        # those we don't match as those won't be executed anyway and
+        # thus are irrelevant
+        self.skip_tests = set()
+        for t in names:
+            self.skip_tests.update(byname.get(t, [t]))
         # all done
         return 0
 
     def allocateCluster(self, log, cmds, testDef):
         self.allocated = False
+        self.allocation = None
+        # sections naming the same allocation share it - it is
+        # only allocated for the first of them
+        try:
+            key = cmds['allocation_key']
+        except KeyError:
+            key = None
+        if key is not None:
+            self.allocation = key
+            if key in allocations:
+                testDef.logger.verbose_print("Reusing allocation " + key)
+                allocations[key]['next'] = None
+                return 0
         if cmds['allocate_cmd'] is not None and cmds['deallocate_cmd'] is not None:
             self.allocated = True
             allocate_cmdargs = shlex.split(cmds['allocate_cmd'])
@@ -365,78 +489,593 @@ class LauncherMTTTool(IPlugin):
                 log['status'] = results['status']
                 log['stderr'] = results['stderr']
                 os.chdir(self.cwd)
+                self.allocation = None
                 return 1
+            # the allocation is now released by its last user
+            if key is not None:
+                allocations[key] = {'cmds': cmds, 'pid': os.getpid(), 'next': None}
+                self.allocated = False
         return 0
 
-    def runTests(self, log, cmdargs, cmds, testDef):
-        log['testresults'] = []
-        for test in self.tests:
-            testLog = {'test':test}
-            cmdargs.append(test)
-            testLog['cmd'] = " ".join(cmdargs)
-
-            # check if we should skip this test
-            if test in self.skip_tests:
-                # track number of tests we skipped. We record its
-                # status as the one we were told to use for
-                # a "skipped" test since we obviously didn't
-                # really execute it
-                self.numSkip += 1
-                testLog['stdout'] = ""
-                testLog['stderr'] = ""
-                testLog['time'] = 0
-                testLog['status'] = self.skipStatus
-                # clearly mark this as a skipped test
-                testLog['result'] = testDef.MTT_TEST_SKIPPED
-                log['testresults'].append(testLog)
-                cmdargs = cmdargs[:-1]
+    # find the next TestRun section to be executed after the given one
+    # that names the given allocation - those that don't name one take
+    # the default of their own launcher. Returns its title, or None if
+    # there is none before the test definition is stopped
+    def laterUser(self, key, title, testDef):
+        try:
+            titles = testDef.config.sections()
+            actives = set(testDef.actives)
+        except AttributeError:
+            return None
+        if title not in titles:
+            title = re.sub(r"-loop\d+$", "", title)
+            if title not in titles:
+                return None
+        for t in titles[titles.index(title)+1:]:
+            if t not in actives or "SKIP" in t:
                 continue
+            if "STOP" in t:
+                return None
+            if "TestRun" not in t.split(":")[0]:
+                continue
+            try:
+                name = testDef.config.get(t, 'allocation_key', raw=True).strip()
+            except Exception:
+                name = None
+                try:
+                    plugin = testDef.findPlugin(testDef.config.get(t, 'plugin', raw=True).strip(), "tool")[0]
+                    name = plugin.options['allocation_key'][0]
+                except Exception:
+                    pass
+            if name == key:
+                return t
+        return None
 
-            harass_exec_ids = testDef.harasser.start(testDef)
+    # a section that was due to use a shared allocation is done or won't
+    # be executed - pass the allocation on to the next section naming it,
+    # or release it if there is none
+    def sectionDone(self, testDef, title):
+        for key in list(allocations.keys()):
+            entry = allocations.get(key)
+            if entry is None or entry['next'] not in [title, re.sub(r"-loop\d+$", "", title)]:
+                continue
+            entry['next'] = self.laterUser(key, title, testDef)
+            if entry['next'] is None:
+                self.releaseAllocations(testDef, key)
 
-            harass_check = testDef.harasser.check(harass_exec_ids, testDef)
-            if harass_check is not None:
-                testLog['stderr'] = 'Not all harasser scripts started. These failed to start: ' \
-                                + ','.join([h_info[1]['start_script'] for h_info in harass_check[0]])
-                testLog['time'] = sum([r_info[3] for r_info in harass_check[1]])
-                testLog['status'] = 1
-                testLog['result'] = testDef.MTT_TEST_FAILED
-                if 0 == self.finalStatus:
-                    self.finalStatus = 1
-                    self.finalError = testLog['stderr']
-                self.numFail += 1
-                self.numTests += 1
-                testDef.harasser.stop(harass_exec_ids, testDef)
-                log['testresults'].append(testLog)
-                cmdargs = cmdargs[:-1]
-                if self.numTests == self.maxTests:
-                    break
+    # release the shared allocations - all of them, or just the given
+    # one. Those a forked worker inherited from its parent are left to
+    # the parent to release
+    def releaseAllocations(self, testDef, key=None):
+        status = 0
+        stderr = None
+        for name in list(allocations.keys()):
+            if key is not None and name != key:
+                continue
+            entry = allocations.pop(name)
+            if entry['pid'] != os.getpid():
                 continue
+            testDef.logger.verbose_print("Releasing allocation " + name)
+            cmds = entry['cmds']
+            results = testDef.execmd.execute(cmds, shlex.split(cmds['deallocate_cmd']), testDef)
+            if 0 != results['status'] and 0 == status:
+                status = results['status']
+                stderr = results['stderr']
+        return status, stderr
 
-            results = testDef.execmd.execute(cmds, cmdargs, testDef)
+    # load the results recorded for earlier runs of the tests from
+    # the history file in the scratch directory, keeping only the most
+    # recent durations of each test
+    def loadHistory(self, testDef):
+        self.history = {}
+        self.lastResult = {}
+        self.history_file = os.path.join(testDef.options['scratchdir'], "test_history.pkl")
+        records = 0
+        try:
+            with open(self.history_file, 'rb') as f:
+                while True:
+                    try:
+                        key, secs, result = pickle.load(f)
+                    except Exception:
+                        break
+                    records += 1
+                    self.lastResult[key] = result
+                    if result == testDef.MTT_TEST_PASSED:
+                        try:
+                            self.history[key].append(secs)
+                        except KeyError:
+                            self.history[key] = deque([secs], self.historyLength)
+        except (IOError, OSError):
+            return
+        # compact the file once most of it holds results
+        # that have aged out
+        kept = sum([len(d) for d in self.history.values()]) + len(self.lastResult)
+        if records > 2 * kept:
+            tmpfile = "%s.%d.tmp" % (self.history_file, os.getpid())
+            with open(tmpfile, 'wb') as f:
+                for key, durations in self.history.items():
+                    for secs in durations:
+                        pickle.dump((key, secs, testDef.MTT_TEST_PASSED), f, 2)
+                for key, result in self.lastResult.items():
+                    if result != testDef.MTT_TEST_PASSED:
+                        pickle.dump((key, None, result), f, 2)
+            os.rename(tmpfile, self.history_file)
 
-            testDef.harasser.stop(harass_exec_ids, testDef)
+    # the median duration of each of our tests as recorded in the given
+    # history file, which is only read - so that every client given the
+    # same file splits the tests alike. Returns None if it can't be read
+    def shardDurations(self, path, cmds, testDef):
+        history = {}
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    try:
+                        key, secs, result = pickle.load(f)
+                    except Exception:
+                        break
+                    if result == testDef.MTT_TEST_PASSED:
+                        history.setdefault(key, []).append(secs)
+        except (IOError, OSError):
+            return None
+        durations = {}
+        for t in self.tests:
+            try:
+                recorded = sorted(history[self.historyKey(t, cmds)])
+            except KeyError:
+                durations[t] = None
+                continue
+            durations[t] = recorded[len(recorded) // 2]
+        return durations
 
-            testLog['status'] = results['status']
-            testLog['stdout'] = results['stdout']
-            testLog['stderr'] = results['stderr']
+    def historyKey(self, test, cmds):
+        try:
+            np = cmds['np']
+        except KeyError:
+            np = None
+        return (test, str(np), self.print_name())
+
+    # append the result and duration of a test to the history file.
+    # Each record is written in a single call so that sections running
+    # concurrently can share the file
+    def recordResult(self, key, secs, result, testDef):
+        self.lastResult[key] = result
+        if result == testDef.MTT_TEST_PASSED:
+            try:
+                self.history[key].append(secs)
+            except KeyError:
+                self.history[key] = deque([secs], self.historyLength)
+        try:
+            with open(self.history_file, 'ab') as f:
+                f.write(pickle.dumps((key, secs, result), 2))
+        except (IOError, OSError):
+            pass
+
+    # the median of the durations recorded for a test, if any
+    def medianDuration(self, key):
+        try:
+            durations = sorted(self.history[key])
+        except KeyError:
+            return None
+        return durations[len(durations) // 2]
+
+    # order the tests as requested using their history - longest or
+    # shortest first by their median duration, or those that did not
+    # pass when last run first. Tests without history are taken to be
+    # long, and are otherwise kept in the order they were found
+    def orderTests(self, tests, order, cmds, testDef):
+        if order == "failed":
+            return sorted(tests, key=lambda t: self.lastResult.get(self.historyKey(t, cmds),
+                                                                    testDef.MTT_TEST_PASSED) == testDef.MTT_TEST_PASSED)
+        durations = {}
+        for t in tests:
+            durations[t] = self.medianDuration(self.historyKey(t, cmds))
+            if durations[t] is None:
+                durations[t] = float('inf')
+        if order == "longest":
+            return sorted(tests, key=lambda t: -durations[t])
+        if order == "shortest":
+            return sorted(tests, key=lambda t: durations[t])
+        return list(tests)
+
+    # derive the timeout of a test from its history - a multiple of
+    # the 99th percentile of its durations, bounded by the floor and
+    # the cap. Returns None if the test has not run often enough
+    def adaptiveTimeout(self, key, cmds):
+        try:
+            durations = sorted(self.history[key])
+        except KeyError:
+            return None
+        if len(durations) < self.historyMinSamples:
+            return None
+        p99 = durations[int(math.ceil(0.99 * len(durations))) - 1]
+        secs = max(p99 * float(cmds['timeout_multiplier']), float(cmds['timeout_floor']))
+        cap = cmds['timeout_cap']
+        if cap is None:
+            cap = cmds['timeout']
+        if cap is not None:
+            secs = min(secs, float(cap))
+        return int(math.ceil(secs))
+
+    # build the pool of slots the tests are packed onto when more than
+    # one is run at a time - from the hostfile if one was given, else
+    # from the nodes of the SLURM allocation we are running in, if any.
+    # Each entry holds a host and its number of free slots
+    def setupSlots(self, cmds, testDef):
+        self.slots = []
+        try:
+            hostfile = cmds['hostfile']
+        except KeyError:
+            hostfile = None
+        if hostfile is not None:
             try:
-                testLog['time'] = results['time']
-            except:
-                pass
+                with open(hostfile, 'r') as f:
+                    for line in f:
+                        fields = line.split('#')[0].split()
+                        if not fields:
+                            continue
+                        num = 1
+                        for field in fields[1:]:
+                            if field.startswith("slots="):
+                                num = int(field[6:])
+                        self.slots.append([fields[0], num])
+            except (IOError, OSError, ValueError):
+                self.slots = []
+        elif 'SLURM_JOB_NODELIST' in os.environ:
+            results = testDef.execmd.execute(None, ["scontrol", "show", "hostnames", os.environ['SLURM_JOB_NODELIST']], testDef, quiet=True)
+            if 0 == results['status']:
+                # the number of CPUs of each node is given in a
+                # compressed form - e.g., 16(x2),8
+                counts = []
+                for entry in os.environ.get('SLURM_JOB_CPUS_PER_NODE', "").split(','):
+                    m = re.match(r"(\d+)(?:\(x(\d+)\))?$", entry.strip())
+                    if m:
+                        counts.extend([int(m.group(1))] * int(m.group(2) or 1))
+                hosts = [h.strip() for h in results['stdout'] if h.strip()]
+                for i,host in enumerate(hosts):
+                    self.slots.append([host, counts[i] if i < len(counts) else 1])
+        self.totalSlots = sum([s[1] for s in self.slots])
+
+    # claim slots for a test of the given number of processes, keeping
+    # the test on as few hosts as possible. Returns the hosts and the
+    # number of slots claimed on each, or None if not enough slots are
+    # free. A test that needs more slots than we have, or whose number
+    # of processes isn't known, is given every slot once all are free
+    def claimSlots(self, nprocs, busy):
+        if not self.slots:
+            return []
+        if nprocs is None or nprocs > self.totalSlots:
+            if busy:
+                return None
+            claim = [[host, free] for host, free in self.slots]
+        else:
+            if sum([s[1] for s in self.slots]) < nprocs:
+                return None
+            claim = []
+            for host, free in self.slots:
+                if free >= nprocs:
+                    claim = [[host, nprocs]]
+                    break
+            if not claim:
+                needed = nprocs
+                for host, free in self.slots:
+                    if 0 < free and 0 < needed:
+                        claim.append([host, min(free, needed)])
+                        needed -= min(free, needed)
+        for host, num in claim:
+            for s in self.slots:
+                if s[0] == host:
+                    s[1] -= num
+        return claim
+
+    def releaseSlots(self, claim):
+        for host, num in claim:
+            for s in self.slots:
+                if s[0] == host:
+                    s[1] += num
 
+    # the arguments placing a test on the slots claimed for it -
+    # launchers that can direct a job to specific hosts override this
+    def hostArgs(self, claim):
+        return []
+
+    # release whatever this process started for later sections to use -
+    # called before a worker process of the parallel executor exits, as
+    # the sections that would have used it are run elsewhere
+    def releaseKept(self, testDef):
+        for key in list(allocations.keys()):
+            if allocations[key]['pid'] == os.getpid():
+                self.releaseAllocations(testDef, key)
+
+    # execute the command of a job - launchers that launch into a
+    # runtime of their own may check on it here
+    def runJob(self, job, testDef):
+        return testDef.execmd.execute(job['opts'], job['cmdargs'], testDef)
+
+    # execute a job - in a thread of its own if more than one
+    # is to be run at a time
+    def launchJob(self, job, width, testDef, done):
+        if 1 == width:
+            job['results'] = self.runJob(job, testDef)
+            done.put(job)
+        else:
+            t = threading.Thread(target=self.executeTest, args=(job, testDef, done))
+            t.daemon = True
+            t.start()
+
+    # write the script that runs a batch of tests in turn under a single
+    # launch. Each process of the job runs every test, tagging each line
+    # of its output with the index of the test and noting the start and
+    # exit status of each test with markers carrying its rank and the time
+    def batchScript(self, batch, testDef):
+        bdir = os.path.join(testDef.options['scratchdir'], "batch")
+        try:
+            os.makedirs(bdir)
+        except OSError:
+            pass
+        path = os.path.join(bdir, "batch%d-%d.sh" % (os.getpid(), next(self.batchIds)))
+        lines = ["#!/bin/sh",
+                 "rank=${OMPI_COMM_WORLD_RANK:-${PMIX_RANK:-${SLURM_PROCID:-0}}}",
+                 'rc="${TMPDIR:-/tmp}/mtt-batch.$$"']
+        for i,test in enumerate(batch):
+            cmd = " ".join([quote(arg) for arg in test.split()])
+            lines.append('echo "##MTT-BEGIN %d $rank @`date +%%s.%%N`"' % i)
+            lines.append('{ { %s; echo $? >"$rc"; } 2>&1 1>&3 | sed "s/^/##MTT-%d /" >&2; } 3>&1 | sed "s/^/##MTT-%d /"' % (cmd, i, i))
+            lines.append('echo "##MTT-END %d $rank `cat "$rc"` @`date +%%s.%%N`"' % i)
+        lines.append('rm -f "$rc"')
+        lines.append("exit 0")
+        with open(path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.chmod(path, 0o755)
+        return path
+
+    # the options for executing a batch - the batch is allowed the sum of
+    # the timeouts of its tests, each test's derived from its history if
+    # requested and possible, and the output of the batch is kept in full
+    # so it can be split between the tests. The output of a test is only
+    # seen once it has been tagged, so it can't be watched for stalls
+    def batchOptions(self, cmds, batch, adaptive):
+        opts = dict(cmds)
+        total = 0
+        for test in batch:
+            timeout = None
+            if adaptive:
+                timeout = self.adaptiveTimeout(self.historyKey(test, cmds), cmds)
+            if timeout is None:
+                timeout = cmds['timeout']
+            if timeout is None:
+                # a test without a timeout leaves the batch without one
+                total = None
+                break
+            total += int(timeout)
+        opts['timeout'] = total
+        opts['idle_timeout'] = None
+        opts['stdout_save_lines'] = -1
+        opts['stderr_save_lines'] = -1
+        return opts
+
+    # split the output of a batch between its tests. Returns the results
+    # of the tests that were run, along with the tests the batch never
+    # got to - e.g., because it was aborted or timed out. The results of
+    # a test that every process completed hold how long it took
+    def splitBatch(self, job, cmds):
+        results = job['results']
+        num = len(job['tests'])
+        # the ranks that began and ended each test, its exit status,
+        # and when the first process began it and the last ended it
+        begun = [set() for i in range(num)]
+        ended = [set() for i in range(num)]
+        status = [0] * num
+        first = [None] * num
+        last = [None] * num
+        output = {}
+        # the markers are on stdout, so anything the launcher says on
+        # stderr goes with the last test to begin
+        cur = 0
+        for key in ['stdout', 'stderr']:
+            # the full output may have been written to a file
             try:
-                if results['timedout']:
-                    # the test timed out, so flag it as having exited that way
+                with open(results[key + '_file']['path'], 'rb') as f:
+                    lines = [l.decode('utf-8', 'replace').rstrip() for l in f]
+            except (KeyError, IOError, OSError):
+                lines = results.get(key) or []
+                if not isinstance(lines, list):
+                    lines = str(lines).splitlines()
+            parts = [[] for i in range(num)]
+            for line in lines:
+                m = batchMarker.search(line)
+                if m is not None and int(m.group(2)) < num:
+                    i = int(m.group(2))
+                    when = float(m.group(5)) if m.group(5) else None
+                    if m.group(1) == "BEGIN":
+                        begun[i].add(m.group(3))
+                        cur = max(cur, i)
+                        if when is not None and (first[i] is None or when < first[i]):
+                            first[i] = when
+                    else:
+                        ended[i].add(m.group(3))
+                        if m.group(4) and not status[i]:
+                            status[i] = int(m.group(4))
+                        if when is not None and (last[i] is None or when > last[i]):
+                            last[i] = when
+                    continue
+                m = batchLine.search(line)
+                if m is not None and int(m.group(1)) < num:
+                    parts[int(m.group(1))].append(m.group(2))
+                else:
+                    # anything said by the launcher goes with the latest test
+                    parts[cur].append(line)
+            # keep as much of the output of each test as requested
+            try:
+                keep = int(cmds[key + '_save_lines'])
+            except (KeyError, TypeError, ValueError):
+                keep = -1
+            if 0 < keep:
+                parts = [p[-keep:] for p in parts]
+            output[key] = parts
+        # every process begins the first test
+        ranks = begun[0]
+        runs = []
+        leftover = []
+        for i,test in enumerate(job['tests']):
+            res = {'stdout': output['stdout'][i], 'stderr': output['stderr'][i]}
+            if ranks and ended[i] >= ranks:
+                res['status'] = status[i]
+                if first[i] is not None and last[i] is not None:
+                    res['elapsed'] = max(0.0, last[i] - first[i])
+            elif begun[i]:
+                # the batch ended while running this test
+                res['status'] = results['status'] if results['status'] else status[i]
+                for key in ['timedout', 'stalled']:
+                    if key in results:
+                        res[key] = results[key]
+            else:
+                leftover.append((test, job['logs'][i]))
+                continue
+            runs.append((test, job['logs'][i], res))
+        return runs, leftover
+
+    # the body of the thread executing a test when running more than one
+    # test at a time - the job is passed back to the launcher when done
+    def executeTest(self, job, testDef, done):
+        try:
+            job['results'] = self.runJob(job, testDef)
+        except Exception as e:
+            job['results'] = {'status': 1, 'stdout': [], 'stderr': ["Exception was raised: %s %s" % (type(e), str(e))]}
+        done.put(job)
+
+    # record the results of a test in its log and classify it
+    def classifyTest(self, test, testLog, results, testDef):
+        testLog['status'] = results['status']
+        testLog['stdout'] = results['stdout']
+        testLog['stderr'] = results['stderr']
+        # the full output may have been written to files, and
+        # the resources used by the test may have been collected
+        for key in ['stdout_file', 'stderr_file', 'rusage']:
+            if key in results:
+                testLog[key] = results[key]
+        try:
+            testLog['time'] = results['time']
+        except:
+            pass
+
+        try:
+            if results['timedout']:
+                # the test timed out, so flag it as having exited that way -
+                # noting if it was killed for producing no output
+                if 'stalled' in results:
+                    testLog['result'] = testDef.MTT_TEST_STALLED
+                    self.numStalled += 1
+                else:
                     testLog['result'] = testDef.MTT_TEST_TIMED_OUT
+                    self.numTimed += 1
+                if 0 == self.finalStatus:
+                    self.finalStatus = results['status']
+                    self.finalError = results['stderr']
+        except:
+            # check the return status - if the test checked its conditions
+            # and decided to be skipped, then log it as such
+            if results['status'] == self.skipStatus:
+                self.numSkip += 1
+                testLog['stdout'] = ""
+                testLog['stderr'] = ""
+                testLog['time'] = 0
+                testLog['status'] = self.skipStatus
+                # nothing a skipped test said is reported, so
+                # remove any output it spilled to files
+                for key in ['stdout_file', 'stderr_file']:
+                    try:
+                        os.remove(testLog.pop(key)['path'])
+                    except (KeyError, TypeError, OSError):
+                        pass
+                # clearly mark this as a skipped test
+                testLog['result'] = testDef.MTT_TEST_SKIPPED
+            elif None == self.expected_returncodes[test]:
+                if 0 != results['status']:
+                    testLog['result'] = testDef.MTT_TEST_PASSED
+                    self.numPass += 1
+                else:
+                    testLog['result'] = testDef.MTT_TEST_FAILED
                     if 0 == self.finalStatus:
-                        self.finalStatus = results['status']
+                        self.finalStatus = 1
                         self.finalError = results['stderr']
-                    self.numTimed += 1
-            except:
-                # check the return status - if the test checked its conditions
-                # and decided to be skipped, then log it as such
-                if results['status'] == self.skipStatus:
+                    self.numFail += 1
+            elif results['status'] != self.expected_returncodes[test]:
+                # if the test was expected to fail, then
+                # we should see it return the expected code or else we declare it
+                # as having failed
+                testLog['result'] = testDef.MTT_TEST_FAILED
+                if 0 == self.finalStatus:
+                    self.finalStatus = results['status']
+                    self.finalError = results['stderr']
+                self.numFail += 1
+            else:
+                testLog['result'] = testDef.MTT_TEST_PASSED
+                self.numPass += 1
+
+    def runTests(self, log, cmdargs, cmds, testDef):
+        log['testresults'] = []
+        # derive the timeout of each test from its earlier runs, if requested
+        try:
+            adaptive = str(cmds['adaptive_timeout']).strip().lower() in ['y', 'yes', 't', 'true', '1']
+        except KeyError:
+            adaptive = False
+        # run the tests in the requested order
+        try:
+            order = str(cmds['test_order']).strip().lower()
+        except KeyError:
+            order = "original"
+        if order not in ["longest", "shortest", "failed"]:
+            order = "original"
+        # the history of the tests is kept if either needs it
+        history = adaptive or order != "original"
+        if history:
+            self.loadHistory(testDef)
+        # see how many tests we may run at a time - if more than one,
+        # they are packed onto the slots available to us
+        try:
+            width = int(cmds['max_concurrent'])
+        except (KeyError, TypeError, ValueError):
+            width = 1
+        self.slots = []
+        self.totalSlots = 0
+        if width != 1:
+            self.setupSlots(cmds, testDef)
+            if width < 1:
+                # as many as the slots allow
+                width = max(1, self.totalSlots)
+        try:
+            nprocs = int(cmds['np'])
+        except (KeyError, TypeError, ValueError):
+            nprocs = None
+        done = Queue()
+        if order != "original":
+            pending = deque(self.orderTests(self.tests, order, cmds, testDef))
+        else:
+            pending = deque(self.tests)
+        # tests may be run in batches, each launched once to run
+        # its tests in turn
+        try:
+            batchSize = int(cmds['batch_size'])
+        except (KeyError, TypeError, ValueError):
+            batchSize = 1
+        # the tests to be run by themselves
+        single = set()
+        running = 0
+        inflight = 0
+        while pending or running:
+            # start as many tests as we can
+            while pending and running < width and self.numTests + inflight < self.maxTests:
+                test = pending[0]
+                testLog = {'test':test}
+                testLog['cmd'] = " ".join(cmdargs + [test])
+
+                # check if we should skip this test
+                if test in self.skip_tests:
+                    pending.popleft()
+                    # track number of tests we skipped. We record its
+                    # status as the one we were told to use for
+                    # a "skipped" test since we obviously didn't
+                    # really execute it
                     self.numSkip += 1
                     testLog['stdout'] = ""
                     testLog['stderr'] = ""
@@ -444,40 +1083,120 @@ class LauncherMTTTool(IPlugin):
                     testLog['status'] = self.skipStatus
                     # clearly mark this as a skipped test
                     testLog['result'] = testDef.MTT_TEST_SKIPPED
-                elif None == self.expected_returncodes[test]:
-                    if 0 != results['status']:
-                        testLog['result'] = testDef.MTT_TEST_PASSED
-                        self.numPass += 1
-                    else:
-                        testLog['result'] = testDef.MTT_TEST_FAILED
-                        if 0 == self.finalStatus:
-                            self.finalStatus = 1
-                            self.finalError = results['stderr']
-                        self.numFail += 1
-                elif results['status'] != self.expected_returncodes[test]:
-                    # if the test was expected to fail, then
-                    # we should see it return the expected code or else we declare it
-                    # as having failed
+                    log['testresults'].append(testLog)
+                    continue
+
+                # wait for enough slots to free up
+                claim = self.claimSlots(nprocs, running > 0)
+                if claim is None:
+                    break
+                pending.popleft()
+                # gather the tests that follow into a batch, if requested
+                batch = [test]
+                if 1 < batchSize and test not in single:
+                    while pending and len(batch) < batchSize and self.numTests + inflight + len(batch) < self.maxTests:
+                        if pending[0] in self.skip_tests or pending[0] in single:
+                            break
+                        batch.append(pending.popleft())
+
+                harass_exec_ids = testDef.harasser.start(testDef)
+
+                harass_check = testDef.harasser.check(harass_exec_ids, testDef)
+                if harass_check is not None:
+                    self.releaseSlots(claim)
+                    # only the first test of a batch is failed
+                    for t in reversed(batch[1:]):
+                        pending.appendleft(t)
+                    testLog['stderr'] = 'Not all harasser scripts started. These failed to start: ' \
+                                    + ','.join([h_info[1]['start_script'] for h_info in harass_check[0]])
+                    testLog['time'] = sum([r_info[3] for r_info in harass_check[1]])
+                    testLog['status'] = 1
                     testLog['result'] = testDef.MTT_TEST_FAILED
                     if 0 == self.finalStatus:
-                        self.finalStatus = results['status']
-                        self.finalError = results['stderr']
+                        self.finalStatus = 1
+                        self.finalError = testLog['stderr']
                     self.numFail += 1
-                else:
-                    testLog['result'] = testDef.MTT_TEST_PASSED
-                    self.numPass += 1
-            try:
-                testLog['np'] = cmds['np']
-            except KeyError:
-                try:
-                    testLog['np'] = cmds['ppn']
-                except:
-                    testLog['np'] = -1
-            log['testresults'].append(testLog)
-            cmdargs = cmdargs[:-1]
-            self.numTests = self.numTests + 1
-            if self.numTests == self.maxTests:
+                    self.numTests += 1
+                    testDef.harasser.stop(harass_exec_ids, testDef)
+                    log['testresults'].append(testLog)
+                    continue
+
+                job = {'tests': batch, 'logs': [], 'claim': claim, 'harass': harass_exec_ids, 'opts': cmds}
+                hostargs = self.hostArgs(claim)
+                for t in batch:
+                    job['logs'].append({'test': t, 'cmd': " ".join(cmdargs + hostargs + [t])})
+                # keep the results in the order of the tests
+                log['testresults'].extend(job['logs'])
+                inflight += len(batch)
+                if 1 < len(batch):
+                    testDef.logger.verbose_print("Running a batch of %d tests" % len(batch))
+                    job['batch'] = self.batchScript(batch, testDef)
+                    job['cmdargs'] = cmdargs + hostargs + [job['batch']]
+                    job['opts'] = self.batchOptions(cmds, batch, adaptive)
+                    if adaptive:
+                        testDef.logger.verbose_print("Using a timeout of %s seconds for the batch" % job['opts']['timeout'])
+                    self.launchJob(job, width, testDef, done)
+                    running += 1
+                    continue
+                testLog = job['logs'][0]
+                job['cmdargs'] = cmdargs + hostargs + [test]
+                if history:
+                    job['histkey'] = self.historyKey(test, cmds)
+                    job['start'] = datetime.datetime.now()
+                if adaptive:
+                    timeout = self.adaptiveTimeout(job['histkey'], cmds)
+                    if timeout is not None:
+                        testDef.logger.verbose_print("Using a timeout of %d seconds for %s" % (timeout, test))
+                        job['opts'] = dict(cmds)
+                        job['opts']['timeout'] = timeout
+                        testLog['timeout'] = timeout
+                self.launchJob(job, width, testDef, done)
+                running += 1
+
+            if not running:
                 break
+
+            # wait for a test to complete
+            job = done.get()
+            running -= 1
+            inflight -= len(job['tests'])
+            self.releaseSlots(job['claim'])
+
+            testDef.harasser.stop(job['harass'], testDef)
+
+            if 'batch' in job:
+                # split the output of the batch between its tests - those
+                # it didn't get to are run by themselves
+                runs, leftover = self.splitBatch(job, cmds)
+                os.remove(job['batch'])
+                for test, testLog in reversed(leftover):
+                    log['testresults'] = [t for t in log['testresults'] if t is not testLog]
+                    single.add(test)
+                    pending.appendleft(test)
+            else:
+                runs = [(job['tests'][0], job['logs'][0], job['results'])]
+
+            for test, testLog, results in runs:
+                self.classifyTest(test, testLog, results, testDef)
+                # only the durations of tests that passed tell us how long
+                # a test should take, but all results are kept. The tests
+                # of a batch were timed by the batch itself - one it cut
+                # short has no duration to go by
+                if history and testLog['result'] != testDef.MTT_TEST_SKIPPED:
+                    if 'batch' in job:
+                        secs = results.get('elapsed')
+                    else:
+                        secs = (datetime.datetime.now() - job['start']).total_seconds()
+                    if secs is not None or testLog['result'] != testDef.MTT_TEST_PASSED:
+                        self.recordResult(self.historyKey(test, cmds), secs, testLog['result'], testDef)
+                try:
+                    testLog['np'] = cmds['np']
+                except KeyError:
+                    try:
+                        testLog['np'] = cmds['ppn']
+                    except:
+                        testLog['np'] = -1
+                self.numTests = self.numTests + 1
         # record the results
         log['status'] = self.finalStatus
         log['stderr'] = self.finalError
@@ -486,9 +1205,28 @@ class LauncherMTTTool(IPlugin):
         log['numSkip'] = self.numSkip
         log['numFail'] = self.numFail
         log['numTimed'] = self.numTimed
+        log['numStalled'] = self.numStalled
         return
 
     def deallocateCluster(self, log, cmds, testDef):
+        # keep a shared allocation open while a later section will use
+        # it - it is released by the last of them. Without a log, the
+        # section failed and only its own allocation is released, the
+        # rest being released when we are deactivated
+        key = self.allocation
+        self.allocation = None
+        if key is not None:
+            if log is not None and key in allocations:
+                later = self.laterUser(key, log['section'], testDef)
+                if later is not None:
+                    allocations[key]['next'] = later
+                    return 0
+            status, stderr = self.releaseAllocations(testDef, key)
+            if 0 != status and log is not None:
+                log['status'] = status
+                log['stderr'] = stderr
+                return 1
+            return 0
         if cmds['deallocate_cmd'] is not None and self.allocated:
             deallocate_cmdargs = shlex.split(cmds['deallocate_cmd'])
             results = testDef.execmd.execute(cmds, deallocate_cmdargs, testDef)
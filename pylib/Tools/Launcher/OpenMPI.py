@@ -25,6 +25,11 @@ import shlex
 # @param np                        Number of processes to run
 # @param ppn                       Number of processes per node to run
 # @param timeout                   Maximum execution time - terminate a test if it exceeds this time
+# @param idle_timeout              Terminate a test if it produces no output for this many seconds
+# @param adaptive_timeout          Derive the timeout of each test from the durations of its earlier runs
+# @param timeout_multiplier        Multiple of the 99th percentile of earlier durations to use as an adaptive timeout
+# @param timeout_floor             Minimum adaptive timeout in seconds
+# @param timeout_cap               Maximum adaptive timeout in seconds (defaults to the timeout)
 # @param options                   Comma-delimited sets of command line options that shall be used on each test
 # @param skipped                   Exit status of a test that declares it was skipped
 # @param merge_stdout_stderr       Merge stdout and stderr into one output stream
@@ -35,9 +40,15 @@ import shlex
 # @param fail_timeout              Maximum execution time for tests expected to fail
 # @param skip_tests                Names of tests to be skipped
 # @param max_num_tests             Maximum number of tests to run
+# @param max_concurrent            Maximum number of tests to run at a time, packed onto the slots of the hostfile or allocation (0 for as many as the slots allow)
+# @param test_order                Order in which to run the tests: original, or longest, shortest or failed first as recorded in earlier runs
+# @param shard_by                  Split the tests across the shards given by --shard by name, or by the durations in the shard_history file
+# @param shard_history             History file of earlier runs to balance the shards by with shard_by = duration - every client must be given the same file
+# @param batch_size                Number of tests to run in turn under a single launch, for suites of many short tests - every process of the launch runs each test
 # @param test_list                 List of tests to run, default is all
 # @param allocate_cmd              Command to use for allocating nodes from the resource manager
 # @param deallocate_cmd            Command to use for deallocating nodes from the resource manager
+# @param allocation_key            Name of an allocation to be shared by the TestRun sections giving the same name - it is released after the last of them
 # @param modules_unload  Modules to unload
 # @param modules         Modules to load
 # @param modules_swap    Modules to swap
@@ -54,6 +65,11 @@ class OpenMPI(LauncherMTTTool):
         self.options['np'] = (None, "Number of processes to run")
         self.options['ppn'] = (None, "Number of processes per node to run")
         self.options['timeout'] = (None, "Maximum execution time - terminate a test if it exceeds this time")
+        self.options['idle_timeout'] = (None, "Terminate a test if it produces no output for this many seconds")
+        self.options['adaptive_timeout'] = (False, "Derive the timeout of each test from the durations of its earlier runs")
+        self.options['timeout_multiplier'] = ("3", "Multiple of the 99th percentile of earlier durations to use as an adaptive timeout")
+        self.options['timeout_floor'] = ("30", "Minimum adaptive timeout in seconds")
+        self.options['timeout_cap'] = (None, "Maximum adaptive timeout in seconds (defaults to the timeout)")
         self.options['options'] = (None, "Comma-delimited sets of command line options that shall be used on each test")
         self.options['skipped'] = ("77", "Exit status of a test that declares it was skipped")
         self.options['merge_stdout_stderr'] = (False, "Merge stdout and stderr into one output stream")
@@ -64,9 +80,15 @@ class OpenMPI(LauncherMTTTool):
         self.options['fail_timeout'] = (None, "Maximum execution time for tests expected to fail")
         self.options['skip_tests'] = (None, "Names of tests to be skipped")
         self.options['max_num_tests'] = (None, "Maximum number of tests to run")
+        self.options['max_concurrent'] = ("1", "Maximum number of tests to run at a time, packed onto the slots of the hostfile or allocation (0 for as many as the slots allow)")
+        self.options['test_order'] = ("original", "Order in which to run the tests: original, or longest, shortest or failed first as recorded in earlier runs")
+        self.options['shard_by'] = ("name", "Split the tests across the shards given by --shard by name, or by the durations in the shard_history file")
+        self.options['shard_history'] = (None, "History file of earlier runs to balance the shards by with shard_by = duration - every client must be given the same file")
+        self.options['batch_size'] = ("1", "Number of tests to run in turn under a single launch, for suites of many short tests - every process of the launch runs each test")
         self.options['test_list'] = (None, "List of tests to run, default is all")
         self.options['allocate_cmd'] = (None, "Command to use for allocating nodes from the resource manager")
         self.options['deallocate_cmd'] = (None, "Command to use for deallocating nodes from the resource manager")
+        self.options['allocation_key'] = (None, "Name of an allocation to be shared by the TestRun sections giving the same name - it is released after the last of them")
         self.options['modules'] = (None, "Modules to load")
         self.options['modules_unload'] = (None, "Modules to unload")
         self.options['modules_swap'] = (None, "Modules to swap")
@@ -89,6 +111,9 @@ class OpenMPI(LauncherMTTTool):
         if self.testDef and self.cmds and self.cmds['deallocate_cmd'] is not None:
             deallocate_cmdargs = shlex.split(self.cmds['deallocate_cmd'])
             self.deallocateCluster(None, self.cmds, self.testDef)
+        if self.testDef:
+            # release the allocations still kept for later sections
+            self.releaseAllocations(self.testDef)
 
     def print_name(self):
         return "OpenMPI"
@@ -99,6 +124,12 @@ class OpenMPI(LauncherMTTTool):
             print(prefix + line)
         return
 
+    # place a test on the slots claimed for it
+    def hostArgs(self, claim):
+        if not claim:
+            return []
+        return ["--host", ",".join(["%s:%d" % (host, num) for host, num in claim])]
+
     def execute(self, log, keyvals, testDef):
         self.testDef = testDef
         testDef.logger.verbose_print("OpenMPI Launcher")
@@ -122,7 +153,7 @@ class OpenMPI(LauncherMTTTool):
             return
 
         # collect the tests to be considered
-        status = self.collectTests(log, cmds)
+        status = self.collectTests(log, cmds, testDef)
         # check that we found something
         if status != 0:
             # something went wrong - error is in the log
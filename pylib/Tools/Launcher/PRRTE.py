@@ -14,7 +14,8 @@ from __future__ import print_function
 import os, time
 from LauncherMTTTool import *
 import shlex
-from subprocess import Popen, PIPE
+import threading
+from subprocess import Popen, PIPE, STDOUT
 
 ## @addtogroup Tools
 # @{
@@ -26,6 +27,11 @@ from subprocess import Popen, PIPE
 # @param np                        Number of processes to run
 # @param ppn                       Number of processes per node to run
 # @param timeout                   Maximum execution time - terminate a test if it exceeds this time
+# @param idle_timeout              Terminate a test if it produces no output for this many seconds
+# @param adaptive_timeout          Derive the timeout of each test from the durations of its earlier runs
+# @param timeout_multiplier        Multiple of the 99th percentile of earlier durations to use as an adaptive timeout
+# @param timeout_floor             Minimum adaptive timeout in seconds
+# @param timeout_cap               Maximum adaptive timeout in seconds (defaults to the timeout)
 # @param options                   Comma-delimited sets of command line options that shall be used on each test
 # @param skipped                   Exit status of a test that declares it was skipped
 # @param merge_stdout_stderr       Merge stdout and stderr into one output stream
@@ -36,14 +42,20 @@ from subprocess import Popen, PIPE
 # @param fail_timeout              Maximum execution time for tests expected to fail
 # @param skip_tests                Names of tests to be skipped
 # @param max_num_tests             Maximum number of tests to run
+# @param max_concurrent            Maximum number of tests to run at a time, packed onto the slots of the hostfile or allocation (0 for as many as the slots allow)
+# @param test_order                Order in which to run the tests: original, or longest, shortest or failed first as recorded in earlier runs
+# @param shard_by                  Split the tests across the shards given by --shard by name, or by the durations in the shard_history file
+# @param shard_history             History file of earlier runs to balance the shards by with shard_by = duration - every client must be given the same file
 # @param test_list                 List of tests to run, default is all
 # @param allocate_cmd              Command to use for allocating nodes from the resource manager
 # @param deallocate_cmd            Command to use for deallocating nodes from the resource manager
+# @param allocation_key            Name of an allocation to be shared by the TestRun sections giving the same name - it is released after the last of them
 # @param modules_unload  Modules to unload
 # @param modules         Modules to load
 # @param modules_swap    Modules to swap
 # @param dependencies              List of dependencies specified as the build stage name
 # @param waittime                  Number of seconds to wait for PRRTE DVM to start before executing tests
+# @param persistent_dvm            Keep the PRRTE DVM running for later TestRun sections on the same hosts instead of starting one for each section
 # @}
 class PRRTE(LauncherMTTTool):
 
@@ -56,6 +68,11 @@ class PRRTE(LauncherMTTTool):
         self.options['np'] = (None, "Number of processes to run")
         self.options['ppn'] = (None, "Number of processes per node to run")
         self.options['timeout'] = (None, "Maximum execution time - terminate a test if it exceeds this time")
+        self.options['idle_timeout'] = (None, "Terminate a test if it produces no output for this many seconds")
+        self.options['adaptive_timeout'] = (False, "Derive the timeout of each test from the durations of its earlier runs")
+        self.options['timeout_multiplier'] = ("3", "Multiple of the 99th percentile of earlier durations to use as an adaptive timeout")
+        self.options['timeout_floor'] = ("30", "Minimum adaptive timeout in seconds")
+        self.options['timeout_cap'] = (None, "Maximum adaptive timeout in seconds (defaults to the timeout)")
         self.options['options'] = (None, "Comma-delimited sets of command line options that shall be used on each test")
         self.options['skipped'] = ("77", "Exit status of a test that declares it was skipped")
         self.options['merge_stdout_stderr'] = (False, "Merge stdout and stderr into one output stream")
@@ -66,18 +83,28 @@ class PRRTE(LauncherMTTTool):
         self.options['fail_timeout'] = (None, "Maximum execution time for tests expected to fail")
         self.options['skip_tests'] = (None, "Comma-delimited names of tests to be skipped")
         self.options['max_num_tests'] = (None, "Maximum number of tests to run")
+        self.options['max_concurrent'] = ("1", "Maximum number of tests to run at a time, packed onto the slots of the hostfile or allocation (0 for as many as the slots allow)")
+        self.options['test_order'] = ("original", "Order in which to run the tests: original, or longest, shortest or failed first as recorded in earlier runs")
+        self.options['shard_by'] = ("name", "Split the tests across the shards given by --shard by name, or by the durations in the shard_history file")
+        self.options['shard_history'] = (None, "History file of earlier runs to balance the shards by with shard_by = duration - every client must be given the same file")
         self.options['test_list'] = (None, "Comma-delimited list of tests to run, default is all")
         self.options['allocate_cmd'] = (None, "Command to use for allocating nodes from the resource manager")
         self.options['deallocate_cmd'] = (None, "Command to use for deallocating nodes from the resource manager")
+        self.options['allocation_key'] = (None, "Name of an allocation to be shared by the TestRun sections giving the same name - it is released after the last of them")
         self.options['modules'] = (None, "Modules to load")
         self.options['modules_unload'] = (None, "Modules to unload")
         self.options['modules_swap'] = (None, "Modules to swap")
         self.options['dependencies'] = (None, "List of dependencies specified as the build stage name - e.g., MiddlwareBuild_package to be added to configure using --with-package=location")
         self.options['waittime'] = (5, "Number of seconds to wait for PRRTE DVM to start before executing tests")
+        self.options['persistent_dvm'] = (False, "Keep the PRRTE DVM running for later TestRun sections on the same hosts instead of starting one for each section")
 
         self.allocated = False
         self.testDef = None
         self.cmds = None
+        # the DVM the tests are launched into
+        self.dvm = None
+        self.dvmLock = threading.Lock()
+        self.maxDVMRestarts = 3
         return
 
 
@@ -89,9 +116,14 @@ class PRRTE(LauncherMTTTool):
 
     def deactivate(self):
         IPlugin.deactivate(self)
+        if self.testDef:
+            self.stopDVM(self.testDef)
         if self.testDef and self.cmds and self.cmds['deallocate_cmd'] is not None:
             deallocate_cmdargs = shlex.split(self.cmds['deallocate_cmd'])
             self.deallocateCluster(None, self.cmds, self.testDef)
+        if self.testDef:
+            # release the allocations still kept for later sections
+            self.releaseAllocations(self.testDef)
 
     def print_name(self):
         return "PRRTE"
@@ -102,6 +134,133 @@ class PRRTE(LauncherMTTTool):
             print(prefix + line)
         return
 
+    # the DVM can only be reused by sections that launch the same
+    # PRRTE onto the same hosts
+    def dvmKey(self, cmds):
+        return (cmds['hostfile'], os.environ.get('PATH'), os.environ.get('LD_LIBRARY_PATH'))
+
+    # start the PRRTE DVM and wait for it to be ready - it has written
+    # the rendezvous file prun reaches it by once it is up
+    def startDVM(self, log, cmds, testDef):
+        # define a unique rendezvous file for prun to use
+        # to reach the DVM - protects against case where
+        # multiple DVMs are in simultaneous operation
+        pth = os.path.join(os.getcwd(), "prte.rnd." + str(testDef.signature))
+        try:
+            os.remove(pth)
+        except OSError:
+            pass
+        os.environ['PMIX_LAUNCHER_RENDEZVOUS_FILE'] = pth
+        cmdargs = ['prte']
+        if cmds['hostfile'] is not None:
+            cmdargs.append("--hostfile")
+            cmdargs.append(cmds['hostfile'])
+        testDef.logger.verbose_print("Starting PRRTE DVM: " + " ".join(cmdargs))
+        # keep what the DVM says in a file - nobody reads its pipes
+        with open(pth + ".log", 'w') as out:
+            process = Popen(cmdargs, stdout=out, stderr=STDOUT)
+        deadline = time.time() + int(cmds['waittime'])
+        while time.time() < deadline and process.poll() is None and not os.path.exists(pth):
+            time.sleep(0.1)
+        if process.poll() is not None:
+            log['status'] = 1
+            try:
+                with open(pth + ".log", 'r') as f:
+                    log['stderr'] = ["PRRTE DVM failed to start"] + f.read().splitlines()
+            except IOError:
+                log['stderr'] = ["PRRTE DVM failed to start"]
+            del os.environ['PMIX_LAUNCHER_RENDEZVOUS_FILE']
+            return 1
+        self.dvm = {'process': process, 'rendezvous': pth, 'key': self.dvmKey(cmds),
+                    'cmds': cmds, 'restarts': 0, 'pid': os.getpid(),
+                    'allocation': self.allocation}
+        return 0
+
+    # stop the PRRTE DVM, if one is running
+    def stopDVM(self, testDef):
+        if self.dvm is None:
+            return
+        dvm = self.dvm
+        self.dvm = None
+        # a forked worker of the parallel executor can't reach
+        # the DVM of its parent - it just forgets about it
+        if dvm['pid'] != os.getpid():
+            return
+        process = dvm['process']
+        if process.poll() is None:
+            testDef.logger.verbose_print("Stopping PRRTE DVM")
+            env = dict(os.environ)
+            env['PMIX_LAUNCHER_RENDEZVOUS_FILE'] = dvm['rendezvous']
+            testDef.execmd.execute(dvm['cmds'], ["prun", "--terminate"], testDef, env=env)
+            deadline = time.time() + int(dvm['cmds']['waittime'])
+            while time.time() < deadline and process.poll() is None:
+                time.sleep(0.1)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        try:
+            os.remove(dvm['rendezvous'])
+        except OSError:
+            pass
+
+    # make sure the DVM is still up, restarting it if it died - returns
+    # the DVM to launch into, or None if it could not be restarted
+    def checkDVM(self, testDef):
+        with self.dvmLock:
+            dvm = self.dvm
+            if dvm is None or dvm['process'].poll() is None:
+                return dvm
+            if self.maxDVMRestarts <= dvm['restarts']:
+                return None
+            testDef.logger.verbose_print("PRRTE DVM died with status %d - restarting it" % dvm['process'].returncode)
+            self.stopDVM(testDef)
+            log = {}
+            if 0 != self.startDVM(log, dvm['cmds'], testDef):
+                testDef.logger.verbose_print("\n".join(log['stderr']))
+                return None
+            self.dvm['restarts'] = dvm['restarts'] + 1
+            return self.dvm
+
+    # launch a test into the DVM - if the DVM dies under the test,
+    # the test is run again once the DVM has been restarted
+    def runJob(self, job, testDef):
+        for attempt in range(2):
+            dvm = self.checkDVM(testDef)
+            if dvm is None:
+                return {'status': 1, 'stdout': [], 'stderr': ["PRRTE DVM is not running"]}
+            results = LauncherMTTTool.runJob(self, job, testDef)
+            if dvm['process'].poll() is None:
+                break
+            testDef.logger.verbose_print("PRRTE DVM died while running " + " ".join(job['cmdargs']))
+        return results
+
+    # a DVM kept for later sections would be orphaned once the
+    # worker process that started it exits
+    def releaseKept(self, testDef):
+        self.stopDVM(testDef)
+        LauncherMTTTool.releaseKept(self, testDef)
+
+    # the DVM runs on the allocated nodes, so it can't outlive them
+    def deallocateCluster(self, log, cmds, testDef):
+        if self.allocated or log is None or \
+                (self.allocation is not None and self.laterUser(self.allocation, log['section'], testDef) is None):
+            self.stopDVM(testDef)
+        return LauncherMTTTool.deallocateCluster(self, log, cmds, testDef)
+
+    # nor can it outlive a shared allocation released because the
+    # section due to use it next was not executed
+    def sectionDone(self, testDef, title):
+        LauncherMTTTool.sectionDone(self, testDef, title)
+        if self.dvm is not None and self.dvm['allocation'] is not None and \
+                self.dvm['allocation'] not in allocations:
+            self.stopDVM(testDef)
+
+    # place a test on the slots claimed for it
+    def hostArgs(self, claim):
+        if not claim:
+            return []
+        return ["--host", ",".join(["%s:%d" % (host, num) for host, num in claim])]
+
     def execute(self, log, keyvals, testDef):
         self.testDef = testDef
         testDef.logger.verbose_print("PRRTE Launcher")
@@ -183,7 +342,7 @@ class PRRTE(LauncherMTTTool):
             return
 
         # collect the tests to be considered
-        status = self.collectTests(log, cmds)
+        status = self.collectTests(log, cmds, testDef)
         # check that we found something
         if status != 0:
             # something went wrong - error is in the log
@@ -212,22 +371,29 @@ class PRRTE(LauncherMTTTool):
             self.resetPaths(log, testDef)
             return
 
-        # define a unique rendezvous file for prun to use
-        # to reach the DVM - protects against case where
-        # multiple DVMs are in simultaneous operation
-        pth = "prte.rnd." + str(testDef.signature)
-        os.environ['PMIX_LAUNCHER_RENDEZVOUS_FILE'] = os.path.join(os.getcwd(), pth)
-
-        # start the PRRTE DVM
-        process = Popen(['prte'], stdout=PIPE, stderr=PIPE)
-        # wait a little for the prte daemon to start
-        time.sleep(int(cmds['waittime']))
+        # start the PRRTE DVM - unless one left running by an
+        # earlier section can be reused
+        persistent = str(cmds['persistent_dvm']).strip().lower() in ['y', 'yes', 't', 'true', '1']
+        if persistent and self.dvm is not None and self.dvm['key'] == self.dvmKey(cmds) \
+                and self.dvm['pid'] == os.getpid() and self.dvm['process'].poll() is None:
+            testDef.logger.verbose_print("Reusing PRRTE DVM")
+            os.environ['PMIX_LAUNCHER_RENDEZVOUS_FILE'] = self.dvm['rendezvous']
+            self.dvm['cmds'] = cmds
+            self.dvm['restarts'] = 0
+        else:
+            self.stopDVM(testDef)
+            status = self.startDVM(log, cmds, testDef)
+            if 0 != status:
+                self.deallocateCluster(None, cmds, testDef)
+                self.resetPaths(log, testDef)
+                return
 
         # execute the tests
         self.runTests(log, cmdargs, cmds, testDef)
 
         # stop the PRRTE DVM
-        results = testDef.execmd.execute(cmds, ["prun", "--terminate"], testDef)
+        if not persistent:
+            self.stopDVM(testDef)
 
         # cleanup the environ
         del os.environ['PMIX_LAUNCHER_RENDEZVOUS_FILE']
@@ -0,0 +1,593 @@
+# run this via pytest
+# export MTT_HOME=/path/to/mtt
+# pytest ./test_LauncherMTTTool.py
+#   add the -s argument to display print lines
+#   add the -v argument to be verbose
+# ie  pytest -sv ./test_LauncherMTTTool.py
+import pytest
+import os
+import sys
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/System"))
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/Utilities"))
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/Tools/Launcher"))
+import LauncherMTTTool as LT
+
+class FakeLogger(object):
+   printout = False
+   def verbose_print(self, *args, **kwargs):
+      pass
+   def log_execmd_elk(self, *args, **kwargs):
+      return None
+
+class FakeTestDef(object):
+   MTT_TEST_FAILED = 0
+   MTT_TEST_PASSED = 1
+   MTT_TEST_SKIPPED = 2
+   MTT_TEST_TIMED_OUT = 3
+   MTT_TEST_STALLED = 5
+   def __init__(self, scratchdir="/tmp"):
+      self.options = {'scratchdir': scratchdir}
+      self.logger = FakeLogger()
+
+def launcher(tests=None):
+   l = LT.LauncherMTTTool()
+   l.tests = tests or []
+   l.expected_returncodes = dict((t, 0) for t in l.tests)
+   l.skipStatus = 77
+   return l
+
+def test_classifyTest():
+   l = launcher(['a', 'b', 'c', 'd'])
+   l.expected_returncodes['c'] = 3
+   td = FakeTestDef()
+   logs = {}
+   for test, results in [('a', {'status': 0}), ('b', {'status': 1}), ('c', {'status': 3}),
+                         ('d', {'status': 77})]:
+      results.update({'stdout': ['out'], 'stderr': []})
+      logs[test] = {'test': test}
+      l.classifyTest(test, logs[test], results, td)
+   assert [logs[t]['result'] for t in 'abcd'] == [td.MTT_TEST_PASSED, td.MTT_TEST_FAILED,
+                                                  td.MTT_TEST_PASSED, td.MTT_TEST_SKIPPED]
+   assert (l.numPass, l.numFail, l.numSkip) == (2, 1, 1)
+   assert l.finalStatus == 1
+
+def test_classifyTimedOutAndStalled():
+   l = launcher(['a', 'b'])
+   td = FakeTestDef()
+   timed = {'test': 'a'}
+   stalled = {'test': 'b'}
+   l.classifyTest('a', timed, {'status': -15, 'stdout': [], 'stderr': [], 'timedout': True}, td)
+   l.classifyTest('b', stalled, {'status': -15, 'stdout': [], 'stderr': [], 'timedout': True, 'stalled': True}, td)
+   assert timed['result'] == td.MTT_TEST_TIMED_OUT
+   assert stalled['result'] == td.MTT_TEST_STALLED
+   assert (l.numTimed, l.numStalled) == (1, 1)
+
+def test_skippedTestDropsSpilledOutput(tmpdir):
+   l = launcher(['a'])
+   td = FakeTestDef(str(tmpdir))
+   path = os.path.join(str(tmpdir), "cmd.stdout")
+   with open(path, 'w') as f:
+      f.write("skipping\n")
+   testLog = {'test': 'a'}
+   results = {'status': 77, 'stdout': ['skipping'], 'stderr': [],
+              'stdout_file': {'path': path, 'size': 9, 'lines': 1}}
+   l.classifyTest('a', testLog, results, td)
+   assert testLog['result'] == td.MTT_TEST_SKIPPED
+   assert 'stdout_file' not in testLog
+   assert not os.path.exists(path)
+
+def timeoutCmds(**kwargs):
+   cmds = {'timeout_multiplier': "3", 'timeout_floor': "10", 'timeout_cap': None, 'timeout': None}
+   cmds.update(kwargs)
+   return cmds
+
+def test_historyRoundTrip(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   l = launcher()
+   l.loadHistory(td)
+   key = l.historyKey('a', {'np': 4})
+   for secs in [3, 1, 2]:
+      l.recordResult(key, secs, td.MTT_TEST_PASSED, td)
+   l.recordResult(key, 50, td.MTT_TEST_FAILED, td)
+   later = launcher()
+   later.loadHistory(td)
+   # only durations of passing runs are kept
+   assert list(later.history[key]) == [3, 1, 2]
+   assert later.lastResult[key] == td.MTT_TEST_FAILED
+   assert later.medianDuration(key) == 2
+   assert later.medianDuration(l.historyKey('a', {'np': 2})) is None
+
+def test_adaptiveTimeout():
+   l = launcher()
+   key = ('a', '4', None)
+   assert l.adaptiveTimeout(key, timeoutCmds()) is None
+   l.history[key] = [4] * (l.historyMinSamples - 1)
+   # not enough samples yet
+   assert l.adaptiveTimeout(key, timeoutCmds()) is None
+   l.history[key].append(8)
+   assert l.adaptiveTimeout(key, timeoutCmds()) == 24
+   # bounded below by the floor and above by the cap or fixed timeout
+   assert l.adaptiveTimeout(key, timeoutCmds(timeout_floor="60")) == 60
+   assert l.adaptiveTimeout(key, timeoutCmds(timeout_cap="20")) == 20
+   assert l.adaptiveTimeout(key, timeoutCmds(timeout="15")) == 15
+   assert l.adaptiveTimeout(key, timeoutCmds(timeout_multiplier="1.1", timeout_floor="1")) == 9
+
+def test_setupSlotsFromHostfile(tmpdir):
+   hostfile = os.path.join(str(tmpdir), "hosts")
+   with open(hostfile, 'w') as f:
+      f.write("# the nodes\nh1 slots=4\nh2 slots=2 max_slots=8\n\nh3   # one slot\n")
+   l = launcher()
+   l.setupSlots({'hostfile': hostfile}, FakeTestDef())
+   assert l.slots == [['h1', 4], ['h2', 2], ['h3', 1]]
+   assert l.totalSlots == 7
+   l.setupSlots({'hostfile': os.path.join(str(tmpdir), "missing")}, FakeTestDef())
+   assert l.slots == [] and l.totalSlots == 0
+
+def test_claimAndReleaseSlots():
+   l = launcher()
+   l.slots = [['h1', 4], ['h2', 2], ['h3', 1]]
+   l.totalSlots = 7
+   # kept on a single host where it fits
+   a = l.claimSlots(2, False)
+   assert a == [['h1', 2]]
+   b = l.claimSlots(2, True)
+   assert b == [['h1', 2]]
+   # otherwise spread over as few hosts as the free slots allow
+   c = l.claimSlots(3, True)
+   assert c == [['h2', 2], ['h3', 1]]
+   assert l.claimSlots(1, True) is None
+   l.releaseSlots(a)
+   l.releaseSlots(c)
+   assert l.slots == [['h1', 2], ['h2', 2], ['h3', 1]]
+   # tests too large or of unknown size wait for every slot
+   assert l.claimSlots(None, True) is None
+   l.releaseSlots(b)
+   d = l.claimSlots(10, False)
+   assert d == [['h1', 4], ['h2', 2], ['h3', 1]]
+   assert all(0 == s[1] for s in l.slots)
+   l.releaseSlots(d)
+   assert l.slots == [['h1', 4], ['h2', 2], ['h3', 1]]
+
+def test_claimWithoutSlots():
+   l = launcher()
+   l.slots = []
+   l.totalSlots = 0
+   assert l.claimSlots(4, True) == []
+   assert l.hostArgs([['h1', 2]]) == []
+
+def test_slurmHostArgs():
+   import SLURM
+   l = SLURM.SLURM()
+   l.cmds = {'command': 'srun', 'options': None, 'hostfile': None}
+   claim = [['h1', 2], ['h2', 1]]
+   assert l.hostArgs(claim) == ["--nodelist=h1,h2"]
+   assert l.hostArgs([]) == []
+   l.cmds['options'] = "-N 2 -w h3,h4"
+   assert l.hostArgs(claim) == []
+   l.cmds = {'command': 'mpiexec.hydra', 'options': "-bootstrap slurm", 'hostfile': None}
+   assert l.hostArgs(claim) == ["-hosts", "h1:2,h2:1"]
+
+def script(path, body):
+   with open(path, 'w') as f:
+      f.write("#!/bin/sh\n" + body + "\n")
+   os.chmod(path, 0o755)
+   return path
+
+def fakeDVM(tmpdir, monkeypatch):
+   # a prte that is up once it writes the rendezvous file, and exits
+   # if that is removed - or dies if asked to by the "die" file - plus
+   # a prun that only launches into a live DVM
+   import PRRTE
+   import ExecuteCmd
+   top = str(tmpdir)
+   bindir = os.path.join(top, "bin")
+   os.makedirs(bindir)
+   script(os.path.join(bindir, "prte"), """echo $$ >> %s/starts
+echo $$ > "$PMIX_LAUNCHER_RENDEZVOUS_FILE"
+while [ -f "$PMIX_LAUNCHER_RENDEZVOUS_FILE" ]; do
+  if [ -f %s/die ]; then rm -f %s/die; exit 9; fi
+  sleep 0.05
+done""" % (top, top, top))
+   script(os.path.join(bindir, "prun"), """r="$PMIX_LAUNCHER_RENDEZVOUS_FILE"
+if [ "$1" = "--terminate" ]; then rm -f "$r"; exit 0; fi
+[ -f "$r" ] && kill -0 `cat "$r"` 2>/dev/null || { echo "prun: no DVM" >&2; exit 1; }
+exec "$1"
+""")
+   monkeypatch.setenv('PATH', bindir + os.pathsep + os.environ['PATH'])
+   monkeypatch.chdir(top)
+   monkeypatch.delenv('PMIX_LAUNCHER_RENDEZVOUS_FILE', raising=False)
+   td = FakeTestDef(top)
+   td.signature = 1234
+   td.execmd = ExecuteCmd.ExecuteCmd()
+   l = PRRTE.PRRTE()
+   cmds = dict((k, v[0]) for k, v in l.options.items())
+   assert 0 == l.startDVM({}, cmds, td)
+   return l, td, cmds
+
+def starts(tmpdir):
+   with open(os.path.join(str(tmpdir), "starts")) as f:
+      return len(f.read().split())
+
+def test_prrteRerunsTestOnceDVMRestarted(tmpdir, monkeypatch):
+   l, td, cmds = fakeDVM(tmpdir, monkeypatch)
+   top = str(tmpdir)
+   # the first run of the test takes the DVM down with it
+   test = script(os.path.join(top, "test"), """echo run >> %s/runs
+if [ ! -f %s/done ]; then touch %s/done %s/die; sleep 0.5; fi
+echo ok""" % (top, top, top, top))
+   try:
+      results = l.runJob({'opts': cmds, 'cmdargs': ['prun', test]}, td)
+   finally:
+      l.stopDVM(td)
+   assert results['status'] == 0 and results['stdout'] == ['ok']
+   with open(os.path.join(top, "runs")) as f:
+      assert len(f.read().split()) == 2
+   assert starts(tmpdir) == 2
+
+def test_prrteStopsRestartingDVM(tmpdir, monkeypatch):
+   l, td, cmds = fakeDVM(tmpdir, monkeypatch)
+   l.maxDVMRestarts = 1
+   top = str(tmpdir)
+   # the test takes the DVM down every time
+   test = script(os.path.join(top, "test"), "touch %s/die; sleep 0.5; exit 0" % top)
+   job = {'opts': cmds, 'cmdargs': ['prun', test]}
+   try:
+      # run again once after the restart, but only once
+      l.runJob(job, td)
+      assert starts(tmpdir) == 2
+      # and not restarted any more
+      results = l.runJob(job, td)
+   finally:
+      l.stopDVM(td)
+   assert results['status'] == 1
+   assert results['stderr'] == ["PRRTE DVM is not running"]
+   assert starts(tmpdir) == 2
+
+class FakeHarasser(object):
+   # fails to start the harassers of the given launches
+   def __init__(self, failing):
+      self.failing = failing
+      self.started = 0
+      self.stopped = []
+   def start(self, testDef):
+      self.started += 1
+      return self.started
+   def check(self, ids, testDef):
+      if ids in self.failing:
+         return ([(None, {'start_script': "harass.sh"})], [(None, None, None, 0.5)])
+      return None
+   def stop(self, ids, testDef):
+      self.stopped.append(ids)
+
+def test_runTestsConcurrently(tmpdir):
+   import threading
+   import time
+   hostfile = os.path.join(str(tmpdir), "hosts")
+   with open(hostfile, 'w') as f:
+      f.write("h1 slots=4\n")
+   tests = ['t%d' % i for i in range(6)]
+   l = launcher(tests)
+   td = FakeTestDef(str(tmpdir))
+   # the harassers of the third launch fail to start
+   td.harasser = FakeHarasser([3])
+   lock = threading.Lock()
+   running = []
+   peak = []
+   def runJob(job, testDef):
+      test = job['tests'][0]
+      with lock:
+         running.append(test)
+         peak.append(len(running))
+      # the earlier tests take longer, so they complete out of order
+      time.sleep(0.05 * (6 - tests.index(test)))
+      with lock:
+         running.remove(test)
+      return {'status': 1 if test == 't1' else 0, 'stdout': [test], 'stderr': []}
+   l.runJob = runJob
+   log = {}
+   l.runTests(log, ['mpirun'], {'np': "2", 'max_concurrent': "0", 'hostfile': hostfile}, td)
+   # as many at a time as the slots allow
+   assert max(peak) == 2
+   assert log['numTests'] == 6
+   assert log['numPass'] == 4 and log['numFail'] == 2
+   # the results are in the order of the tests, however they completed
+   assert [r['test'] for r in log['testresults']] == tests
+   results = dict((r['test'], r) for r in log['testresults'])
+   assert results['t1']['status'] == 1 and results['t1']['result'] == td.MTT_TEST_FAILED
+   assert results['t2']['result'] == td.MTT_TEST_FAILED
+   assert 'harass.sh' in results['t2']['stderr']
+   assert all(results[t]['stdout'] == [t] for t in tests if t != 't2')
+   # every harasser was stopped, and every slot released
+   assert sorted(td.harasser.stopped) == list(range(1, 7))
+   assert l.slots == [['h1', 4]]
+   assert running == []
+
+def makeTree(top):
+   for d in ['a', 'a/x', 'b', 'c']:
+      os.makedirs(os.path.join(top, d))
+   for name, mode in [('t1', 0o755), ('a/t2', 0o755), ('a/x/t1', 0o755), ('a/notes', 0o644),
+                      ('b/t3', 0o755), ('c/t4', 0o755)]:
+      path = os.path.join(top, name)
+      with open(path, 'w') as f:
+         f.write("#!/bin/sh\n")
+      os.chmod(path, mode)
+
+def test_scanTestsMatchesWalk(tmpdir, monkeypatch):
+   top = str(tmpdir)
+   makeTree(top)
+   l = launcher()
+   index = l.scanTests(top)
+   monkeypatch.setattr(LT, 'scandir', None)
+   walked = l.scanTests(top)
+   # the same executables in the order os.walk visits them
+   assert index['tests'] == walked['tests']
+   assert [d for d, m in index['dirs']] == [d for d, m in walked['dirs']]
+   assert [t for t in index['tests'] if t.endswith('/t1')] == [os.path.join(top, 't1'), os.path.join(top, 'a/x/t1')]
+   assert not [t for t in index['tests'] if t.endswith('notes')]
+   assert len(index['names']['t1']) == 2
+
+def test_testIndexRescansChangedDirectories(tmpdir):
+   top = str(tmpdir)
+   makeTree(top)
+   l = launcher()
+   index = l.testIndex(top)
+   assert l.testIndex(top) is index
+   path = os.path.join(top, 'b', 't5')
+   with open(path, 'w') as f:
+      f.write("#!/bin/sh\n")
+   os.chmod(path, 0o755)
+   # make sure the change shows even if the clock is coarse
+   st = os.stat(os.path.join(top, 'b'))
+   os.utime(os.path.join(top, 'b'), (st.st_atime, st.st_mtime + 10))
+   rescanned = l.testIndex(top)
+   assert rescanned is not index
+   assert path in rescanned['tests']
+
+def test_orderTests():
+   td = FakeTestDef()
+   l = launcher()
+   cmds = {'np': 2}
+   tests = ['a', 'b', 'c', 'd']
+   l.history[l.historyKey('a', cmds)] = [5, 1, 3]
+   l.history[l.historyKey('b', cmds)] = [10]
+   l.history[l.historyKey('d', cmds)] = [1]
+   # a different number of processes has a history of its own
+   l.history[l.historyKey('d', {'np': 4})] = [100]
+   l.lastResult[l.historyKey('a', cmds)] = td.MTT_TEST_PASSED
+   l.lastResult[l.historyKey('b', cmds)] = td.MTT_TEST_FAILED
+   l.lastResult[l.historyKey('d', cmds)] = td.MTT_TEST_TIMED_OUT
+   # tests without history count as long
+   assert l.orderTests(tests, "longest", cmds, td) == ['c', 'b', 'a', 'd']
+   assert l.orderTests(tests, "shortest", cmds, td) == ['d', 'a', 'b', 'c']
+   # the order is otherwise kept
+   assert l.orderTests(tests, "failed", cmds, td) == ['b', 'd', 'a', 'c']
+   assert l.orderTests(tests, "original", cmds, td) == tests
+   assert l.orderTests(tests, "longest", {'np': 4}, td) == ['a', 'b', 'c', 'd']
+
+def test_shardDurationsFromGivenHistory(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   recorder = launcher()
+   recorder.loadHistory(td)
+   cmds = {'np': 2}
+   for secs in [4, 8, 6]:
+      recorder.recordResult(recorder.historyKey('a', cmds), secs, td.MTT_TEST_PASSED, td)
+   recorder.recordResult(recorder.historyKey('b', cmds), 99, td.MTT_TEST_FAILED, td)
+   l = launcher(['a', 'b', 'c'])
+   durations = l.shardDurations(recorder.history_file, cmds, td)
+   assert durations == {'a': 6, 'b': None, 'c': None}
+   # our own history plays no part in it
+   assert l.history == {}
+   assert l.shardDurations(os.path.join(str(tmpdir), "missing"), cmds, td) is None
+
+def batchJob(tests, results):
+   return {'tests': tests, 'logs': [{'test': t} for t in tests], 'results': results}
+
+def test_batchScriptRunsEachTest(tmpdir):
+   import subprocess
+   td = FakeTestDef(str(tmpdir))
+   tests = []
+   for name, body in [('ok', 'echo one; echo two'), ('bad', 'echo oops >&2; exit 3'), ('skip', 'exit 77')]:
+      path = os.path.join(str(tmpdir), name)
+      with open(path, 'w') as f:
+         f.write("#!/bin/sh\n" + body + "\n")
+      os.chmod(path, 0o755)
+      tests.append(path)
+   l = launcher(tests)
+   script = l.batchScript(tests, td)
+   assert script.startswith(os.path.join(str(tmpdir), "batch"))
+   p = subprocess.Popen([script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+   out, err = p.communicate()
+   results = {'status': p.returncode, 'stdout': out.decode().splitlines(), 'stderr': err.decode().splitlines()}
+   runs, leftover = l.splitBatch(batchJob(tests, results), {})
+   assert leftover == []
+   assert [(r[0], r[2]['status']) for r in runs] == [(tests[0], 0), (tests[1], 3), (tests[2], 77)]
+   assert runs[0][2]['stdout'] == ['one', 'two']
+   assert runs[1][2]['stderr'] == ['oops']
+   assert runs[2][2]['stdout'] == [] and runs[2][2]['stderr'] == []
+   # each test was timed
+   assert all(r[2]['elapsed'] >= 0 for r in runs)
+
+def test_splitBatchOfAbortedRun():
+   l = launcher()
+   tests = ['a', 'b', 'c']
+   # two ranks - the second test timed out on one of them
+   stdout = ["##MTT-BEGIN 0 0", "##MTT-BEGIN 0 1", "##MTT-0 hello", "##MTT-END 0 0 0", "##MTT-END 0 1 0",
+             "##MTT-BEGIN 1 0", "##MTT-BEGIN 1 1", "##MTT-1 working", "##MTT-END 1 1 0"]
+   stderr = ["##MTT-1 warning", "mpirun: killed by signal"]
+   results = {'status': -15, 'timedout': True, 'stdout': stdout, 'stderr': stderr}
+   runs, leftover = l.splitBatch(batchJob(tests, results), {'stdout_save_lines': 1})
+   assert [r[0] for r in runs] == ['a', 'b']
+   assert leftover == [('c', {'test': 'c'})]
+   assert runs[0][2] == {'status': 0, 'stdout': ['hello'], 'stderr': []}
+   b = runs[1][2]
+   assert b['status'] == -15 and b['timedout']
+   # untagged lines go with the test that was running
+   assert b['stderr'] == ['warning', 'mpirun: killed by signal']
+   assert b['stdout'] == ['working']
+
+def test_splitBatchKeepsFirstFailure():
+   l = launcher()
+   stdout = ["##MTT-BEGIN 0 0", "##MTT-BEGIN 0 1", "##MTT-END 0 0 0", "##MTT-END 0 1 2"]
+   runs, leftover = l.splitBatch(batchJob(['a'], {'status': 0, 'stdout': stdout, 'stderr': []}), {})
+   assert runs[0][2]['status'] == 2 and leftover == []
+
+def test_splitBatchTimesTests():
+   l = launcher()
+   # the last to end rank 1 of the first test, which took 2.5 seconds -
+   # the second only has whole seconds, and the third was cut short
+   stdout = ["##MTT-BEGIN 0 0 @100.5", "##MTT-BEGIN 0 1 @100.75", "##MTT-END 0 0 0 @102", "##MTT-END 0 1 0 @103.0",
+             "##MTT-BEGIN 1 0 @103.N", "##MTT-BEGIN 1 1 @103.N", "##MTT-END 1 0 0 @110.N", "##MTT-END 1 1 0 @109.N",
+             "##MTT-BEGIN 2 0 @110.1", "##MTT-BEGIN 2 1 @110.1", "##MTT-END 2 0 0 @111"]
+   results = {'status': -15, 'timedout': True, 'stdout': stdout, 'stderr': []}
+   runs, leftover = l.splitBatch(batchJob(['a', 'b', 'c'], results), {})
+   assert runs[0][2]['elapsed'] == 2.5
+   assert runs[1][2]['elapsed'] == 7
+   assert 'elapsed' not in runs[2][2]
+
+def test_batchOptions():
+   l = launcher()
+   batch = ['a', 'b', 'c', 'd']
+   opts = l.batchOptions({'timeout': "10", 'idle_timeout': "5", 'stdout_save_lines': 3}, batch, False)
+   assert opts['timeout'] == 40
+   assert opts['idle_timeout'] is None
+   assert opts['stdout_save_lines'] == -1 and opts['stderr_save_lines'] == -1
+   assert l.batchOptions({'timeout': None}, batch, False)['timeout'] is None
+
+def test_batchOptionsAdaptiveTimeout():
+   l = launcher()
+   cmds = timeoutCmds(timeout="100", np="2")
+   l.history[l.historyKey('a', cmds)] = [4] * l.historyMinSamples
+   l.history[l.historyKey('b', cmds)] = [5] * l.historyMinSamples
+   # the tests with enough history get their own timeouts, the rest the fixed one
+   assert l.batchOptions(cmds, ['a', 'b'], True)['timeout'] == 12 + 15
+   assert l.batchOptions(cmds, ['a', 'c'], True)['timeout'] == 12 + 100
+   assert l.batchOptions(cmds, ['a', 'b'], False)['timeout'] == 200
+   # without a fixed timeout, a test lacking history leaves the batch without one
+   cmds['timeout'] = None
+   assert l.batchOptions(cmds, ['a', 'b'], True)['timeout'] == 27
+   assert l.batchOptions(cmds, ['a', 'c'], True)['timeout'] is None
+
+def allocationTestDef(tmpdir):
+   import ExecuteCmd
+   td = FakeTestDef(str(tmpdir))
+   td.execmd = ExecuteCmd.ExecuteCmd()
+   return td
+
+def test_failedSectionReleasesOnlyItsAllocation(tmpdir, monkeypatch):
+   td = allocationTestDef(tmpdir)
+   released = os.path.join(str(tmpdir), "released")
+   monkeypatch.setattr(LT, 'allocations', {})
+   for key in ['mine', 'other']:
+      LT.allocations[key] = {'cmds': {'deallocate_cmd': "sh -c 'echo %s >> %s'" % (key, released)},
+                             'pid': os.getpid(), 'next': None}
+   l = launcher()
+   l.allocation = 'mine'
+   assert 0 == l.deallocateCluster(None, {'deallocate_cmd': None}, td)
+   assert list(LT.allocations.keys()) == ['other']
+   assert l.allocation is None
+   # the rest go when the launcher is done
+   l.releaseAllocations(td)
+   assert LT.allocations == {}
+   with open(released) as f:
+      assert f.read().split() == ['mine', 'other']
+
+class FakePlugin(object):
+   def __init__(self, key):
+      self.options = {'allocation_key': (key, "Name of an allocation")}
+
+def sharingTestDef(tmpdir, default=None):
+   import configparser
+   td = allocationTestDef(tmpdir)
+   td.config = configparser.ConfigParser()
+   td.config.read_string(u"""
+[TestRun:A]
+plugin = Fake
+allocation_key = k1
+[TestRun:SKIP B]
+plugin = Fake
+allocation_key = k1
+[TestRun:C]
+plugin = Fake
+[Reporter:R]
+allocation_key = k1
+[STOP]
+[TestRun:D]
+plugin = Fake
+allocation_key = k1
+""")
+   td.actives = [t for t in td.config.sections() if not t.startswith("SKIP")]
+   plugins = {'Fake': FakePlugin(default)}
+   td.findPlugin = lambda name, kind, category=None: (plugins.get(name), "Launcher")
+   return td
+
+def test_laterUser(tmpdir):
+   l = launcher()
+   # C takes the default of its own plugin rather than ours
+   l.options = {'allocation_key': ("k1", "")}
+   td = sharingTestDef(tmpdir)
+   assert l.laterUser('k1', 'TestRun:A', td) is None
+   td = sharingTestDef(tmpdir, default='k1')
+   assert l.laterUser('k1', 'TestRun:A', td) == 'TestRun:C'
+   assert l.laterUser('k1', 'TestRun:A-loop2', td) == 'TestRun:C'
+   # nothing after the STOP section is executed
+   assert l.laterUser('k1', 'TestRun:C', td) is None
+   assert l.laterUser('k2', 'TestRun:A', td) is None
+
+def sharedAllocation(tmpdir, key, nxt, pid=None):
+   released = os.path.join(str(tmpdir), "released")
+   LT.allocations[key] = {'cmds': {'deallocate_cmd': "sh -c 'echo %s >> %s'" % (key, released)},
+                          'pid': pid or os.getpid(), 'next': nxt}
+   return released
+
+def readReleased(released):
+   try:
+      with open(released) as f:
+         return f.read().split()
+   except IOError:
+      return []
+
+def test_sharedAllocationPassedOnAndReleased(tmpdir, monkeypatch):
+   monkeypatch.setattr(LT, 'allocations', {})
+   td = sharingTestDef(tmpdir, default='k1')
+   l = launcher()
+   released = sharedAllocation(tmpdir, 'k1', 'TestRun:A')
+   # A was to use it next but did not claim it - C will
+   l.sectionDone(td, 'TestRun:A')
+   assert LT.allocations['k1']['next'] == 'TestRun:C'
+   assert readReleased(released) == []
+   # another section finishing doesn't affect it
+   l.sectionDone(td, 'TestRun:A')
+   assert LT.allocations['k1']['next'] == 'TestRun:C'
+   # C did not run either, and no one else will use it
+   l.sectionDone(td, 'TestRun:C-loop1')
+   assert LT.allocations == {}
+   assert readReleased(released) == ['k1']
+
+def test_sectionKeepsAllocationForLaterUser(tmpdir, monkeypatch):
+   monkeypatch.setattr(LT, 'allocations', {})
+   td = sharingTestDef(tmpdir, default='k1')
+   l = launcher()
+   released = sharedAllocation(tmpdir, 'k1', 'TestRun:A')
+   cmds = {'allocation_key': 'k1', 'allocate_cmd': None, 'deallocate_cmd': None}
+   # A claims the allocation and keeps it for C once done
+   assert 0 == l.allocateCluster({'section': 'TestRun:A'}, cmds, td)
+   assert LT.allocations['k1']['next'] is None
+   assert 0 == l.deallocateCluster({'section': 'TestRun:A'}, cmds, td)
+   assert LT.allocations['k1']['next'] == 'TestRun:C'
+   assert 0 == l.allocateCluster({'section': 'TestRun:C'}, cmds, td)
+   assert 0 == l.deallocateCluster({'section': 'TestRun:C'}, cmds, td)
+   assert LT.allocations == {}
+   assert readReleased(released) == ['k1']
+
+def test_workerReleasesOnlyItsOwnAllocations(tmpdir, monkeypatch):
+   monkeypatch.setattr(LT, 'allocations', {})
+   td = allocationTestDef(tmpdir)
+   released = sharedAllocation(tmpdir, 'mine', 'TestRun:C')
+   sharedAllocation(tmpdir, 'parent', 'TestRun:C', pid=os.getpid() + 1)
+   l = launcher()
+   l.releaseKept(td)
+   assert list(LT.allocations.keys()) == ['parent']
+   # those inherited from the parent are dropped, not deallocated
+   l.releaseAllocations(td)
+   assert LT.allocations == {}
+   assert readReleased(released) == ['mine']
@@ -10,6 +10,8 @@
 
 from __future__ import print_function
 import os
+import shutil
+import tempfile
 from BaseMTTUtility import *
 
 ## @addtogroup Utilities
@@ -173,20 +175,21 @@ class Compilers(BaseMTTUtility):
         return
 
     def check_compile(self, testDef, macro, c_code, compiler):
-        # write out a little test program
-        fh = open("spastic.c", 'w')
+        # write out a little test program in a private directory so
+        # that concurrent checks cannot trample on each other
+        tmpdir = tempfile.mkdtemp(prefix="mtt_cc_")
+        src = os.path.join(tmpdir, "spastic.c")
+        fh = open(src, 'w')
         for ln in c_code:
             print(ln, file=fh)
         fh.close()
 
         # Attempt to compile it
-        mycmdargs = [compiler, "-c", "spastic.c"]
+        mycmdargs = [compiler, "-c", src, "-o", os.path.join(tmpdir, "spastic.o")]
         results = testDef.execmd.execute(None, mycmdargs, testDef, quiet=True)
 
         # cleanup the test
-        os.remove("spastic.c")
-        if os.path.exists("spastic.o"):
-            os.remove("spastic.o")
+        shutil.rmtree(tmpdir, ignore_errors=True)
 
         if 0 == results['status']:
             return True
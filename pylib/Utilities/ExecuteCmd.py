@@ -17,84 +17,285 @@ import time
 import datetime
 import signal
 import os, threading, errno
+from collections import deque
 from contextlib import contextmanager
 from BaseMTTUtility import *
 import random
+import heapq
+import itertools
+import multiprocessing
 
 
-class TimeoutThread(object):
-    def __init__(self, seconds):
-        self.seconds = seconds
+def _signal(pid, sig):
+    try:
+        os.kill(pid, sig)
+    except OSError as e:
+        # if it is already gone, then ignore the
+        # error - just a race condition
+        if e.errno not in (errno.EPERM, errno.ESRCH):
+            raise e
+
+class TimeoutScheduler(object):
+    # A single thread owns the deadlines of all commands, kept in a
+    # heap ordered by time. When a deadline passes, the process is
+    # politely given a SIGTERM so it can exit cleanly, and its entry
+    # is rescheduled so it gets hammered with a SIGKILL after the grace
+    # period if the command has not been cancelled by then
+    def __init__(self, grace=1):
+        self.grace = grace
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
         self.cond = threading.Condition()
-        self.cancelled = False
-        self.thread = threading.Thread(target=self._wait)
-
-    def run(self):
-        # start the timer
-        self.thread.start()
-
-    def _wait(self):
-        with self.cond:
-            self.cond.wait(self.seconds)
-
-            if not self.cancelled:
-                self.timed_out()
-
-    def cancel(self):
-        # cancel the timeout, if it hasn't already fired
+        self.heap = []
+        self.seq = itertools.count()
+        self.ncancelled = 0
+        self.thread = None
+
+    def schedule(self, seconds, pid):
+        # a forked child doesn't inherit our thread, so start afresh
+        if self.pid != os.getpid():
+            self._reset()
+        entry = {'pid': pid, 'termed': False, 'cancelled': False, 'done': False}
         with self.cond:
-            self.cancelled = True
+            heapq.heappush(self.heap, (time.time() + seconds, next(self.seq), entry))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
             self.cond.notify()
-        self.thread.join()
+        return entry
 
-    def timed_out(self):
-        # raise exception to signal timeout
-        raise NotImplementedError
-
-class KillProcessThread(TimeoutThread):
-    def __init__(self, seconds, pid):
-        super(KillProcessThread, self).__init__(seconds)
-        self.pid = pid
-
-    def timed_out(self):
-        # be polite and provide a SIGTERM to let them
-        # exit cleanly
-        try:
-            os.kill(self.pid, signal.SIGTERM)
-        except OSError as e:
-            # if it is already gone, then ignore the
-            # error - just a race condition
-            if e.errno not in (errno.EPERM, errno. ESRCH):
-                raise e
-        # wait a little bit
-        time.sleep(1)
-        # hammer it with a cannonball
-        try:
-            os.kill(self.pid, signal.SIGKILL)
-        except OSError as e:
-            # If the process is already gone, ignore the error.
-            if e.errno not in (errno.EPERM, errno. ESRCH):
-                raise e
+    def cancel(self, entry):
+        with self.cond:
+            if entry['done'] or entry['cancelled']:
+                return
+            entry['cancelled'] = True
+            if entry['termed']:
+                # it was told to terminate - don't give it any more
+                # time, but make sure it is gone before it is reaped
+                _signal(entry['pid'], signal.SIGKILL)
+            self.ncancelled += 1
+            # drop the cancelled entries if they make up most of the heap
+            if 64 < self.ncancelled and len(self.heap) < 2 * self.ncancelled:
+                self.heap = [item for item in self.heap if not item[2]['cancelled']]
+                heapq.heapify(self.heap)
+                self.ncancelled = 0
+
+    def _run(self):
+        with self.cond:
+            while True:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                deadline, seq, entry = self.heap[0]
+                if entry['cancelled']:
+                    heapq.heappop(self.heap)
+                    self.ncancelled = max(0, self.ncancelled - 1)
+                    continue
+                now = time.time()
+                if now < deadline:
+                    self.cond.wait(deadline - now)
+                    continue
+                heapq.heappop(self.heap)
+                if not entry['termed']:
+                    entry['termed'] = True
+                    _signal(entry['pid'], signal.SIGTERM)
+                    heapq.heappush(self.heap, (now + self.grace, next(self.seq), entry))
+                else:
+                    entry['done'] = True
+                    _signal(entry['pid'], signal.SIGKILL)
+
+timeouts = TimeoutScheduler()
 
 @contextmanager
 def processTimeout(seconds, pid):
-    timeout = KillProcessThread(seconds, pid)
-    timeout.run()
-    try:
+    # nothing to track if no timeout was given
+    if seconds is None:
         yield
+        return
+    entry = timeouts.schedule(seconds, pid)
+    try:
+        yield entry
     finally:
-        timeout.cancel()
+        timeouts.cancel(entry)
+
+class SlurmJobCache(object):
+    # A single thread polls squeue for the job ids of all the job
+    # names being watched, in one query per interval, and caches them
+    # by name. Commands register the name of the jobs they launch when
+    # they start and release it when done. If no id has been found by
+    # then, the command asks for a poll at once but doesn't wait for
+    # it - the thread adds any ids squeue reports later to the same
+    # list, and to the ELK record of the command
+    def __init__(self, interval=10, linger=2):
+        self.interval = interval
+        # number of polls a name is kept after its command completed
+        self.linger = linger
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.cond = threading.Condition()
+        # name -> {'ids': list of ids, 'entries': ELK records to
+        # update, 'polls': number of polls left or None if running}
+        self.watched = {}
+        self.thread = None
+        # whether a command asked for a poll ahead of the interval
+        self.asked = False
+
+    def watch(self, name):
+        # a forked child doesn't inherit our thread, so start afresh
+        if self.pid != os.getpid():
+            self._reset()
+        with self.cond:
+            self.watched[name] = {'ids': [], 'entries': [], 'polls': None}
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    # the command using the name is done - merge the ids found so far
+    # into the given list, which is kept up to date from here on. If
+    # none were found, have squeue polled without waiting for the interval
+    def release(self, name, ids):
+        with self.cond:
+            try:
+                job = self.watched[name]
+            except KeyError:
+                return ids
+            for i in job['ids']:
+                if i not in ids:
+                    ids.append(i)
+            job['ids'] = ids
+            job['polls'] = self.linger
+            if not ids:
+                self.asked = True
+                self.cond.notify_all()
+        return ids
+
+    # keep the given ELK record of the command up to date too
+    def follow(self, name, entry):
+        if entry is None:
+            return
+        with self.cond:
+            if name in self.watched:
+                self.watched[name]['entries'].append(entry)
+
+    def _run(self):
+        with self.cond:
+            while self.watched:
+                if not self.asked:
+                    self.cond.wait(self.interval)
+                self.asked = False
+                names = list(self.watched.keys())
+                # don't hold the lock while squeue runs
+                self.cond.release()
+                try:
+                    found = self._query(names)
+                finally:
+                    self.cond.acquire()
+                for name in names:
+                    try:
+                        job = self.watched[name]
+                    except KeyError:
+                        continue
+                    for i in found.get(name, []):
+                        if i not in job['ids']:
+                            job['ids'].append(i)
+                            for entry in job['entries']:
+                                entry['slurm_job_ids'] = ','.join([str(j) for j in job['ids']])
+                    if job['polls'] is not None:
+                        job['polls'] -= 1
+                        if job['polls'] <= 0:
+                            del self.watched[name]
+            self.thread = None
+
+    def _query(self, names):
+        found = {}
+        try:
+            p = subprocess.Popen(['squeue', '-h', '-t', 'all', '-o', '%j|%i', '-n', ','.join(names)],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            with processTimeout(self.interval * 3, p.pid):
+                out = p.communicate()[0]
+        except Exception:
+            return found
+        for l in out.decode('utf-8', 'replace').splitlines():
+            name, sep, jobid = l.strip().rpartition('|')
+            if jobid.isdigit():
+                found.setdefault(name, []).append(int(jobid))
+        return found
+
+slurmjobs = SlurmJobCache()
+
+class OutputBuffer(object):
+    # lines check_for_slurm_jobids looks for - these are
+    # kept aside so they survive the older lines being dropped
+    hint_prefixes = (b'Submitted batch job ', b'salloc: Granted job allocation ')
+
+    def __init__(self, maxlines, path=None):
+        # only keep the tail of the output if a limit was set
+        if 0 < maxlines:
+            self.lines = deque(maxlen=maxlines)
+        else:
+            self.lines = []
+        self.hints = []
+        self.count = 0
+        # if given a path, the full output is also written there
+        self.path = path
+        self.size = 0
+        self.fh = None
+        if path is not None:
+            self.fh = open(path, 'wb')
+
+    def write(self, chunk):
+        if self.fh is not None:
+            self.fh.write(chunk)
+            self.size += len(chunk)
+
+    def append(self, line):
+        self.lines.append(line)
+        self.count += 1
+        if line.startswith(self.hint_prefixes):
+            self.hints.append(line.decode('utf-8', 'replace').rstrip())
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+            # nothing to keep if there was no output
+            if 0 == self.size:
+                os.remove(self.path)
+                self.path = None
+
+    def contents(self):
+        return [l.decode('utf-8', 'replace').rstrip() for l in self.lines]
+
+    # the handle recorded in the log in place of the full output
+    def handle(self):
+        return {'path': self.path, 'size': self.size, 'lines': self.count}
 
 
 ## @addtogroup Utilities
 # @{
 # @section ExecuteCmd
 # Execute a command and capture its stdout and stderr
+# @param spill_output      Write the full stdout and stderr of each command to files in the scratch directory, only keeping their last lines in the log
 # @}
 class ExecuteCmd(BaseMTTUtility):
     def __init__(self):
         BaseMTTUtility.__init__(self)
         self.options = {}
+        self.options['spill_output'] = (False, "Write the full stdout and stderr of each command to files in the scratch directory, only keeping their last lines in the log")
+        # number of bytes to read from a pipe at a time
+        self.chunk_size = 65536
+        # number of lines kept in the log when output is
+        # spilled to files and no limit was given
+        self.spill_tail_lines = 100
+        # numbers the output files - drawing from a counter
+        # keeps them unique when commands run concurrently
+        self.spill_ids = itertools.count(1)
         return
 
     def print_name(self):
@@ -106,10 +307,13 @@ class ExecuteCmd(BaseMTTUtility):
             print(prefix + line)
         return
 
-    def _bool_option(self, options, name):
+    # interpret a boolean option - an unset option takes the default
+    def _bool_option(self, options, name, default=False):
         if options and name in options:
             val = options[name]
-            if type(val) is bool:
+            if val is None:
+                return default
+            elif type(val) is bool:
                 return val
             elif type(val) is str:
                 val = val.strip().lower()
@@ -117,7 +321,7 @@ class ExecuteCmd(BaseMTTUtility):
             else:
                 return val > 0
 
-        return False
+        return default
 
     def _positive_int_option(self, options, name):
         val = None
@@ -128,8 +332,9 @@ class ExecuteCmd(BaseMTTUtility):
         return int(val)
 
     def check_for_slurm_jobids(self, unique_identifier, prev_stdout, prev_stderr):
-        '''Checks stdout, stderr, and also squeue for any hints of a slurm job
-        that was run during the command that was executed
+        '''Checks stdout, stderr, and also the squeue cache for any hints of
+        a slurm job that was run during the command that was executed. Ids
+        that squeue only reports later are added to the returned list
         '''
         slurm_jobids = []
 
@@ -145,34 +350,48 @@ class ExecuteCmd(BaseMTTUtility):
                 if jobid.isdigit():
                     slurm_jobids.append(int(jobid))
 
+        slurm_jobids = list(set(slurm_jobids))
+        if unique_identifier is None:
+            return slurm_jobids
+        return slurmjobs.release(unique_identifier, slurm_jobids)
+
+
+    # wait for the process to exit and collect the resources it used.
+    # Returns a dictionary of its CPU time (in seconds), peak resident
+    # set size (in kilobytes), block I/O operations and context switches,
+    # or None if they could not be obtained
+    def reap(self, p):
         try:
-            stdout = []
-            p = subprocess.Popen(['squeue', '-o', '%i', '-h', '-t', 'all', '-n', unique_identifier],
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            with processTimeout(100000000, p.pid):
-                while True:
-                    reads = [p.stdout.fileno()]
-                    ret = select.select(reads, [], [])
-                    stdout_done = True
-                    for fd in ret[0]:
-                        if fd == p.stdout.fileno():
-                            read = p.stdout.readline()
-                            if read:
-                                read = read.decode('utf-8').rstrip()
-                                stdout.append(read)
-                                stdout_done = False
-                    if stdout_done:
-                        break
-            for l in stdout:
-                if l.isdigit:
-                    slurm_jobids.append(int(l))
-        except:
-            pass
-
-        return list(set(slurm_jobids))
-
-
-    def execute(self, options, cmdargs, testDef, quiet=False):
+            pid, status, ru = os.wait4(p.pid, 0)
+        except (OSError, AttributeError):
+            # already reaped, or wait4 isn't available
+            p.wait()
+            return None
+        if os.WIFSIGNALED(status):
+            p.returncode = -os.WTERMSIG(status)
+        else:
+            p.returncode = os.WEXITSTATUS(status)
+        return {'utime': ru.ru_utime,
+                'stime': ru.ru_stime,
+                'maxrss': ru.ru_maxrss,
+                'inblock': ru.ru_inblock,
+                'oublock': ru.ru_oublock,
+                'nvcsw': ru.ru_nvcsw,
+                'nivcsw': ru.ru_nivcsw}
+
+    # if the output was written to files, record the handles of the
+    # files next to the lines that were kept - reporters read the
+    # full output from them when needed
+    def recordSpill(self, results, stdout, stderr):
+        if stdout.path is not None:
+            results['stdout_file'] = stdout.handle()
+        if stderr.path is not None:
+            results['stderr_file'] = stderr.handle()
+
+    # execute the command given by cmdargs and capture its output. The
+    # command is executed in the current directory and environment
+    # unless a cwd and/or env are given
+    def execute(self, options, cmdargs, testDef, quiet=False, cwd=None, env=None):
         # if this is a dryrun, just declare success
         if 'dryrun' in testDef.options and testDef.options['dryrun']:
             return (0, [], [], 0)
@@ -198,7 +417,13 @@ class ExecuteCmd(BaseMTTUtility):
         # along with squeue to capture any slurm job ids that contain the identifier
         if cmdargs[0] == 'srun':
             unique_identifier = str(random.randint(0,999999999999))
-            os.environ['SLURM_JOB_NAME'] = unique_identifier
+            # set it in a copy of the environment, as other threads
+            # may be starting commands of their own
+            if env is None:
+                env = dict(os.environ)
+            else:
+                env = dict(env)
+            env['SLURM_JOB_NAME'] = unique_identifier
         else:
             unique_identifier = None
 
@@ -224,6 +449,8 @@ class ExecuteCmd(BaseMTTUtility):
             else:
                 mycmdargs.append(arg)
         testDef.logger.verbose_print("ExecuteCmd start: " + ' '.join(mycmdargs), timestamp=datetime.datetime.now() if time_exec else None)
+        if unique_identifier is not None:
+            slurmjobs.watch(unique_identifier)
 
         if not mycmdargs:
             testDef.logger.verbose_print("ExecuteCmd error: no cmdargs")
@@ -237,9 +464,26 @@ class ExecuteCmd(BaseMTTUtility):
                                               0, None)
             return (1, [], ["MTT ExecuteCmd error: no cmdargs"], 0)
 
-        # define storage to catch the output
-        stdout = []
-        stderr = []
+        # check if the full output is to be written to files
+        spill = self._bool_option(options, 'spill_output') or \
+                self._bool_option(testDef.options, 'spill_output')
+
+        # define storage to catch the output - the lines are
+        # kept as raw bytes and only decoded once we are done
+        if spill:
+            outdir = os.path.join(testDef.options['scratchdir'], "output")
+            try:
+                os.makedirs(outdir)
+            except OSError:
+                # already there
+                pass
+            base = os.path.join(outdir, "cmd%d-%d" % (os.getpid(), next(self.spill_ids)))
+            stdout = OutputBuffer(stdoutlines or self.spill_tail_lines,
+                                  None if merge else base + ".stdout")
+            stderr = OutputBuffer(stderrlines or self.spill_tail_lines, base + ".stderr")
+        else:
+            stdout = OutputBuffer(stdoutlines)
+            stderr = OutputBuffer(stderrlines)
 
         # start the process so that we can catch an exception
         # if it times out, assuming timeout was set
@@ -254,58 +498,98 @@ class ExecuteCmd(BaseMTTUtility):
             # open a subprocess with stdout and stderr
             # as distinct pipes so we can capture their
             # output as the process runs
-            p = subprocess.Popen(mycmdargs,
+            p = subprocess.Popen(mycmdargs, cwd=cwd, env=env,
                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             if options is not None and 'timeout' in options and options['timeout'] is not None:
                 t = int(options['timeout'])
             else:
-                t = 100000000
-            with processTimeout(t, p.pid):
-                # loop until the pipes close
-                while True:
-                    ret = select.select([p.stdout.fileno(), p.stderr.fileno()], [], [])
-
-                    stdout_done = True
-                    stderr_done = True
-
+                t = None
+            # the command is also terminated if it stays silent
+            # for longer than the idle timeout, if one was given
+            idle = None
+            if options is not None and 'idle_timeout' in options and options['idle_timeout'] is not None:
+                idle = float(options['idle_timeout'])
+                if idle <= 0:
+                    idle = None
+            stalled = None
+            # track the pipes by descriptor, along with the buffer
+            # their lines go into and any incomplete last line
+            streams = {p.stdout.fileno(): ['stdout: ', stderr if merge else stdout, b''],
+                       p.stderr.fileno(): ['stderr: ', stderr, b'']}
+            with processTimeout(t, p.pid) as deadline:
+                # wake up regularly if the command may be killed, as
+                # whatever it started can keep the pipes open after it
+                wait = idle if t is None else timeouts.grace
+                lastread = time.time()
+                # loop until the pipes close, reading whatever is
+                # available rather than waiting for complete lines
+                while streams:
+                    ret = select.select(list(streams.keys()), [], [], wait)
+                    if not ret[0]:
+                        killer = stalled or deadline
+                        if killer is not None and killer['done']:
+                            # the command was killed, but something it started
+                            # still holds the pipes open - stop waiting for it
+                            for stream in streams.values():
+                                if stream[2]:
+                                    stream[1].append(stream[2])
+                            p.stdout.close()
+                            p.stderr.close()
+                            break
+                        if stalled is None and idle is not None and time.time() - lastread >= idle:
+                            # no output for too long - the command stalled, so
+                            # terminate it now, escalating as for a timeout
+                            testDef.logger.verbose_print("ExecuteCmd stalled: no output for %s seconds" % options['idle_timeout'])
+                            stalled = timeouts.schedule(0, p.pid)
+                            wait = timeouts.grace
+                        continue
+                    lastread = time.time()
                     for fd in ret[0]:
-                        # if the data
-                        if fd == p.stdout.fileno():
-                            read = p.stdout.readline()
-                            if read:
-                                read = read.decode('utf-8').rstrip()
-                                testDef.logger.verbose_print('stdout: ' + read)
-                                if merge:
-                                    stderr.append(read)
-                                else:
-                                    stdout.append(read)
-                                stdout_done = False
-                        elif fd == p.stderr.fileno():
-                            read = p.stderr.readline()
-                            if read:
-                                read = read.decode('utf-8').rstrip()
-                                testDef.logger.verbose_print('stderr: ' + read)
-                                stderr.append(read)
-                                stderr_done = False
-
-                    if stdout_done and stderr_done:
-                        break
-            p.wait()
+                        stream = streams[fd]
+                        read = os.read(fd, self.chunk_size)
+                        if read:
+                            stream[1].write(read)
+                            lines = (stream[2] + read).split(b'\n')
+                            stream[2] = lines.pop()
+                            # don't let a line without end grow forever
+                            if len(stream[2]) > self.chunk_size * 16:
+                                lines.append(stream[2])
+                                stream[2] = b''
+                        else:
+                            # the pipe closed
+                            lines = [stream[2]] if stream[2] else []
+                            del streams[fd]
+                        for line in lines:
+                            stream[1].append(line)
+                            if testDef.logger.printout:
+                                testDef.logger.verbose_print(stream[0] + line.decode('utf-8', 'replace').rstrip())
+                if stalled is not None:
+                    timeouts.cancel(stalled)
+            rusage = self.reap(p)
+            stdout.close()
+            stderr.close()
 
             endtime = datetime.datetime.now()
 
-            if p.returncode == -15 or p.returncode == -9:
+            if stalled is not None or p.returncode == -15 or p.returncode == -9:
                 # check if slurm was run, and record job ids
-                slurm_jobids = self.check_for_slurm_jobids(unique_identifier, stdout, stderr)
+                slurm_jobids = self.check_for_slurm_jobids(unique_identifier, stdout.hints, stderr.hints)
                 # print execmd timed out info, including any slurm job ids
                 testDef.logger.verbose_print("ExecuteCmd Timed Out%s%s" % (" : elapsed=%s"%elapsed_datetime if time_exec else "", \
                                                                            " : slurm_jobids=%s" % ','.join([str(j) for j in slurm_jobids]) if slurm_jobids else ""), \
                                              timestamp=endtime if time_exec else None)
-                stderr.append("**** TIMED OUT ****")
+                if stalled is not None:
+                    stderr.append(b"**** STALLED ****")
+                    results['stalled'] = True
+                else:
+                    stderr.append(b"**** TIMED OUT ****")
                 results['timedout'] = True
                 results['status'] = p.returncode
-                results['stdout'] = stdout[-1 * stdoutlines:]
-                results['stderr'] = stderr[-1 * stderrlines:]
+                if rusage is not None:
+                    results['rusage'] = rusage
+                results['stdout'] = stdout.contents()
+                results['stderr'] = stderr.contents()
+                self.recordSpill(results, stdout, stderr)
                 results['slurm_job_ids'] = slurm_jobids
                 if time_exec:
                     endtime = datetime.datetime.now()
@@ -313,7 +597,7 @@ class ExecuteCmd(BaseMTTUtility):
                     results['elapsed_secs'] = elapsed_datetime.total_seconds()
 
                 if not quiet:
-                    testDef.logger.log_execmd_elk(cmdargs,
+                    entry = testDef.logger.log_execmd_elk(cmdargs,
                                                   results['status'] if 'status' in results else None,
                                                   results['stdout'] if 'stdout' in results else None,
                                                   results['stderr'] if 'stderr' in results else None,
@@ -321,7 +605,10 @@ class ExecuteCmd(BaseMTTUtility):
                                                   starttime,
                                                   endtime,
                                                   (endtime - starttime).total_seconds,
-                                                  results['slurm_job_ids'] if 'slurm_job_ids' in results else None)
+                                                  results['slurm_job_ids'] if 'slurm_job_ids' in results else None,
+                                                  rusage=results.get('rusage'))
+                    if unique_identifier is not None:
+                        slurmjobs.follow(unique_identifier, entry)
                 return results
 
             if time_exec:
@@ -329,27 +616,34 @@ class ExecuteCmd(BaseMTTUtility):
                 results['elapsed_secs'] = elapsed_datetime.total_seconds()
 
             # check if slurm was run, and record job ids
-            slurm_jobids = self.check_for_slurm_jobids(unique_identifier, stdout, stderr)
+            slurm_jobids = self.check_for_slurm_jobids(unique_identifier, stdout.hints, stderr.hints)
             # print execmd info, including any slurm job ids
             testDef.logger.verbose_print("ExecuteCmd done%s%s" % (" : elapsed=%s" % elapsed_datetime if time_exec else "", \
                                                                   " : slurm_jobids=%s" % ','.join([str(j) for j in slurm_jobids]) if slurm_jobids else ""), \
                                          timestamp=endtime if time_exec else None)
 
             results['status'] = p.returncode
-            results['stdout'] = stdout[-1 * stdoutlines:]
-            results['stderr'] = stderr[-1 * stderrlines:]
+            if rusage is not None:
+                results['rusage'] = rusage
+            results['stdout'] = stdout.contents()
+            results['stderr'] = stderr.contents()
+            self.recordSpill(results, stdout, stderr)
             results['slurm_job_ids'] = slurm_jobids
         except OSError as e:
             if p:
                 p.wait()
+            stdout.close()
+            stderr.close()
             endtime = datetime.datetime.now()
             results['status'] = 1
             results['stdout'] = []
             results['stderr'] = [str(e)]
             results['slurm_job_ids'] = []
+            if unique_identifier is not None:
+                slurmjobs.release(unique_identifier, results['slurm_job_ids'])
 
         if not quiet:
-            testDef.logger.log_execmd_elk(cmdargs,
+            entry = testDef.logger.log_execmd_elk(cmdargs,
                                           results['status'] if 'status' in results else None,
                                           results['stdout'] if 'stdout' in results else None,
                                           results['stderr'] if 'stderr' in results else None,
@@ -357,6 +651,62 @@ class ExecuteCmd(BaseMTTUtility):
                                           starttime,
                                           endtime,
                                           (endtime - starttime).total_seconds(),
-                                          results['slurm_job_ids'] if 'slurm_job_ids' in results else None)
+                                          results['slurm_job_ids'] if 'slurm_job_ids' in results else None,
+                                          rusage=results.get('rusage'))
+            if unique_identifier is not None:
+                slurmjobs.follow(unique_identifier, entry)
 
         return results
+
+    # execute a number of independent commands, up to concurrency of
+    # them at a time (defaults to the number of CPUs). Each command is
+    # given either as its list of arguments, or as a dictionary holding
+    # the arguments under 'cmdargs' plus, optionally, the 'cwd' and
+    # 'env' to execute it in and a 'timeout' overriding the one in the
+    # options. Returns a list holding the result of each command, as
+    # returned by execute, in the order the commands were given
+    def execute_many(self, options, cmds, testDef, quiet=False, concurrency=None):
+        specs = []
+        for cmd in cmds:
+            if isinstance(cmd, dict):
+                specs.append(cmd)
+            else:
+                specs.append({'cmdargs': cmd})
+        results = [None] * len(specs)
+        if not specs:
+            return results
+        if concurrency is None:
+            concurrency = multiprocessing.cpu_count()
+        concurrency = max(1, min(int(concurrency), len(specs)))
+        # the workers take the commands from the front of the queue
+        pending = deque(range(len(specs)))
+        if 1 == concurrency:
+            self._execute_queued(options, specs, pending, results, testDef, quiet)
+            return results
+        threads = []
+        for n in range(concurrency):
+            t = threading.Thread(target=self._execute_queued,
+                                 args=(options, specs, pending, results, testDef, quiet))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        return results
+
+    def _execute_queued(self, options, specs, pending, results, testDef, quiet):
+        while True:
+            try:
+                i = pending.popleft()
+            except IndexError:
+                return
+            spec = specs[i]
+            opts = options
+            if 'timeout' in spec:
+                opts = dict(options) if options else {}
+                opts['timeout'] = spec['timeout']
+            try:
+                results[i] = self.execute(opts, spec['cmdargs'], testDef, quiet,
+                                          cwd=spec.get('cwd'), env=spec.get('env'))
+            except Exception as e:
+                results[i] = {'status': 1, 'stdout': [], 'stderr': [str(e)], 'slurm_job_ids': []}
@@ -28,6 +28,10 @@ class Logger(BaseMTTUtility):
         BaseMTTUtility.__init__(self)
         self.fh = sys.stdout
         self.results = []
+        # index the results by section name and by stage
+        # so lookups don't have to scan the whole list
+        self.sections = {}
+        self.stages = {}
         self.options = {}
         self.printout = False
         self.timestamp = False
@@ -44,6 +48,8 @@ class Logger(BaseMTTUtility):
 
     def reset(self):
         self.results = []
+        self.sections = {}
+        self.stages = {}
         self.stage_start = {}
 
     def print_name(self):
@@ -190,7 +196,7 @@ class Logger(BaseMTTUtility):
         if self.elk_id is not None:
             self.log_to_elk({'environment': dict(os.environ), 'options': testDef.options}, 'mtt-env')
 
-    def log_execmd_elk(self, cmdargs, status, stdout, stderr, timedout, starttime, endtime, elapsed_secs, slurm_job_ids):
+    def log_execmd_elk(self, cmdargs, status, stdout, stderr, timedout, starttime, endtime, elapsed_secs, slurm_job_ids, rusage=None):
         if self.elk_id is not None:
             if 'MTT_ELK_MAXSIZE' in os.environ:
                 try:
@@ -207,16 +213,21 @@ class Logger(BaseMTTUtility):
                         stderr = ['<truncated>'] + stderr[-maxsize:]
                     else:
                         stderr = ['<truncated>']
-            self.execmds_stash.append({'cmdargs': ' '.join(cmdargs),
-                                       'status': status,
-                                       'stdout': stdout if 'MTT_ELK_NOSTDOUT' not in os.environ else ['<ignored>'],
-                                       'stderr': stderr if 'MTT_ELK_NOSTDERR' not in os.environ else ['<ignored>'],
-                                       'timedout': timedout,
-                                       'starttime': str(starttime),
-                                       'endtime': str(endtime),
-                                       'elapsed': elapsed_secs,
-                                       'slurm_job_ids': ','.join(slurm_job_ids)
-                                      })
+            entry = {'cmdargs': ' '.join(cmdargs),
+                     'status': status,
+                     'stdout': stdout if 'MTT_ELK_NOSTDOUT' not in os.environ else ['<ignored>'],
+                     'stderr': stderr if 'MTT_ELK_NOSTDERR' not in os.environ else ['<ignored>'],
+                     'timedout': timedout,
+                     'starttime': str(starttime),
+                     'endtime': str(endtime),
+                     'elapsed': elapsed_secs,
+                     'slurm_job_ids': ','.join([str(j) for j in slurm_job_ids]) if slurm_job_ids else '',
+                     'rusage': rusage
+                    }
+            self.execmds_stash.append(entry)
+            # return the record so it can be updated later
+            return entry
+        return None
 
     def stage_start_print(self, stagename):
         self.stage_start[stagename] = datetime.datetime.now()
@@ -263,11 +274,35 @@ class Logger(BaseMTTUtility):
 
     def logResults(self, title, result):
         self.verbose_print("LOGGING results for " + title)
-        self.results.append(result)
+        self.addResult(result)
         if self.elk_id is not None:
             self.log_to_elk(result, 'mtt-sec')
         return
 
+    def addResult(self, result):
+        self.results.append(result)
+        try:
+            section = result['section']
+        except KeyError:
+            section = None
+        if section is not None:
+            # a section may be logged more than once - lookups
+            # have always returned the first entry, so keep it
+            if section not in self.sections:
+                self.sections[section] = result
+            self.stages.setdefault(section.split(":")[0].strip(), []).append(result)
+
+    def resetSections(self):
+        # forget which result was logged for each section, so
+        # lookups by name only find results logged from now on
+        self.sections = {}
+
+    def mergeResults(self, results):
+        # add results that were logged elsewhere - e.g., by a
+        # worker process - without logging them a second time
+        for result in results:
+            self.addResult(result)
+
     def outputLog(self):
         # cycle across the logged results and output
         # them to the logging file
@@ -293,12 +328,17 @@ class Logger(BaseMTTUtility):
         if key is None:
             return self.results
         # we have been passed the name of a section, so
-        # see if we have its log in the results
-        for result in self.results:
-            try:
-                if key == result['section']:
-                    return result
-            except KeyError:
-                pass
-        # if we get here, then the key wasn't found
-        return None
+        # see if we have its log in the results - if not,
+        # then None is returned
+        return self.sections.get(key)
+
+    def getStageLogs(self, stage):
+        # return the logs of all sections whose names begin with the
+        # given stage (e.g., "TestRun" also matches "TestRunFoo") in
+        # the order they were logged
+        keys = [k for k in self.stages if k.startswith(stage)]
+        if 1 == len(keys):
+            return self.stages[keys[0]]
+        if not keys:
+            return []
+        return [r for r in self.results if r.get('section') is not None and r['section'].startswith(stage)]
@@ -0,0 +1,274 @@
+# run this via pytest
+# export MTT_HOME=/path/to/mtt
+# pytest ./test_ExecuteCmd.py
+#   add the -s argument to display print lines
+#   add the -v argument to be verbose
+# ie  pytest -sv ./test_ExecuteCmd.py
+import pytest
+import os
+import sys
+import time
+import signal
+import subprocess
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib/Utilities"))
+import ExecuteCmd as EC
+
+class FakeLogger(object):
+   printout = False
+   def __init__(self):
+      self.entries = []
+   def verbose_print(self, *args, **kwargs):
+      pass
+   def log_execmd_elk(self, cmdargs, status, stdout, stderr, timedout, starttime, endtime, elapsed_secs, slurm_job_ids, rusage=None):
+      entry = {'cmdargs': ' '.join(cmdargs), 'status': status,
+               'slurm_job_ids': ','.join([str(j) for j in slurm_job_ids]) if slurm_job_ids else '',
+               'rusage': rusage}
+      self.entries.append(entry)
+      return entry
+
+class FakeTestDef(object):
+   def __init__(self, scratchdir):
+      self.options = {'scratchdir': scratchdir}
+      self.logger = FakeLogger()
+
+def test_outputBufferKeepsTail():
+   buf = EC.OutputBuffer(3)
+   for i in range(10):
+      buf.append(("line %d\n" % i).encode('utf-8'))
+   buf.close()
+   assert buf.contents() == ['line 7', 'line 8', 'line 9']
+   assert buf.count == 10
+   assert buf.path is None
+
+def test_outputBufferUnbounded():
+   buf = EC.OutputBuffer(-1)
+   for i in range(1000):
+      buf.append(b"x\n")
+   assert len(buf.contents()) == 1000
+
+def test_outputBufferKeepsSlurmHints():
+   buf = EC.OutputBuffer(1)
+   buf.append(b"Submitted batch job 1234\n")
+   buf.append(b"other\n")
+   buf.append(b"last\n")
+   assert buf.contents() == ['last']
+   assert buf.hints == ['Submitted batch job 1234']
+
+def test_outputBufferReplacesUndecodableBytes():
+   buf = EC.OutputBuffer(0)
+   buf.append(b"caf\xe9\n")
+   assert buf.contents() == [u'caf\ufffd']
+
+def test_executeKeepsTailOfLongOutput(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   results = EC.ExecuteCmd().execute({'stdout_save_lines': 5}, ['seq', '1', '1000'], td)
+   assert results['status'] == 0
+   assert results['stdout'] == ['996', '997', '998', '999', '1000']
+
+def test_executeReadsLineWithoutNewline(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   results = EC.ExecuteCmd().execute(None, ['printf', 'no newline'], td)
+   assert results['stdout'] == ['no newline']
+
+def test_executeRecordsRusage(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   results = EC.ExecuteCmd().execute(None, ['sh', '-c', 'i=0; while [ $i -lt 50000 ]; do i=$((i+1)); done'], td)
+   assert results['status'] == 0
+   rusage = results['rusage']
+   assert sorted(rusage.keys()) == ['inblock', 'maxrss', 'nivcsw', 'nvcsw', 'oublock', 'stime', 'utime']
+   assert rusage['utime'] + rusage['stime'] > 0
+   assert rusage['maxrss'] > 0
+   # and it is passed on to the ELK log
+   assert td.logger.entries[-1]['rusage'] is rusage
+
+def test_executeWithoutWait4(tmpdir, monkeypatch):
+   monkeypatch.delattr(os, 'wait4')
+   td = FakeTestDef(str(tmpdir))
+   results = EC.ExecuteCmd().execute(None, ['sh', '-c', 'echo hello; exit 3'], td)
+   assert results['status'] == 3
+   assert results['stdout'] == ['hello']
+   assert 'rusage' not in results
+   assert td.logger.entries[-1]['rusage'] is None
+
+def test_executeWhenWait4Fails(tmpdir, monkeypatch):
+   def wait4(pid, options):
+      raise OSError(10, "No child processes")
+   monkeypatch.setattr(os, 'wait4', wait4)
+   td = FakeTestDef(str(tmpdir))
+   results = EC.ExecuteCmd().execute(None, ['sh', '-c', 'exit 3'], td)
+   assert results['status'] == 3
+   assert 'rusage' not in results
+
+def test_boolOptionUnsetTakesDefault():
+   ex = EC.ExecuteCmd()
+   assert ex._bool_option({'spill_output': None}, 'spill_output') is False
+   assert ex._bool_option({'spill_output': None}, 'spill_output', default=True) is True
+   assert ex._bool_option({}, 'spill_output', default=True) is True
+   assert ex._bool_option(None, 'spill_output') is False
+   assert ex._bool_option({'spill_output': 'yes'}, 'spill_output') is True
+   assert ex._bool_option({'spill_output': '0'}, 'spill_output') is False
+
+def test_executeWithoutSpillSet(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   td.options['spill_output'] = None
+   results = EC.ExecuteCmd().execute({'spill_output': None}, ['echo', 'hi'], td)
+   assert results['stdout'] == ['hi']
+   assert 'stdout_file' not in results
+
+def test_executeSpillsFullOutput(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   results = EC.ExecuteCmd().execute({'spill_output': True, 'stdout_save_lines': 2}, ['seq', '1', '50'], td)
+   assert results['stdout'] == ['49', '50']
+   handle = results['stdout_file']
+   assert handle['lines'] == 50
+   with open(handle['path']) as f:
+      assert f.read().split() == [str(i) for i in range(1, 51)]
+   assert handle['size'] == os.path.getsize(handle['path'])
+   # nothing was written to stderr, so no file is kept for it
+   assert 'stderr_file' not in results
+
+def test_executeManyKeepsOrder(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   # the first commands take the longest, so they finish last
+   cmds = [['sh', '-c', 'sleep 0.%d; echo %d' % (5 - i, i)] for i in range(5)]
+   results = EC.ExecuteCmd().execute_many({}, cmds, td, concurrency=5)
+   assert [r['stdout'] for r in results] == [[str(i)] for i in range(5)]
+   assert all(0 == r['status'] for r in results)
+
+def test_executeManyRunsConcurrently(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   cmds = [['sleep', '0.5']] * 4
+   start = time.time()
+   EC.ExecuteCmd().execute_many({}, cmds, td, concurrency=4)
+   assert time.time() - start < 1.5
+   start = time.time()
+   EC.ExecuteCmd().execute_many({}, cmds[:2], td, concurrency=1)
+   assert 1.0 <= time.time() - start
+
+def test_executeManySpecs(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   env = dict(os.environ)
+   env['MTT_TEST_VALUE'] = 'xyzzy'
+   cmds = [{'cmdargs': ['pwd'], 'cwd': str(tmpdir)},
+           {'cmdargs': ['sh', '-c', 'echo $MTT_TEST_VALUE'], 'env': env},
+           {'cmdargs': ['sleep', '10'], 'timeout': 1},
+           ['true']]
+   results = EC.ExecuteCmd().execute_many({}, cmds, td, concurrency=2)
+   assert results[0]['stdout'] == [os.path.realpath(str(tmpdir))]
+   assert results[1]['stdout'] == ['xyzzy']
+   assert results[2].get('timedout')
+   assert 'timedout' not in results[3] and 0 == results[3]['status']
+
+def test_executeManyReportsFailedLaunch(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   results = EC.ExecuteCmd().execute_many({}, [['/nonexistent/command'], ['true']], td, concurrency=2)
+   assert 0 != results[0]['status']
+   assert 0 == results[1]['status']
+   assert [] == EC.ExecuteCmd().execute_many({}, [], td)
+
+def test_timeoutSchedulerTerminates():
+   sched = EC.TimeoutScheduler(grace=1)
+   p = subprocess.Popen(['sleep', '30'])
+   start = time.time()
+   entry = sched.schedule(0.2, p.pid)
+   assert -signal.SIGTERM == p.wait()
+   assert time.time() - start < 5
+   assert entry['termed']
+   sched.cancel(entry)
+
+def test_timeoutSchedulerKillsAfterGrace():
+   sched = EC.TimeoutScheduler(grace=0.3)
+   # ignore the polite request so it takes the SIGKILL
+   p = subprocess.Popen(['sh', '-c', 'trap "" TERM; sleep 30'])
+   time.sleep(0.1)
+   sched.schedule(0.2, p.pid)
+   assert -signal.SIGKILL == p.wait()
+
+def test_timeoutSchedulerCancel():
+   sched = EC.TimeoutScheduler(grace=0)
+   p = subprocess.Popen(['sleep', '1'])
+   entry = sched.schedule(0.5, p.pid)
+   later = sched.schedule(5, p.pid)
+   sched.cancel(entry)
+   assert 0 == p.wait()
+   assert not entry['termed'] and entry['cancelled']
+   sched.cancel(later)
+   # cancelling twice is harmless
+   sched.cancel(later)
+   assert all(item[2]['cancelled'] for item in sched.heap)
+
+def test_processTimeoutWithoutLimit():
+   with EC.processTimeout(None, os.getpid()) as entry:
+      assert entry is None
+
+class FakeSqueue(EC.SlurmJobCache):
+   # reports the ids in self.jobs, or only from the given poll on
+   def __init__(self, jobs, after=0):
+      EC.SlurmJobCache.__init__(self, interval=0.2, linger=3)
+      self.jobs = jobs
+      self.after = after
+      self.polls = 0
+   def _query(self, names):
+      self.polls += 1
+      if self.polls <= self.after:
+         return {}
+      return dict((n, self.jobs[n]) for n in names if n in self.jobs)
+
+def test_slurmJobCacheDoesNotWaitForIds():
+   cache = FakeSqueue({'job1': [42]}, after=2)
+   cache.watch('job1')
+   start = time.time()
+   ids = cache.release('job1', [])
+   # released before squeue reported the job, which doesn't hold us up
+   assert time.time() - start < cache.interval
+   assert ids == []
+   # the thread adds the id once squeue reports it
+   deadline = time.time() + 5
+   while not ids and time.time() < deadline:
+      time.sleep(0.05)
+   assert ids == [42]
+
+def test_slurmJobCacheMergesIds():
+   cache = FakeSqueue({'job1': [42]})
+   cache.watch('job1')
+   start = time.time()
+   ids = cache.release('job1', [7])
+   assert time.time() - start < cache.interval
+   assert 7 in ids
+   # the thread goes on adding to the list it was given
+   deadline = time.time() + 5
+   while 42 not in ids and time.time() < deadline:
+      time.sleep(0.05)
+   assert sorted(ids) == [7, 42]
+
+def test_slurmJobCacheBackfillsEntry():
+   # squeue only reports the job a couple of polls after it completed
+   cache = FakeSqueue({'job1': [42]}, after=2)
+   cache.watch('job1')
+   ids = cache.release('job1', [])
+   entry = {'slurm_job_ids': ','.join([str(j) for j in ids])}
+   cache.follow('job1', entry)
+   deadline = time.time() + 5
+   while not entry['slurm_job_ids'] and time.time() < deadline:
+      time.sleep(0.05)
+   assert entry['slurm_job_ids'] == '42'
+   # unknown names and missing entries are ignored
+   assert cache.release('other', [1]) == [1]
+   cache.follow('job1', None)
+
+def test_executeMarksSilentCommandStalled(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   start = time.time()
+   results = EC.ExecuteCmd().execute({'idle_timeout': 0.5}, ['sh', '-c', 'echo started; sleep 30'], td)
+   assert time.time() - start < 10
+   assert results.get('stalled') and results.get('timedout')
+   assert results['stdout'] == ['started']
+
+def test_executeKeepsChattyCommand(tmpdir):
+   td = FakeTestDef(str(tmpdir))
+   # output keeps coming more often than the idle timeout
+   results = EC.ExecuteCmd().execute({'idle_timeout': 1},
+                                     ['sh', '-c', 'for i in 1 2 3 4 5; do echo $i; sleep 0.3; done'], td)
+   assert 'stalled' not in results and 'timedout' not in results
+   assert 0 == results['status']
+   assert len(results['stdout']) == 5
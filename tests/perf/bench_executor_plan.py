@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2026      Intel, Inc.  All rights reserved.
+# $COPYRIGHT$
+#
+# Additional copyrights may follow
+#
+# $HEADER$
+#
+# Measure the per-pass overhead of walking a large test description.
+# The "rescan" numbers reproduce what SequentialEx used to do on every
+# loop iteration (scan each stage against every section, then parse
+# the section and search the plugin managers for its plugin by name,
+# category by category), while the "plan" numbers walk
+# the plan compiled once by ExecutorMTTTool.compilePlan. No plugins
+# are executed - only the executor's own bookkeeping is timed.
+#
+# run this with
+#   export MTT_HOME=/path/to/mtt
+#   python tests/perf/bench_executor_plan.py [nsections] [npasses]
+
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import configparser
+
+sys.path.append(os.path.join(os.environ['MTT_HOME'], "pylib", "System"))
+import TestDef as TD
+
+def setup(nsections):
+    testDef = TD.TestDef()
+    testDef.setOptions(argparse.Namespace(plugindir=None, env_module_wrapper=None,
+                                          verbose=False, debug=False))
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        testDef.loadPlugins(os.path.join(os.environ['MTT_HOME'], "pylib", "System"),
+                            os.path.join(os.environ['MTT_HOME'], "pylib"))
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    testDef.config = configparser.ConfigParser(interpolation=configparser.ExtendedInterpolation())
+    testDef.config.optionxform = str
+    testDef.config.add_section('MTTDefaults')
+    testDef.config.set('MTTDefaults', 'scratch', '/tmp/mttscratch')
+    # spread the sections across the get/build/run stages, with each
+    # section having its predecessor in the previous stage as parent
+    stages = [("TestGet", "Copytree"), ("TestBuild", "Shell"), ("TestRun", "Shell")]
+    for n in range(nsections):
+        stage, plugin = stages[n % len(stages)]
+        title = "%s:t%d" % (stage, n // len(stages))
+        testDef.config.add_section(title)
+        testDef.config.set(title, 'plugin', plugin)
+        testDef.config.set(title, 'command', "true")
+        if 0 < n % len(stages):
+            testDef.config.set(title, 'parent', "%s:t%d" % (stages[n % len(stages) - 1][0],
+                                                            n // len(stages)))
+    testDef.actives = list(testDef.config.sections())
+    return testDef
+
+# the plugin search SequentialEx did for each section before the plugins
+# were indexed by name - the stage first, then every tool and utility
+def searchPlugin(testDef, stage, module):
+    try:
+        for pluginInfo in testDef.stages.getPluginsOfCategory(stage):
+            if module == pluginInfo.plugin_object.print_name():
+                testDef.stages.activatePluginByName(module, stage)
+                return pluginInfo.plugin_object
+    except KeyError:
+        pass
+    for tool in list(testDef.loader.tools.keys()):
+        for pluginInfo in testDef.tools.getPluginsOfCategory(tool):
+            if module == pluginInfo.plugin_object.print_name():
+                testDef.tools.activatePluginByName(module, tool)
+                return pluginInfo.plugin_object
+    for util in list(testDef.loader.utilities.keys()):
+        for pluginInfo in testDef.utilities.getPluginsOfCategory(util):
+            if module == pluginInfo.plugin_object.print_name():
+                return pluginInfo.plugin_object
+    return None
+
+# one pass as SequentialEx made it - every stage against every section,
+# with the section read (and interpolated) afresh for its log and keyvals
+def rescan(executor, testDef):
+    for step in testDef.loader.stageOrder:
+        for title in testDef.config.sections():
+            if (":" in title and step not in title.split(":")[0]) or \
+               (":" not in title and step not in title):
+                continue
+            if title not in testDef.actives:
+                continue
+            if ":" in title:
+                stage,name = title.split(':')
+                stage = stage.strip()
+            else:
+                stage = title
+            stageLog = {'section':title}
+            stageLog["parameters"] = testDef.config.items(title)
+            keyvals = {'section':title.strip()}
+            for kv in testDef.config.items(title):
+                keyvals[kv[0].strip()] = kv[1].strip()
+            try:
+                module = keyvals['plugin']
+            except KeyError:
+                continue
+            searchPlugin(testDef, stage, module)
+
+def walk(executor, testDef, plan):
+    for entry in plan:
+        stage, stageLog, keyvals = executor.setupSection(testDef, entry['title'], entry['title'],
+                                                         "", entry['parameters'])
+        plugin = entry['plugin']
+        if plugin is None:
+            executor.resolvePlugin(testDef, entry['title'], stage, stageLog, keyvals)
+
+def main():
+    nsections = int(sys.argv[1]) if 1 < len(sys.argv) else 2000
+    npasses = int(sys.argv[2]) if 2 < len(sys.argv) else 5
+    testDef = setup(nsections)
+    executor = testDef.selectPlugin("Sequential executor", "tool")
+    if executor is None:
+        print("Sequential executor plugin not found")
+        sys.exit(1)
+
+    start = time.time()
+    for n in range(npasses):
+        rescan(executor, testDef)
+    before = (time.time() - start) / npasses
+
+    start = time.time()
+    plan = executor.compilePlan(testDef)
+    compile_time = time.time() - start
+    start = time.time()
+    for n in range(npasses):
+        walk(executor, testDef, plan)
+    after = (time.time() - start) / npasses
+
+    print("sections:", nsections, "passes:", npasses)
+    print("rescan per pass:  %8.2f ms" % (before * 1000.0))
+    print("plan compile:     %8.2f ms (once)" % (compile_time * 1000.0))
+    print("plan per pass:    %8.2f ms" % (after * 1000.0))
+    if 0 < after:
+        print("speedup per pass: %8.1fx" % (before / after))
+
+if __name__ == "__main__":
+    main()